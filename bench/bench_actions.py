@@ -0,0 +1,21 @@
+import argparse
+
+from dancer.libfun import create_actions
+from tests.test_actions import create_actions_loop
+from .common import synthetic_data, timeit
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark action generation")
+	parser.add_argument("--minutes", type=float, default=120)
+	args = parser.parse_args()
+
+	data = synthetic_data(minutes=args.minutes)
+	print(f"Beats: {len(data['beats'])}")
+	for overflow in range(3):
+		params = dict(energy_multiplier=4, pitch_range=100, overflow=overflow)
+		old = timeit(lambda: create_actions_loop(data, **params), repeat=3)
+		new = timeit(lambda: create_actions(data, **params), repeat=3)
+		print(f"overflow={overflow}: loop {old*1000:.1f} ms, vectorized {new*1000:.1f} ms ({old/new:.1f}x)")
+
+if __name__ == "__main__":
+	main()
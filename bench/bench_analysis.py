@@ -0,0 +1,50 @@
+import argparse
+import tempfile
+from pathlib import Path
+
+import librosa
+import numpy as np
+
+from dancer.libfun import AnalysisPipeline, decode_audio
+from .common import write_click_track, timeit
+
+def analyze_reference(y, sr, hop_length=1024, frame_length=1024, plp=True):
+	# The previous code: every librosa stage computes its own spectrogram
+	onset = None
+	if (plp):
+		onset = librosa.beat.plp(y=y, sr=sr, hop_length=hop_length).T
+	_, beats = librosa.beat.beat_track(y=y, sr=sr, onset_envelope=onset, hop_length=hop_length, trim=False, units="time")
+	rms = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
+	pitches, magnitudes = librosa.piptrack(y=y, sr=sr, hop_length=hop_length, center=True)
+	pitches = np.fmax(0.01, pitches)
+	magnitudes = np.fmax(0.01, magnitudes)
+	return beats, rms, np.sum(pitches * magnitudes, axis=0) / np.sum(magnitudes, axis=0)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the shared-STFT analysis pipeline")
+	parser.add_argument("--minutes", type=float, default=10)
+	parser.add_argument("--no_plp", action="store_true")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as d:
+		y, sr = decode_audio(write_click_track(Path(d, "input.wav"), minutes=args.minutes))
+
+	plp = not args.no_plp
+	expected = analyze_reference(y, sr, plp=plp)
+	_, *actual = AnalysisPipeline(sr, plp=plp).run(y)
+	for name, a, b in zip(("beats", "rms", "pitch"), expected, actual):
+		if not np.array_equal(a, b):
+			raise AssertionError(f"{name} differs from the reference")
+	print("Parity: ok")
+
+	old = timeit(lambda: analyze_reference(y, sr, plp=plp), repeat=2)
+	new = timeit(lambda: AnalysisPipeline(sr, plp=plp).run(y), repeat=2)
+	print(f"reference {old:.2f} s, pipeline {new:.2f} s ({old/new:.2f}x)")
+
+	pipeline = AnalysisPipeline(sr, plp=plp)
+	pipeline.run(y)
+	for name, elapsed in pipeline.timings.items():
+		print(f"  {name}: {elapsed:.2f} s")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,52 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dancer.libfun import create_actions_array, load_audio_data
+from .common import write_click_track
+
+def beat_report(reference, beats):
+	# Distance from every reference beat to the nearest decimated beat
+	idx = np.clip(np.searchsorted(beats, reference), 1, len(beats) - 1)
+	nearest = np.minimum(np.abs(beats[idx - 1] - reference), np.abs(beats[idx] - reference))
+	return nearest.mean() * 1000, nearest.max() * 1000, np.mean(nearest < 0.025) * 100
+
+def action_report(reference, actions):
+	# Positions of the decimated script sampled at the reference action times
+	pos = np.interp(reference["at"], actions["at"], actions["pos"])
+	return np.abs(pos - reference["pos"]).mean(), np.abs(pos - reference["pos"]).max()
+
+def main():
+	parser = argparse.ArgumentParser(description="Accuracy and speed of decimated-rate analysis")
+	parser.add_argument("--minutes", type=float, default=5)
+	parser.add_argument("--rates", type=int, nargs="+", default=[24000, 22050, 16000, 11025])
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as d:
+		src = write_click_track(Path(d, "input.wav"), minutes=args.minutes, sr=44100)
+
+		load_audio_data(src, analysis_sr=args.rates[-1])
+		start = time.perf_counter()
+		full = load_audio_data(src)
+		full_time = time.perf_counter() - start
+		full_actions = create_actions_array(full, energy_multiplier=4)
+		print(f"native 44100 Hz: {full_time:.2f} s, {len(full['beats'])} beats")
+
+		for sr in args.rates:
+			start = time.perf_counter()
+			data = load_audio_data(src, analysis_sr=sr)
+			elapsed = time.perf_counter() - start
+
+			mean_ms, max_ms, within = beat_report(full["beats"], data["beats"])
+			mean_pos, max_pos = action_report(full_actions, create_actions_array(data, energy_multiplier=4))
+			print(
+				f"{sr} Hz: {elapsed:.2f} s ({full_time/elapsed:.1f}x), {len(data['beats'])} beats, "
+				f"beat offset mean {mean_ms:.1f} ms max {max_ms:.1f} ms ({within:.0f}% within 25 ms), "
+				f"action pos error mean {mean_pos:.2f} max {max_pos:.1f}"
+			)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,59 @@
+import argparse
+import contextlib
+import io
+
+import numpy as np
+from scipy.optimize import minimize
+
+from dancer.libfun import AutomapModel, autoval, create_actions, _speed
+from .common import synthetic_data, timeit
+
+def autoval_reference(data, tpi=15, target_speed=300, v2above=0.6, opt=1):
+	# The original implementation, rebuilding the actions for every evaluation
+	def cmean(pitch):
+		result = create_actions(data, energy_multiplier=0, center_offset=pitch)
+		_,Y = map(list, zip(*result))
+		return np.average(Y)
+
+	pres = minimize(lambda p: abs(cmean(p) - tpi), (100,), method="Nelder-Mead", bounds=((-200,200),))
+	pres = pres.x[0]
+
+	def speeds(energy):
+		result = create_actions(data, energy_multiplier=energy, pitch_range=pres)
+		return result, np.array([_speed(result[i],result[i+1],smax=1.0) for i in range(len(result)-1)], dtype=np.float32)
+
+	def cemean(energy):
+		_, s = speeds(energy)
+		return abs(np.average(s) - target_speed)
+
+	def cemeanv2(energy):
+		_, s = speeds(energy)
+		return abs(np.sum(s > target_speed) / len(s) - v2above)
+
+	def celen(energy):
+		result = create_actions(data, energy_multiplier=energy, pitch_range=pres)
+		return abs(np.mean([abs(result[i][1] - result[i+1][1])/100 for i in range(len(result) - 1)], dtype=np.float64) - v2above)
+
+	optimizers = [cemean, cemeanv2, celen]
+	eres = minimize(optimizers[opt], (10,), method="Nelder-Mead", bounds=((0,100),), options={'xatol': 1e-10})
+	return pres, eres.x[0]
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark automapping")
+	parser.add_argument("--minutes", type=float, default=30)
+	args = parser.parse_args()
+
+	data = synthetic_data(minutes=args.minutes)
+	print(f"Beats: {len(data['beats'])}")
+	for opt, name in enumerate(AutomapModel.optimizers):
+		with contextlib.redirect_stdout(io.StringIO()):
+			expected = autoval_reference(data, opt=opt)
+			actual = autoval(data, opt=opt)
+			old = timeit(lambda: autoval_reference(data, opt=opt), repeat=1)
+			new = timeit(lambda: autoval(data, opt=opt), repeat=3)
+		if not np.allclose(expected, actual):
+			raise AssertionError(f"{name}: {expected} != {actual}")
+		print(f"{name}: reference {old*1000:.0f} ms, model {new*1000:.1f} ms ({old/new:.0f}x)")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,44 @@
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from dancer.libfun import decode_audio
+from dancer.util import ffmpeg_read
+from .common import write_click_track, run_isolated
+
+def wav_roundtrip(path, tmp):
+	# The previous --convert path: write a 48 kHz wav, read it back
+	subprocess.check_call(["ffmpeg", "-y", "-v", "error", "-i", str(path), "-map", "0:a", "-ar", "48000", str(tmp)])
+	return decode_audio(tmp)
+
+def pipe(path):
+	return ffmpeg_read(path)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark ffmpeg wav round-trip against piping")
+	parser.add_argument("--minutes", type=float, default=30)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as d:
+		src = write_click_track(Path(d, "input.wav"), minutes=args.minutes)
+
+		results = []
+		for name, fun, fargs in (
+			("wav round-trip", wav_roundtrip, (src, Path(d, "roundtrip.wav"))),
+			("pipe", pipe, (src,)),
+		):
+			results.append((name, *run_isolated(fun, *fargs)))
+
+		y_wav, _ = wav_roundtrip(src, Path(d, "roundtrip.wav"))
+		y_pipe, _ = pipe(src)
+		n = min(len(y_wav), len(y_pipe))
+		print(f"Samples: {len(y_wav)} (wav) / {len(y_pipe)} (pipe), RMS {np.sqrt(np.mean(y_wav[:n]**2)):.4f} / {np.sqrt(np.mean(y_pipe[:n]**2)):.4f}")
+
+		for name, elapsed, rss, base in results:
+			print(f"{name}: {elapsed:.2f} s, peak RSS {rss:.0f} MiB (after imports {base:.0f} MiB)")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,91 @@
+import argparse
+import io
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dancer.libfun import RenderPipeline, load_audio_data
+from dancer.export import dump_funscript
+from dancer.cache import AnalysisCache
+from dancer.worker import Engine, Stale
+from dancer.jit import configure_numba_cache
+from .common import write_click_track
+
+def frame_times(work, tick=0.015):
+	# What a Tk loop polling every 15 ms sees while work runs on a thread: the
+	# time between ticks, each tick doing a little Python like a redraw would
+	thread = threading.Thread(target=work)
+	thread.start()
+	times, last = [], time.perf_counter()
+	while thread.is_alive():
+		time.sleep(tick)
+		sum(range(2000))
+		now = time.perf_counter()
+		times.append(now - last)
+		last = now
+	thread.join()
+	return np.array(times)
+
+def report(name, times, elapsed):
+	p50, p99 = np.percentile(times, (50, 99)) * 1000
+	print(f"{name:8} load {elapsed:6.2f} s  frame p50 {p50:5.1f} ms  p99 {p99:6.1f} ms  max {times.max()*1000:6.1f} ms  over 50 ms: {np.mean(times > 0.05)*100:4.1f}%")
+
+def written(actions):
+	f = io.StringIO()
+	dump_funscript(f, actions)
+	return f.getvalue()
+
+def check_parity(engine, path, cache):
+	# Mapped results equal an in-process run, for fresh and cached analyses
+	expected = load_audio_data(path)
+	params = (2.5, 80, 1, 0, 0)
+	pipeline = RenderPipeline(expected)
+	for c in (None, cache, cache):
+		data = engine.load(path, cache=c)
+		for k in ("beats", "pitch", "energy"):
+			if not np.array_equal(np.asarray(data[k]), expected[k]):
+				raise AssertionError(f"{k} differs")
+		for simplify in (None, {"tolerance": 2.0, "min_interval": 0.05, "max_speed": 0}):
+			result, speeds, removed, _ = engine.render(data, params, simplify)
+			if written(result) != written(pipeline.simplified(*params, simplify=simplify)):
+				raise AssertionError("Rendered actions differ")
+			if not np.array_equal(speeds, pipeline.speeds(*params, simplify=simplify)):
+				raise AssertionError("Speeds differ")
+
+	try:
+		engine.render(dict(data), params)
+		raise AssertionError("Rendered stale data")
+	except Stale:
+		pass
+
+def main():
+	parser = argparse.ArgumentParser(description="UI frame times while a file loads on a thread or in the engine process")
+	parser.add_argument("--minutes", type=float, default=5)
+	parser.add_argument("--cold", action="store_true", help="Start from an empty numba cache, so both loads also compile the kernels")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		if args.cold:
+			configure_numba_cache(Path(tmp, "numba"))
+		path = write_click_track(Path(tmp, "input.wav"), minutes=args.minutes)
+		engine = Engine(warm_up=False)
+		try:
+			engine.start()
+			for name, work in (
+				("thread", lambda: load_audio_data(path)),
+				("process", lambda: engine.load(path)),
+			):
+				start = time.perf_counter()
+				times = frame_times(work)
+				report(name, times, time.perf_counter() - start)
+
+			check_parity(engine, path, AnalysisCache(Path(tmp, "cache")))
+			print("Parity: ok")
+		finally:
+			engine.close()
+
+if __name__ == "__main__":
+	main()
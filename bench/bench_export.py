@@ -0,0 +1,30 @@
+import argparse
+import gzip
+
+from dancer.libfun import create_actions, create_actions_array
+from dancer.export import dump_csv, dump_funscript
+from tests.test_export import dump_csv_loop, dump_funscript_loop, written
+from .common import synthetic_data, timeit
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark funscript/CSV export")
+	parser.add_argument("--minutes", type=float, default=120)
+	args = parser.parse_args()
+
+	data = synthetic_data(args.minutes)
+	actions = create_actions(data, energy_multiplier=2.5, pitch_range=80, overflow=1)
+	array = create_actions_array(data, energy_multiplier=2.5, pitch_range=80, overflow=1)
+	print(f"Actions: {len(array)}")
+
+	for name, old, new in (("funscript", dump_funscript_loop, dump_funscript), ("csv", dump_csv_loop, dump_csv)):
+		t_old = timeit(lambda: written(old, actions), repeat=3)
+		t_new = timeit(lambda: written(new, array), repeat=3)
+		print(f"{name:10} loop {t_old*1000:6.0f} ms, streaming {t_new*1000:6.0f} ms ({t_old/t_new:.1f}x)")
+
+	plain = written(dump_funscript, array)
+	dropped = written(dump_funscript, array, drop_collinear=True)
+	packed = gzip.compress(plain.encode())
+	print(f"funscript {len(plain)/1024:.0f} KiB, collinear dropped {len(dropped)/1024:.0f} KiB, gzip {len(packed)/1024:.0f} KiB")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from dancer.libfun import HEATMAP, create_actions, render_heatmap, speed
+from dancer.heatmap import heatmap_lut, save_png
+from .common import synthetic_data, timeit
+
+def heatmap_figure(data, energy, pitch, oor, w=4096, h=128):
+	# The original renderer: speeds per action index, drawn through imshow
+	import matplotlib as mpl
+	from matplotlib.figure import Figure
+
+	result = create_actions(data, energy_multiplier=energy, pitch_range=pitch, overflow=oor)
+	speeds = np.array([speed(result[i],result[i+1]) for i in range(len(result)-1)])
+	gradient = np.vstack([speeds]*h)
+
+	dpi = mpl.rcParams["figure.dpi"]
+	fig = Figure(figsize=(w/dpi, h/dpi), tight_layout=True)
+	plot = fig.add_subplot(111)
+	plot.imshow(gradient, cmap=HEATMAP, interpolation="lanczos")
+	plot.axis("off")
+	return fig
+
+def check_lut():
+	expected = HEATMAP(np.arange(HEATMAP.N), bytes=True)[:, :3]
+	if not np.array_equal(heatmap_lut(HEATMAP.N), expected):
+		raise AssertionError("heatmap_lut differs from HEATMAP")
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark heatmap rendering")
+	parser.add_argument("--minutes", type=float, default=60)
+	parser.add_argument("-W", "--width", type=int, default=4096)
+	parser.add_argument("-H", "--height", type=int, default=128)
+	args = parser.parse_args()
+
+	check_lut()
+	print("LUT parity: ok")
+
+	data = synthetic_data(args.minutes)
+	with tempfile.TemporaryDirectory() as tmp:
+		old_path = os.path.join(tmp, "old.png")
+		new_path = os.path.join(tmp, "new.png")
+
+		old = timeit(lambda: heatmap_figure(data, 2.0, 80, 0, args.width, args.height).savefig(old_path, bbox_inches="tight", pad_inches=0), repeat=1)
+		new = timeit(lambda: save_png(new_path, render_heatmap(data, 2.0, 80, 0, w=args.width, h=args.height)))
+
+		print(f"Beats: {len(data['beats'])}, image: {args.width}x{args.height}")
+		print(f"matplotlib {old*1000:.0f} ms ({os.path.getsize(old_path)/1024:.0f} KiB)")
+		print(f"numpy      {new*1000:.1f} ms ({os.path.getsize(new_path)/1024:.0f} KiB, {old/new:.0f}x)")
+
+if __name__ == "__main__":
+	main()
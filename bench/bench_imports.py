@@ -0,0 +1,61 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules a CLI run must not load before it actually analyses something
+HEAVY = ["tkinter", "matplotlib", "matplotlib.pyplot", "librosa", "scipy", "numba"]
+
+SCENARIOS = {
+	"import": "import dancer",
+	"cli": "import dancer.cli",
+	"help": "import sys; sys.argv = ['dancer', '--cli', '-h']; import dancer; dancer.main()",
+}
+
+def importtime(code):
+	# Cumulative microseconds per module from -X importtime, and the total of
+	# the top level entries (nested imports are indented)
+	env = dict(os.environ, PYTHONPATH=os.getcwd() + os.pathsep + os.environ.get("PYTHONPATH", ""))
+	proc = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", code],
+		capture_output=True, text=True, env=env
+	)
+
+	modules, total = {}, 0
+	for line in proc.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			continue
+		_, cumulative, name = line[len("import time:"):].split("|")
+		if not cumulative.strip().isdigit():
+			continue
+		modules[name.strip()] = int(cumulative)
+		if len(name) - len(name.lstrip()) == 1:
+			total += int(cumulative)
+	return modules, total / 1000
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark import time of the CLI path")
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--budget", type=float, default=None, metavar="MS", help="Fail when a scenario takes longer")
+	parser.add_argument("--top", type=int, default=5)
+	args = parser.parse_args()
+
+	failed = False
+	for name, code in SCENARIOS.items():
+		best, total = min((importtime(code) for _ in range(args.repeat)), key=lambda run: run[1])
+
+		heavy = [m for m in HEAVY if m in best]
+		print(f"{name:8} {total:7.1f} ms  heavy: {', '.join(heavy) or 'none'}")
+		for module, us in sorted(best.items(), key=lambda kv: -kv[1])[:args.top]:
+			print(f"         {us/1000:7.1f} ms  {module}")
+
+		if heavy:
+			failed = True
+		if args.budget is not None and total > args.budget:
+			print(f"         over budget ({args.budget:.0f} ms)")
+			failed = True
+
+	sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from .common import write_click_track
+
+# One fresh process: import, first load_audio_data (compiles or loads the
+# numba kernels) and a second one that runs fully warm
+CODE = """
+import json, sys, time, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+from dancer.jit import configure_numba_cache
+configure_numba_cache(sys.argv[2])
+import librosa
+imported = time.perf_counter()
+from dancer.libfun import load_audio_data
+load_audio_data(sys.argv[1])
+first = time.perf_counter()
+load_audio_data(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({"import": imported - start, "first": first - imported, "second": second - first}))
+"""
+
+def run(path, numba_dir):
+	env = dict(os.environ, PYTHONPATH=os.getcwd() + os.pathsep + os.environ.get("PYTHONPATH", ""))
+	proc = subprocess.run([sys.executable, "-c", CODE, str(path), str(numba_dir)], capture_output=True, text=True, env=env, check=True)
+	return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+	parser = argparse.ArgumentParser(description="Cold versus warm numba cache for load_audio_data on a short clip")
+	parser.add_argument("--seconds", type=float, default=30)
+	parser.add_argument("--runs", type=int, default=3, help="Warm starts to time, the best counts")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = write_click_track(Path(tmp, "clip.wav"), minutes=args.seconds / 60)
+		numba_dir = Path(tmp, "numba")
+
+		cold = run(path, numba_dir)
+		files = len(list(numba_dir.rglob("*.nbc")))
+		warm = min((run(path, numba_dir) for _ in range(args.runs)), key=lambda r: r["first"])
+
+	print(f"Kernels cached: {files} files")
+	print(f"{'':12} {'import':>8} {'first':>8} {'second':>8}")
+	for name, r in (("cold start", cold), ("warm start", warm)):
+		print(f"{name:12} {r['import']*1000:6.0f}ms {r['first']*1000:6.0f}ms {r['second']*1000:6.0f}ms")
+	print(f"First analysis {cold['first']/warm['first']:.1f}x faster with a warm cache")
+
+if __name__ == "__main__":
+	main()
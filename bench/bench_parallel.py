@@ -0,0 +1,54 @@
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from dancer.libfun import AnalysisPipeline, decode_audio
+from .common import write_click_track, timeit
+
+def run_blocks(pipeline, y, block_frames):
+	# run_stream over y cut into decoder sized blocks
+	return pipeline.run_stream((y[i:i+4096] for i in range(0, len(y), 4096)), block_frames)
+
+def check_parity(y, sr, jobs, plp):
+	# Chunked features are the streamed ones exactly and the full-file ones up
+	# to float rounding, beats come out the same
+	full = AnalysisPipeline(sr, plp=plp).run(y)
+	streamed = run_blocks(AnalysisPipeline(sr, plp=plp), y, 512)
+	for n in jobs:
+		parallel = AnalysisPipeline(sr, plp=plp).run_parallel(y, n)
+		if parallel[0] != full[0] or not np.array_equal(parallel[1], full[1]):
+			raise AssertionError(f"Beats differ with {n} jobs")
+		for name, a, b, c in zip(("rms", "pitch"), parallel[2:], streamed[2:], full[2:]):
+			if not np.array_equal(a, b):
+				raise AssertionError(f"{name} differs from the streamed features with {n} jobs")
+			if a.shape != c.shape or not np.allclose(a, c, rtol=1e-5, atol=1e-7):
+				raise AssertionError(f"{name} differs from the full-file features with {n} jobs")
+
+def main():
+	parser = argparse.ArgumentParser(description="Scaling of the parallel frame features over cores")
+	parser.add_argument("--minutes", type=float, default=10)
+	parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+	parser.add_argument("--repeat", type=int, default=2)
+	parser.add_argument("--no_plp", action="store_true")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as d:
+		y, sr = decode_audio(write_click_track(Path(d, "input.wav"), minutes=args.minutes))
+
+	plp = not args.no_plp
+	check_parity(y[:sr * 60], sr, [n for n in args.jobs if n > 1] or [2], plp)
+	print("Parity: ok")
+
+	print(f"{os.cpu_count()} cores, {args.minutes:g} min of audio")
+	serial = timeit(lambda: AnalysisPipeline(sr, plp=plp).run(y), repeat=args.repeat)
+	print(f"{'run':>10} {serial:7.2f} s")
+	for n in args.jobs:
+		pipeline = AnalysisPipeline(sr, plp=plp)
+		elapsed = timeit(lambda: pipeline.run_parallel(y, n), repeat=args.repeat)
+		print(f"{n:>4} jobs {elapsed:7.2f} s  {serial/elapsed:5.2f}x  (features {pipeline.timings['features'] / args.repeat:.2f} s per run)")
+
+if __name__ == "__main__":
+	main()
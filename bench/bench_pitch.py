@@ -0,0 +1,42 @@
+import argparse
+import tempfile
+from pathlib import Path
+
+import librosa
+import numpy as np
+
+from dancer.libfun import PITCH_METHODS, AnalysisPipeline, decode_audio
+from .common import write_click_track, measure
+
+def features_reference(y, sr, hop_length=1024, frame_length=1024):
+	# The previous code: separate RMS pass, piptrack from y, copying fmax
+	rms = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
+	pitches, magnitudes = librosa.piptrack(y=y, sr=sr, hop_length=hop_length, center=True)
+	pitches = np.fmax(0.01, pitches)
+	magnitudes = np.fmax(0.01, magnitudes)
+	return rms, np.sum(pitches * magnitudes, axis=0) / np.sum(magnitudes, axis=0)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the pitch backends")
+	parser.add_argument("--minutes", type=float, default=10)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as d:
+		y, sr = decode_audio(write_click_track(Path(d, "input.wav"), minutes=args.minutes))
+
+	print(f"Samples: {len(y)} at {sr} Hz")
+	expected = features_reference(y, sr)
+	elapsed, peak = measure(lambda: features_reference(y, sr))
+	print(f"reference: {elapsed:.2f} s, peak {peak:.0f} MiB")
+
+	for method in PITCH_METHODS:
+		pipeline = AnalysisPipeline(sr, pitch_method=method)
+		features = lambda: pipeline.frame_features(pipeline.spectrum(y) if method == "centroid" else None, y, y)
+		rms, pitches = features()
+		if method == "piptrack" and not (np.allclose(rms, expected[0]) and np.allclose(pitches, expected[1])):
+			raise AssertionError("piptrack backend changed its output")
+		elapsed, peak = measure(features)
+		print(f"{method}: {elapsed:.2f} s, peak {peak:.0f} MiB")
+
+if __name__ == "__main__":
+	main()
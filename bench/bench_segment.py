@@ -0,0 +1,74 @@
+import argparse
+
+import numpy as np
+
+from dancer.libfun import beat_reduce, beat_segments
+from .common import timeit
+
+def segment_loop(values, frames, beats, end=-1):
+	# The original per-frame walk. end=-1 reproduces it exactly, which drops
+	# the last frame; end=len(frames) is the behaviour beat_reduce implements.
+	last = 0
+	splits = [0]
+	for k,v in enumerate(frames):
+		if last >= len(beats):
+			break
+		if v > beats[last]:
+			if (last > 0):
+				splits.append(k)
+			last += 1
+	splits.append(end)
+
+	return [np.sum(values[splits[i-1]:splits[i]]) for i in range(len(beats))]
+
+def synthetic_frames(n_frames, hop=1024 / 48000, seed=0, truncate=False):
+	rng = np.random.default_rng(seed)
+	frames = np.arange(n_frames) * hop
+	beats = np.cumsum(rng.uniform(0.2, 0.7, n_frames))
+	beats = beats[beats < frames[-1] + (hop if truncate else -hop)]
+	# A few beats closer together than a hop
+	beats = np.sort(np.concatenate((beats, beats[::17] + hop / 3)))
+	values = rng.uniform(0, 1, n_frames).astype(np.float32)
+	return values, frames, beats
+
+def check_parity():
+	for seed in range(10):
+		values, frames, beats = synthetic_frames(5000, seed=seed)
+		expected = segment_loop(values, frames, beats)
+		if not np.allclose(expected, beat_reduce(values, frames, beats), rtol=1e-5):
+			raise AssertionError(f"Mismatch with the original segmentation (seed {seed})")
+
+		# A final beat past the last frame: only the dropped frame differs
+		values, frames, beats = synthetic_frames(5000, seed=seed, truncate=True)
+		beats = np.append(beats, frames[-1] + 0.1)
+		expected = segment_loop(values, frames, beats, end=len(frames))
+		actual = beat_reduce(values, frames, beats)
+		if not np.allclose(expected, actual, rtol=1e-5):
+			raise AssertionError(f"Mismatch with the fixed segmentation (seed {seed})")
+		legacy = segment_loop(values, frames, beats)
+		if not np.isclose(actual[-1] - legacy[-1], values[-1], rtol=1e-4):
+			raise AssertionError("Last frame not accounted for")
+
+	values, frames, beats = synthetic_frames(1000)
+	starts, ends = beat_segments(frames, beats)
+	for how, fun in (("mean", np.mean), ("max", np.max)):
+		expected = [fun(values[a:b]) if b > a else 0 for a, b in zip(starts, ends)]
+		if not np.allclose(expected, beat_reduce(values, frames, beats, how=how), rtol=1e-5):
+			raise AssertionError(f"Mismatch for how={how}")
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark beat segmentation")
+	parser.add_argument("--minutes", type=float, default=120)
+	args = parser.parse_args()
+
+	check_parity()
+	print("Parity: ok")
+
+	values, frames, beats = synthetic_frames(int(args.minutes * 60 * 48000 / 1024))
+	print(f"Frames: {len(frames)}, beats: {len(beats)}")
+	old = timeit(lambda: segment_loop(values, frames, beats), repeat=1)
+	new = timeit(lambda: beat_reduce(values, frames, beats))
+	print(f"loop {old*1000:.0f} ms, reduceat {new*1000:.2f} ms ({old/new:.0f}x)")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,182 @@
+import argparse
+import http.client
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dancer.libfun import create_actions_array, load_audio_data
+from dancer.export import dump_funscript
+from dancer.serve import Service, make_server, serve_args
+from .common import write_click_track
+
+class UnixConnection(http.client.HTTPConnection):
+	def __init__(self, path, timeout=None):
+		super().__init__("localhost", timeout=timeout)
+		self.socket_path = path
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(self.socket_path)
+
+def request(connect, method, path, body=None):
+	conn = connect()
+	try:
+		conn.request(method, path, body=json.dumps(body) if body is not None else None, headers={"Content-Type": "application/json"})
+		response = conn.getresponse()
+		return response.status, response.read().decode()
+	finally:
+		conn.close()
+
+def running(service, **kwargs):
+	# Server on a free port (or a socket) in a background thread
+	server = make_server(service, port=0, quiet=True, **kwargs)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	if kwargs.get("socket_path"):
+		connect = lambda: UnixConnection(kwargs["socket_path"])
+	else:
+		connect = lambda: http.client.HTTPConnection(*server.server_address)
+	return server, connect
+
+def cache_args(tmp):
+	return serve_args().parse_args(["--cache_dir", str(Path(tmp, "cache"))])
+
+def expected(path, params):
+	data = load_audio_data(path)
+	f = io.StringIO()
+	dump_funscript(f, create_actions_array(data, energy_multiplier=params.get("energy", 10), pitch_range=params.get("pitch", 100), overflow=params.get("overflow", 0)))
+	return f.getvalue()
+
+def timed(fun):
+	start = time.perf_counter()
+	result = fun()
+	return result, time.perf_counter() - start
+
+def check_limits(tmp, files):
+	# One worker and one queued job, the rest of a burst is turned away
+	service = Service(jobs=1, queue_size=1, cache_args=cache_args(tmp), warm_up=False)
+	server, connect = running(service)
+	try:
+		service.start()
+		with ThreadPoolExecutor(len(files)) as pool:
+			statuses = list(pool.map(lambda f: request(connect, "POST", "/funscript", {"path": str(f), "no_plp": True})[0], files))
+		if statuses.count(200) < 1 or statuses.count(503) < 1 or set(statuses) - {200, 503}:
+			raise AssertionError(f"Queue bound not enforced: {statuses}")
+
+		status, _ = request(connect, "POST", "/funscript", {"path": str(files[0]), "pitch_method": "centroid", "timeout": 0.01})
+		if status != 504:
+			raise AssertionError(f"Timeout not enforced: {status}")
+
+		for body, code in (({"path": "/nonexistent.wav"}, 404), ({"path": str(files[0]), "bogus": 1}, 400), ({"nope": 1}, 400)):
+			if request(connect, "POST", "/funscript", body)[0] != code:
+				raise AssertionError(f"Expected {code} for {body}")
+		return statuses, json.loads(request(connect, "GET", "/status")[1])
+	finally:
+		server.shutdown()
+		server.server_close()
+		service.close()
+
+def check_recovery(tmp, files):
+	# Hung and dead workers are replaced and the service keeps answering
+	service = Service(jobs=1, queue_size=1, cache_args=cache_args(tmp), warm_up=False)
+	server, connect = running(service)
+	try:
+		service.start()
+		long_file = write_click_track(Path(tmp, "long.wav"), minutes=10)
+		status, _ = request(connect, "POST", "/funscript", {"path": str(long_file), "timeout": 0.5})
+		if status != 504 or service.counts["restarts"] != 1:
+			raise AssertionError(f"Overrunning job not killed: {status}, {service.counts}")
+		if request(connect, "POST", "/funscript", {"path": str(files[0])})[0] != 200:
+			raise AssertionError("No answer after a timed out job")
+
+		# Killed while idle, then while running a job
+		for pid in (w.process.pid for w in list(service._workers)):
+			os.kill(pid, signal.SIGKILL)
+		time.sleep(0.2)
+		if request(connect, "POST", "/funscript", {"path": str(files[1])})[0] != 200:
+			raise AssertionError("No answer after a worker was killed")
+
+		def kill_soon():
+			time.sleep(0.5)
+			for w in list(service._workers):
+				os.kill(w.process.pid, signal.SIGKILL)
+		threading.Thread(target=kill_soon).start()
+		status, _ = request(connect, "POST", "/funscript", {"path": str(long_file), "no_plp": True})
+		if status != 500:
+			raise AssertionError(f"Expected 500 from a killed job, got {status}")
+		if request(connect, "POST", "/funscript", {"path": str(files[2])})[0] != 200:
+			raise AssertionError("No answer after a job's worker was killed")
+		return service.counts["restarts"]
+	finally:
+		server.shutdown()
+		server.server_close()
+		service.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the serve daemon against one CLI process per request")
+	parser.add_argument("--minutes", type=float, default=1)
+	parser.add_argument("--requests", type=int, default=5)
+	parser.add_argument("--jobs", type=int, default=2)
+	parser.add_argument("--no_cli", action="store_true", help="Skip timing the CLI")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		files = [write_click_track(Path(tmp, f"{i}.wav"), minutes=args.minutes, bpm=120 + i) for i in range(4)]
+
+		service = Service(jobs=args.jobs, cache_args=cache_args(tmp))
+		_, t_start = timed(service.start)
+		print(f"Workers up and warm in {t_start:.2f} s")
+
+		sock = str(Path(tmp, "dancer.sock"))
+		server, connect = running(service)
+		unix, unix_connect = running(service, socket_path=sock)
+		try:
+			body = {"path": str(files[0]), "energy": 20, "pitch": 80, "overflow": 1}
+			(status, cold), t_cold = timed(lambda: request(connect, "POST", "/funscript", body))
+			if status != 200 or cold != expected(files[0], body):
+				raise AssertionError(f"Served funscript differs ({status})")
+
+			warm = []
+			for i in range(args.requests):
+				(status, text), t = timed(lambda: request(connect, "POST", "/funscript", dict(body, energy=10 + i)))
+				if status != 200 or text != expected(files[0], dict(body, energy=10 + i)):
+					raise AssertionError("Served funscript differs")
+				warm.append(t)
+
+			status, text = request(unix_connect, "POST", "/funscript", body)
+			if status != 200 or text != cold:
+				raise AssertionError("Unix socket funscript differs")
+
+			print(f"First request  {t_cold*1000:8.0f} ms")
+			print(f"Repeat request {min(warm)*1000:8.0f} ms (best of {len(warm)})")
+			print(f"Status: {request(connect, 'GET', '/status')[1]}")
+		finally:
+			for s in (server, unix):
+				s.shutdown()
+				s.server_close()
+			service.close()
+
+		if not args.no_cli:
+			out = Path(tmp, "cli.funscript")
+			_, t_cli = timed(lambda: subprocess.run(
+				[sys.executable, "-m", "dancer", "--cli", str(files[0]), "--out_path", str(out), "-y", "--no_cache", "--energy", "20", "--pitch", "80", "--overflow", "1"],
+				check=True, capture_output=True
+			))
+			print(f"CLI process    {t_cli*1000:8.0f} ms (uncached, includes startup and JIT)")
+
+		statuses, status = check_limits(tmp, files)
+		print(f"Limits: ok, burst answered {statuses}")
+
+		restarts = check_recovery(tmp, files)
+		print(f"Recovery: ok, {restarts} workers replaced")
+
+if __name__ == "__main__":
+	main()
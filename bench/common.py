@@ -0,0 +1,113 @@
+import time
+import numpy as np
+
+def synthetic_data(minutes=1, bpm=128, seed=0):
+	rng = np.random.default_rng(seed)
+	n = int(minutes * bpm)
+	beats = np.cumsum(rng.uniform(0.7, 1.3, n) * 60.0 / bpm)
+	return {
+		"at": float(beats[-1]) if n > 0 else 0.0,
+		"beats": beats,
+		"pitch": np.log10(rng.uniform(1, 1000, n)).astype(np.float32),
+		"energy": rng.uniform(0.01, 10, n).astype(np.float32),
+	}
+
+def timeit(fun, repeat=5):
+	best = float("inf")
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fun()
+		best = min(best, time.perf_counter() - start)
+	return best
+
+def write_click_track(path, minutes=1, sr=44100, bpm=128, channels=2, seed=0):
+	# Tone sweep with decaying noise clicks on every beat, written in blocks
+	import wave
+
+	rng = np.random.default_rng(seed)
+	total = int(minutes * 60 * sr)
+	beat = int(sr * 60 / bpm)
+	click = rng.standard_normal(int(0.05 * sr)) * np.exp(-np.arange(int(0.05 * sr)) / (sr / 50))
+
+	with wave.open(str(path), "wb") as w:
+		w.setnchannels(channels)
+		w.setsampwidth(2)
+		w.setframerate(sr)
+		for start in range(0, total, beat * 64):
+			t = np.arange(start, min(total, start + beat * 64)) / sr
+			y = 0.2 * np.sin(2 * np.pi * (220 + 100 * np.sin(t / 5)) * t)
+			for b in range(-(start % beat) % beat, len(t), beat):
+				n = min(len(click), len(t) - b)
+				y[b:b+n] += click[:n] * (0.5 + 0.4 * np.sin(t[b]))
+			pcm = (np.clip(y, -1, 1) * 32767).astype("<i2")
+			w.writeframes(np.repeat(pcm[:, None], channels, axis=1).tobytes())
+	return path
+
+def write_tone_track(path, minutes=1, sr=44100, bpm=128, channels=2, seed=0):
+	# Plucked sine notes, one per beat from a random melody, and no noise.
+	# Onsets are softer than clicks and the pitch actually moves.
+	import wave
+
+	rng = np.random.default_rng(seed)
+	total = int(minutes * 60 * sr)
+	beat = 60 / bpm
+	melody = 220 * 2 ** (rng.integers(0, 24, 64) / 12)
+	block = sr * 30
+
+	with wave.open(str(path), "wb") as w:
+		w.setnchannels(channels)
+		w.setsampwidth(2)
+		w.setframerate(sr)
+		for start in range(0, total, block):
+			t = np.arange(start, min(total, start + block)) / sr
+			note, phase = np.divmod(t / beat, 1)
+			freq = melody[note.astype(np.int64) % len(melody)]
+			y = 0.4 * np.sin(2 * np.pi * freq * phase * beat) * np.exp(-phase * 4) * (1 - np.exp(-phase * 200))
+			pcm = (np.clip(y, -1, 1) * 32767).astype("<i2")
+			w.writeframes(np.repeat(pcm[:, None], channels, axis=1).tobytes())
+	return path
+
+def peak_rss():
+	# Peak resident set size of this process in MiB. VmHWM is preferred on
+	# Linux because ru_maxrss survives exec and so includes the parent's peak.
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		pass
+
+	try:
+		import resource
+	except ImportError:
+		return None
+	import sys
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_isolated(fun, *args):
+	# Run in a fresh process so peak memory only covers this call
+	import multiprocessing as mp
+
+	with mp.get_context("spawn").Pool(1) as pool:
+		return pool.apply(_isolated, (fun, args))
+
+def _isolated(fun, args):
+	base = peak_rss()
+	start = time.perf_counter()
+	fun(*args)
+	return time.perf_counter() - start, peak_rss(), base
+
+def measure(fun, repeat=3):
+	# Best wall time and the peak traced allocation of one run. NumPy reports
+	# its buffers to tracemalloc, so this covers the array working set.
+	import tracemalloc
+
+	fun()
+	best = timeit(fun, repeat=repeat)
+	tracemalloc.start()
+	fun()
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return best, peak / (1024 * 1024)
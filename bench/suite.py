@@ -0,0 +1,182 @@
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from dancer.libfun import AnalysisPipeline, AutomapModel, autoval, beat_reduce, create_actions_array, decode_audio, load_audio_data, render_heatmap
+from dancer.export import dump_funscript
+from .common import write_click_track, write_tone_track
+
+AUDIO = {"click": write_click_track, "tone": write_tone_track}
+OVERFLOW = ["crop", "bounce", "fold"]
+
+class Recorder:
+	# Times every step, and with trace=True records the traced peak of each
+	# step instead (tracing slows Python-heavy code, so the two never mix)
+	def __init__(self, trace=False):
+		self.trace = trace
+		self.results = {}
+
+	def step(self, name, fun, repeat=1):
+		if (not self.trace):
+			best = float("inf")
+			for _ in range(repeat):
+				start = time.perf_counter()
+				result = fun()
+				best = min(best, time.perf_counter() - start)
+			self.results[name] = best
+			return result
+
+		tracemalloc.start()
+		try:
+			result = fun()
+			_, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+		self.results[name] = peak / (1024 * 1024)
+		return result
+
+def analysis_steps(rec, path, plp=True):
+	# The steps of load_audio_data without the cache, one call each
+	import librosa
+
+	y, sr = rec.step("analysis.decode", lambda: decode_audio(path))
+	pipeline = AnalysisPipeline(sr, plp=plp)
+	pipeline.set_rate(sr, sr)
+
+	S = rec.step("analysis.spectrum", lambda: pipeline.spectrum(y))
+	log_mel = rec.step("analysis.log_mel", lambda: pipeline.log_mel(S))
+	if (pipeline.pitch_method != "centroid"):
+		S = None
+	rms, pitches = rec.step("analysis.frame_features", lambda: pipeline.frame_features(S, y, y))
+	del S
+	beats = rec.step("analysis.beats", lambda: pipeline.beats(log_mel))
+
+	frames = librosa.frames_to_time(np.arange(len(rms)), sr=pipeline.sr, hop_length=pipeline.hop_length)
+	rec.step("analysis.segment", lambda: (beat_reduce(rms, frames, beats), beat_reduce(pitches, frames, beats)))
+	return pipeline.timings
+
+def action_steps(rec, data, repeat):
+	for overflow, name in enumerate(OVERFLOW):
+		rec.step(f"create_actions.{name}", lambda: create_actions_array(data, energy_multiplier=2.5, pitch_range=80, overflow=overflow), repeat=repeat)
+
+	for opt, name in enumerate(AutomapModel.optimizers):
+		rec.step(f"autoval.{name}", lambda: autoval(data, opt=opt), repeat=repeat)
+
+	rec.step("render_heatmap", lambda: render_heatmap(data, 2.5, 80, 0), repeat=repeat)
+
+	actions = create_actions_array(data, energy_multiplier=2.5, pitch_range=80, overflow=1)
+	rec.step("dump_funscript", lambda: dump_funscript(io.StringIO(), actions), repeat=repeat)
+
+def run_case(path, audio, minutes, args):
+	rows = {}
+	for trace in ((False, True) if args.memory else (False,)):
+		rec = Recorder(trace)
+		stages = analysis_steps(rec, path, plp=not args.no_plp)
+		data = rec.step("analysis.total", lambda: load_audio_data(path, plp=not args.no_plp))
+		action_steps(rec, data, 1 if trace else args.repeat)
+
+		for name, value in rec.results.items():
+			row = rows.setdefault(name, {"name": name, "audio": audio, "minutes": minutes})
+			row["peak_mb" if trace else "time"] = value
+		if (not trace):
+			rows["analysis.total"]["stages"] = stages
+			rows["analysis.total"]["beats"] = len(data["beats"])
+	return list(rows.values())
+
+def metadata():
+	import librosa
+	import scipy
+
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip() or None
+	except OSError:
+		commit = None
+
+	return {
+		"commit": commit,
+		"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"python": sys.version.split()[0],
+		"numpy": np.__version__,
+		"scipy": scipy.__version__,
+		"librosa": librosa.__version__,
+		"platform": platform.platform(),
+		"processor": platform.processor() or platform.machine(),
+	}
+
+def compare(results, baseline, threshold):
+	# Ratios against an earlier results file, returns the regressed rows
+	old = {(r["name"], r["audio"], r["minutes"]): r for r in baseline["results"]}
+	regressions = []
+	print(f"\n{'case':44} {'time':>8} {'memory':>8}")
+	for r in results:
+		o = old.get((r["name"], r["audio"], r["minutes"]))
+		if o is None:
+			continue
+		ratios = []
+		for key in ("time", "peak_mb"):
+			if key in r and o.get(key):
+				ratios.append(r[key] / o[key])
+			else:
+				ratios.append(None)
+		cells = [f"{x:7.2f}x" if x is not None else f"{'-':>8}" for x in ratios]
+		flag = any(x is not None and x > threshold for x in ratios)
+		print(f"{r['name'] + ' ' + r['audio'] + ' ' + format(r['minutes'], 'g') + 'min':44} {cells[0]} {cells[1]}{'  <-' if flag else ''}")
+		if flag:
+			regressions.append(r)
+	return regressions
+
+def warm_up(tmp):
+	# Compile librosa's numba kernels before anything is timed
+	path = write_click_track(Path(tmp, "warmup.wav"), minutes=0.1)
+	data = load_audio_data(path)
+	autoval(data)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark suite for analysis and action generation, results as JSON")
+	parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10], help="Audio lengths to generate (1 to 180 is sensible)")
+	parser.add_argument("--audio", nargs="+", default=list(AUDIO), choices=list(AUDIO))
+	parser.add_argument("--sr", type=int, default=44100)
+	parser.add_argument("--channels", type=int, default=2)
+	parser.add_argument("--repeat", type=int, default=3, help="Repeats of the cheap steps, the best run counts")
+	parser.add_argument("--no_memory", dest="memory", action="store_false", help="Skip the traced pass")
+	parser.add_argument("--no_plp", action="store_true")
+	parser.add_argument("-o", "--output", default="bench_results.json")
+	parser.add_argument("--compare", default=None, metavar="JSON", help="Earlier results to compare against")
+	parser.add_argument("--threshold", type=float, default=1.25, help="Ratio counted as a regression")
+	args = parser.parse_args()
+
+	results = []
+	with tempfile.TemporaryDirectory() as tmp:
+		warm_up(tmp)
+		for minutes in args.minutes:
+			for audio in args.audio:
+				path = AUDIO[audio](Path(tmp, f"{audio}.wav"), minutes=minutes, sr=args.sr, channels=args.channels)
+				rows = run_case(path, audio, minutes, args)
+				for r in rows:
+					memory = f"{r['peak_mb']:9.1f} MiB" if "peak_mb" in r else ""
+					print(f"{audio:5} {minutes:6g} min  {r['name']:28} {r['time']*1000:10.1f} ms {memory}", flush=True)
+				results += rows
+				path.unlink()
+
+	with open(args.output, "w", encoding="utf8") as f:
+		json.dump({"meta": metadata(), "results": results}, f, indent="\t")
+	print(f"Wrote {args.output}")
+
+	if (args.compare):
+		with open(args.compare, encoding="utf8") as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		if regressions:
+			print(f"{len(regressions)} regression(s) over {args.threshold:g}x")
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
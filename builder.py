@@ -5,8 +5,13 @@ import io
 import shutil
 import os
 import zipfile
+import tempfile
 
 
+def cache_files(path):
+	# Kernel files numba wrote, with their sizes
+	return {os.path.relpath(os.path.join(root, name), path): os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files}
+
 print("Fetching binaries...")
 os.system(f"{sys.executable} scripts/fetch_binaries.py")
 
@@ -23,4 +28,18 @@ with requests.get("https://github.com/upx/upx/releases/download/v4.0.2/upx-4.0.2
 print("Building")
 os.system("pyinstaller qt.spec")
 
+# Fails if numba can't cache in the frozen build. The second launch has to
+# load every kernel the first one cached instead of compiling new ones.
+print("Warming up")
+exe = os.path.join("dist", "PythonDancer", "PythonDancer.exe")
+numba_dir = tempfile.mkdtemp()
+try:
+	subprocess.check_call([exe, "--warm_up", "--numba_cache_dir", numba_dir])
+	first = cache_files(numba_dir)
+	subprocess.check_call([exe, "--warm_up", "--numba_cache_dir", numba_dir])
+	if (cache_files(numba_dir) != first):
+		sys.exit("The second launch didn't reuse the numba cache")
+finally:
+	shutil.rmtree(numba_dir, ignore_errors=True)
+
 print("Done!")
\ No newline at end of file
@@ -1,16 +1,34 @@
-from . import cli
-from . import ui
+import sys
+
 from . import util
+from .jit import configure_numba_cache
 
 def main():
+	# "dancer serve" runs the daemon, which has its own options
+	if (sys.argv[1:2] == ["serve"]):
+		from . import serve
+		sys.exit(serve.main(sys.argv[2:]))
+
 	parser = util.cli_args()
 	args = parser.parse_args()
+	numba_dir = configure_numba_cache(args.numba_cache_dir)
+
+	if (args.warm_up):
+		from .jit import warm_up, cached_kernels
+		print(f"Compiled the analysis kernels in {warm_up():.1f}s")
+		# Kernels that never reach the cache are compiled again on every start
+		if (numba_dir and cached_kernels(numba_dir) == 0):
+			print(f"No kernels were cached in {numba_dir}")
+			sys.exit(1)
+		sys.exit(0)
 
+	# The UI pulls in tkinter and pyplot, keep them out of CLI runs
 	if (args.cli):
-		cli.cmd(args)
+		from . import cli
+		sys.exit(cli.cmd(args))
 	else:
+		from . import ui
 		ui.ux(args)
 
 if __name__ == "__main__":
 	main()
-	
\ No newline at end of file
@@ -0,0 +1,160 @@
+import os
+import json
+import struct
+import hashlib
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+CACHE_VERSION = 2
+FINGERPRINT_BLOCK = 1 << 20
+DEFAULT_SIZE = 1024
+
+def default_cache_dir():
+	if "DANCER_CACHE_DIR" in os.environ:
+		return Path(os.environ["DANCER_CACHE_DIR"])
+	if os.name == "nt" and "LOCALAPPDATA" in os.environ:
+		return Path(os.environ["LOCALAPPDATA"], "PythonDancer", "cache")
+	return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"), "pythondancer")
+
+def librosa_version():
+	# Package metadata is enough, a cache hit shouldn't import librosa. Frozen
+	# builds may not ship the metadata, fall back to the module then.
+	from importlib.metadata import version, PackageNotFoundError
+	try:
+		return version("librosa")
+	except PackageNotFoundError:
+		import librosa
+		return librosa.__version__
+
+def fingerprint(path):
+	# Hash the size, mtime and a few sampled blocks, hashing whole videos would
+	# cost more than it saves. The mtime catches same-size edits between the
+	# samples (retagging, a patched middle section).
+	h = hashlib.blake2b(digest_size=20)
+	st = os.stat(path)
+	size = st.st_size
+	h.update(f"{size}:{st.st_mtime_ns}".encode())
+	with open(path, "rb") as f:
+		for offset in (0, size // 2, size - FINGERPRINT_BLOCK):
+			f.seek(max(0, offset))
+			h.update(f.read(FINGERPRINT_BLOCK))
+	return h.hexdigest()
+
+def _mmap_npz(path):
+	# np.load ignores mmap_mode for archives, but np.savez stores members
+	# uncompressed, so each .npy payload can be mapped in place
+	arrays = {}
+	with zipfile.ZipFile(path) as z, open(path, "rb") as f:
+		for info in z.infolist():
+			if info.compress_type != zipfile.ZIP_STORED:
+				with np.load(path) as npz:
+					return {k: npz[k] for k in npz.files}
+
+			f.seek(info.header_offset)
+			name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+			f.seek(info.header_offset + 30 + name_len + extra_len)
+
+			version = np.lib.format.read_magic(f)
+			if version == (1, 0):
+				shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+			else:
+				shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+
+			name = info.filename[:-len(".npy")]
+			if np.prod(shape) == 0:
+				arrays[name] = np.empty(shape, dtype=dtype)
+			else:
+				arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran else "C")
+	return arrays
+
+class AnalysisCache:
+	def __init__(self, path=None, max_size=DEFAULT_SIZE):
+		self.path = Path(path) if path else default_cache_dir()
+		self.max_size = max_size * 1024 * 1024
+
+	def key(self, audio_file, **params):
+		params["librosa"] = librosa_version()
+		params["version"] = CACHE_VERSION
+		params["fingerprint"] = fingerprint(audio_file)
+		return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+	def _file(self, key):
+		return self.path / f"{key}.npz"
+
+	def load(self, key):
+		file = self._file(key)
+		try:
+			arrays = _mmap_npz(file)
+		except (OSError, ValueError, zipfile.BadZipFile):
+			return None
+
+		# Touch for LRU bookkeeping
+		try:
+			os.utime(file)
+		except OSError:
+			pass
+
+		data = dict(arrays)
+		data["at"] = float(data["at"])
+		return data
+
+	def store(self, key, data):
+		self.path.mkdir(parents=True, exist_ok=True)
+		file = self._file(key)
+		tmp = file.with_suffix(f".{os.getpid()}.tmp")
+		try:
+			with open(tmp, "wb") as f:
+				np.savez(f, **data)
+			os.replace(tmp, file)
+			self.evict()
+		except OSError:
+			tmp.unlink(missing_ok=True)
+
+	def _stats(self):
+		# (path, stat) oldest first. Other processes sharing the cache may
+		# remove entries at any time, those are skipped.
+		if not self.path.exists():
+			return []
+		stats = []
+		for p in self.path.glob("*.npz"):
+			try:
+				stats.append((p, p.stat()))
+			except OSError:
+				pass
+		return sorted(stats, key=lambda e: e[1].st_mtime)
+
+	def entries(self):
+		return [p for p, _ in self._stats()]
+
+	def evict(self):
+		stats = self._stats()
+		total = sum(st.st_size for _, st in stats)
+		for p, st in stats[:-1]:
+			if total <= self.max_size:
+				break
+			try:
+				p.unlink()
+			except FileNotFoundError:
+				# Evicted by another process
+				pass
+			except OSError:
+				# Still mapped elsewhere (Windows), try again next time
+				continue
+			total -= st.st_size
+
+	def clear(self):
+		for p in self.entries():
+			try:
+				p.unlink()
+			except OSError:
+				pass
+
+def cache_from_args(args):
+	cache = AnalysisCache(args.cache_dir, args.cache_size)
+	if (args.clear_cache):
+		cache.clear()
+	if (args.no_cache):
+		return None
+	return cache
@@ -1,85 +1,309 @@
+import sys
+import copy
+import glob
+import json
+import time
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from .libfun import autoval, create_actions, dump_csv, dump_funscript, load_audio_data, render_heatmap
-from .util import ffmpeg_conv, ffmpeg_check, cli_args
+from .libfun import action_speeds, autoval, block_frames_for, create_actions_array, load_audio_data, render_heatmap
+from .export import dump_csv, dump_funscript, open_output
+from .simplify import simplify
+from .sweep import SweepError, parse_sweep, run_sweep, summary_path, variant_path
+from .util import ffmpeg_check, cli_args
+from .cache import cache_from_args
+from .heatmap import save_png
+from .profiling import Profiler, format_report, stage
 
-def cmd(args):
-	if (not args.audio_path):
-		print("No audio file specified!")
-		return
+MEDIA_SUFFIXES = {
+	".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".wma",
+	".mp4", ".mkv", ".webm", ".avi", ".mov", ".wmv", ".m4v", ".flv", ".ts",
+}
+
+class CliError(Exception):
+	pass
+
+def expand_inputs(paths):
+	files = []
+	for p in paths:
+		matches = glob.glob(p, recursive=True) if glob.has_magic(p) else [p]
+		for m in map(Path, matches):
+			if m.is_dir():
+				files += sorted(f for f in m.rglob("*") if f.is_file() and f.suffix.lower() in MEDIA_SUFFIXES)
+			else:
+				files.append(m)
+
+	# Keep order, drop duplicates
+	return list(dict.fromkeys(files))
 
-	audioFile = Path(args.audio_path)
+def simplify_options(args):
+	if (args.simplify or args.min_interval or args.max_speed):
+		return {"tolerance": args.simplify, "min_interval": args.min_interval / 1000.0, "max_speed": args.max_speed}
+	return None
+
+def profiler_from_args(args):
+	if (args.profile):
+		return Profiler(memory=args.profile_memory)
+	return None
+
+def process_file(audio_path, args, cache=None, log=print, profiler=None):
+	args = copy.copy(args)
+	audioFile = Path(audio_path)
 
 	if not audioFile.exists():
-		print("Audio file doesn't exist!")
-		return
+		raise CliError("Audio file doesn't exist!")
 
 	if (args.out_path):
 		out_file = Path(args.out_path)
 	else:
-		out_file = Path(args.audio_path)
-		out_file = out_file.with_suffix(".csv" if args.csv else ".funscript")
+		out_file = audioFile.with_suffix(".csv" if args.csv else ".funscript")
+		if (args.gzip):
+			out_file = out_file.with_suffix(out_file.suffix + ".gz")
 
-	if (out_file.exists() and not args.yes):
-		print("Funscript already exists!")
-		return
-
-	if (args.convert):
-		print("Processing audio...")
-		audioFile = Path("tmp", audioFile.with_suffix(".wav").name)
-		audioFile.parent.mkdir(parents=True, exist_ok=True)
+	variants = []
+	if (args.sweep):
+		try:
+			variants = parse_sweep(args.sweep)
+		except (SweepError, OSError, ValueError) as e:
+			raise CliError(f"Invalid sweep: {e}")
+		if (not variants):
+			raise CliError("Empty sweep")
+		outputs = [summary_path(out_file)] + [variant_path(out_file, v) for v in variants]
+	else:
+		outputs = [out_file]
 
-		if (ffmpeg_check()):
-			return
+	if (any(p.exists() for p in outputs) and not args.yes):
+		raise CliError("Funscript already exists!")
 
-		try:
-			ffmpeg_conv(args.audio_path, audioFile)
-		except Exception:
-			print("Failed to convert to wav!")
-			return
+	start = time.perf_counter()
 
-	print("Loading audio...")
-	data = load_audio_data(audioFile, plp=not args.no_plp)
+	log("Loading audio...")
+	try:
+		with stage(profiler, "load"):
+			data = load_audio_data(
+				audioFile,
+				plp=not args.no_plp,
+				cache=cache,
+				ffmpeg=args.convert,
+				pitch_method=args.pitch_method,
+				analysis_sr=args.analysis_sr,
+				block_frames=block_frames_for(args.max_memory) if args.max_memory else None,
+				profiler=profiler,
+				n_jobs=args.n_jobs
+			)
+	except RuntimeError as e:
+		if (args.convert):
+			raise CliError(f"Failed to decode audio! {e}")
+		raise
 
 	if (args.automap):
-		print("Automapping...")
-		pitch,energy = autoval(data, tpi=args.auto_pitch, target_speed=args.auto_speed, v2above=args.auto_per/100.0, opt=(args.auto_mod-1))
+		log("Automapping...")
+		with stage(profiler, "automap"):
+			pitch,energy = autoval(data, tpi=args.auto_pitch, target_speed=args.auto_speed, v2above=args.auto_per/100.0, opt=(args.auto_mod-1), profiler=profiler, verbose=True)
 		args.pitch = pitch
 		args.energy = energy
 
-	print("Creating actions...")
-	actions = create_actions(
-		data,
-		energy_multiplier=args.energy,
-		pitch_range=args.pitch,
-		overflow=args.overflow,
-		amplitude_centering=args.amplitude_centering,
-		center_offset=args.center_offset
-	)
-
-	print("Writing...")
-	with open(out_file, "w", encoding="utf8") as f:
+	if (variants):
+		log(f"Sweeping {len(variants)} variants...")
+		with stage(profiler, "sweep"):
+			summary = run_sweep(
+				data,
+				variants,
+				{
+					"energy": args.energy,
+					"pitch": args.pitch,
+					"overflow": args.overflow,
+					"amplitude_centering": args.amplitude_centering,
+					"center_offset": args.center_offset,
+				},
+				out_file,
+				{
+					"csv": args.csv,
+					"gzip": args.gzip,
+					"csv_precision": args.csv_precision,
+					"drop_collinear": args.drop_collinear,
+					"simplify": simplify_options(args),
+				},
+				jobs=args.sweep_jobs
+			)
+		rows = summary["variants"]
+		return {
+			"file": str(audio_path),
+			"out": str(summary_path(out_file)),
+			"time": time.perf_counter() - start,
+			"beats": len(data["beats"]),
+			"actions": sum(r["actions"] for r in rows),
+			"speed": sum(r["speed"]["mean"] for r in rows) / len(rows),
+			"error": None,
+		}
+
+	log("Creating actions...")
+	with stage(profiler, "actions"):
+		actions = create_actions_array(
+			data,
+			energy_multiplier=args.energy,
+			pitch_range=args.pitch,
+			overflow=args.overflow,
+			amplitude_centering=args.amplitude_centering,
+			center_offset=args.center_offset,
+			profiler=profiler
+		)
+
+	if (simplify_options(args)):
+		count = len(actions)
+		with stage(profiler, "simplify"):
+			actions = simplify(actions, **simplify_options(args))
+		log(f"Simplified: removed {count - len(actions)} of {count} points")
+
+	log("Writing...")
+	with stage(profiler, "write"), open_output(out_file, compress=args.gzip or None) as f:
 		if (args.csv):
-			dump_csv(f, actions)
+			dump_csv(f, actions, precision=args.csv_precision, drop_collinear=args.drop_collinear)
 		else:
-			dump_funscript(f, actions)
+			dump_funscript(f, actions, drop_collinear=args.drop_collinear)
 
 	if (args.heatmap):
-		render_heatmap(
-			data,
-			args.energy,
-			args.pitch,
-			args.overflow,
-			args.overflow,
-			args.amplitude_centering,
-			args.center_offset
-			).savefig(
-				out_file
-				.with_stem(out_file.stem + "_heatmap")
-				.with_suffix(".png"),
-				bbox_inches="tight", pad_inches=0)
+		base = out_file.with_suffix("") if out_file.suffix == ".gz" else out_file
+		with stage(profiler, "heatmap"):
+			image = render_heatmap(
+				data,
+				args.energy,
+				args.pitch,
+				args.overflow,
+				amplitude_centering=args.amplitude_centering,
+				center_offset=args.center_offset,
+				profiler=profiler
+			)
+			with stage(profiler, "png"):
+				save_png(
+					base
+					.with_stem(base.stem + "_heatmap")
+					.with_suffix(".png"),
+					image)
+
+	speeds = action_speeds(actions)
+	return {
+		"file": str(audio_path),
+		"out": str(out_file),
+		"time": time.perf_counter() - start,
+		"beats": len(data["beats"]),
+		"actions": len(actions),
+		"speed": float(speeds.mean()) if len(speeds) > 0 else 0.0,
+		"error": None,
+	}
+
+def _warm_worker():
+	# Pay the numba/librosa setup once per worker instead of once per file
+	import librosa.beat
+	import librosa.feature
+
+def _batch_job(audio_path, args):
+	try:
+		profiler = profiler_from_args(args)
+		result = process_file(audio_path, args, cache=cache_from_args(args), log=lambda *a: None, profiler=profiler)
+		if (profiler):
+			result["profile"] = profiler.report()
+		return result
+	except Exception as e:
+		return {"file": str(audio_path), "error": str(e) or type(e).__name__}
+
+def _format_result(r):
+	if r["error"]:
+		return f"FAILED {r['file']}: {r['error']}"
+	return f"OK     {r['file']} -> {r['out']}"
+
+def print_summary(results):
+	rows = [("File", "Time", "Beats", "Actions", "Speed", "Status")]
+	for r in results:
+		if r["error"]:
+			rows.append((Path(r["file"]).name, "-", "-", "-", "-", "failed"))
+		else:
+			rows.append((
+				Path(r["file"]).name,
+				f"{r['time']:.1f}s",
+				str(r["beats"]),
+				str(r["actions"]),
+				f"{r['speed']:.0f}",
+				"ok"
+			))
+
+	widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+	for i, row in enumerate(rows):
+		print("  ".join(c.ljust(w) if j == 0 else c.rjust(w) for j, (c, w) in enumerate(zip(row, widths))))
+		if i == 0:
+			print("  ".join("-" * w for w in widths))
+
+def batch(files, args):
+	if (args.out_path):
+		print("--out_path can only be used with a single file!")
+		return 1
+
+	# Workers open the cache themselves, only the parent may clear it
+	args = copy.copy(args)
+	args.clear_cache = False
+	# Files are already spread over the pool
+	args.sweep_jobs = 1
+	args.n_jobs = 1
+
+	results = []
+	with ProcessPoolExecutor(max_workers=args.jobs, initializer=_warm_worker) as pool:
+		futures = {pool.submit(_batch_job, f, args): f for f in files}
+		for future in as_completed(futures):
+			try:
+				r = future.result()
+			except Exception as e:
+				r = {"file": str(futures[future]), "error": str(e) or type(e).__name__}
+			results.append(r)
+			print(_format_result(r), flush=True)
+
+	order = {str(f): i for i, f in enumerate(files)}
+	results.sort(key=lambda r: order[r["file"]])
+	print_summary(results)
+
+	if (args.profile == "json"):
+		print(json.dumps({r["file"]: r.get("profile") for r in results}, indent="\t"))
+	elif (args.profile):
+		for r in results:
+			if r.get("profile"):
+				print(f"\n{r['file']}")
+				print(format_report(r["profile"]))
+
+	return 1 if any(r["error"] for r in results) else 0
+
+def cmd(args):
+	cache = cache_from_args(args)
+
+	if (not args.audio_path and args.clear_cache):
+		print("Cache cleared!")
+		return 0
+
+	if (not args.audio_path):
+		print("No audio file specified!")
+		return 1
+
+	files = expand_inputs(args.audio_path)
+
+	if (len(files) == 0):
+		print("Audio file doesn't exist!")
+		return 1
+
+	if (args.convert and ffmpeg_check()):
+		return 1
+
+	if (len(files) > 1):
+		return batch(files, args)
+
+	profiler = profiler_from_args(args)
+	try:
+		process_file(files[0], args, cache=cache, profiler=profiler)
+	except CliError as e:
+		print(e)
+		return 1
 
 	print("Done!")
+	if (profiler):
+		print(format_report(profiler.report(), args.profile))
+	return 0
 
 if __name__ == "__main__":
-	cmd(cli_args().parse_args())
+	sys.exit(cmd(cli_args().parse_args()))
@@ -0,0 +1,115 @@
+import gzip
+import json
+
+import numpy as np
+
+CHUNK = 1 << 16
+
+FUNSCRIPT_METADATA = {
+	"creator": "PythonDancer",
+	"description": "",
+	"duration": 0,
+	"license": "None",
+	"notes": "",
+	"performers": [],
+	"script_url": "",
+	"tags": [],
+	"title": "",
+	"type": "basic",
+	"video_url": "",
+}
+
+def action_columns(data):
+	# (at, pos) as float64 columns from the structured array, an (n, 2)
+	# array or any iterable of pairs
+	if isinstance(data, np.ndarray) and data.dtype.names:
+		return np.asarray(data["at"], dtype=np.float64), np.asarray(data["pos"], dtype=np.float64)
+
+	arr = np.asarray(data if hasattr(data, "__len__") else list(data), dtype=np.float64).reshape(-1, 2)
+	return arr[:, 0], arr[:, 1]
+
+def quantize(at, pos):
+	# Funscripts store integer ms, truncated, and positions rounded half to even
+	return (at * 1000).astype(np.int64), np.rint(pos).astype(np.int64)
+
+def collinear_mask(at, pos):
+	# Keep mask dropping points that lie exactly on the line between their
+	# neighbours. Checked on the integers that get written, so players
+	# interpolate the kept points to the very same positions.
+	keep = np.ones(len(at), dtype=bool)
+	if len(at) < 3:
+		return keep
+
+	dt0, dt1 = at[1:-1] - at[:-2], at[2:] - at[1:-1]
+	dp0, dp1 = pos[1:-1] - pos[:-2], pos[2:] - pos[1:-1]
+	keep[1:-1] = (dp0 * dt1 != dp1 * dt0) | (dt0 <= 0) | (dt1 <= 0)
+	return keep
+
+def open_output(path, compress=None):
+	# Text handle for path, gzip compressed when asked or when path ends in .gz
+	if compress is None:
+		compress = str(path).endswith(".gz")
+	if compress:
+		return gzip.open(path, "wt", encoding="utf8")
+	return open(path, "w", encoding="utf8")
+
+def dump_csv(f, data, precision=None, drop_collinear=False):
+	# precision=None writes at (ms) with full float precision like before,
+	# an integer rounds it to that many decimals
+	at, pos = action_columns(data)
+	at_ms = at * 1000
+	pos = np.rint(pos).astype(np.int64)
+
+	if drop_collinear:
+		keep = collinear_mask(*quantize(at, pos))
+		at_ms, pos = at_ms[keep], pos[keep]
+
+	if precision == 0:
+		fmt = str
+		at_ms = np.rint(at_ms).astype(np.int64)
+	elif precision is not None:
+		fmt = f"{{:.{int(precision)}f}}".format
+	else:
+		fmt = repr
+
+	for i in range(0, len(at_ms), CHUNK):
+		lines = zip(map(fmt, at_ms[i:i+CHUNK].tolist()), map(str, pos[i:i+CHUNK].tolist()))
+		f.write("\n".join(map(",".join, lines)) + "\n")
+
+def dump_funscript(f, data, drop_collinear=False, metadata=None):
+	at, pos = quantize(*action_columns(data))
+	if drop_collinear:
+		keep = collinear_mask(at, pos)
+		at, pos = at[keep], pos[keep]
+
+	meta = dict(FUNSCRIPT_METADATA)
+	meta["duration"] = int(at[-1]) if len(at) > 0 else 0
+	meta.update(metadata or {})
+
+	# Same layout json.dump produces for the whole document, with the actions
+	# written a chunk at a time instead of as a list of dicts
+	f.write('{"actions": [')
+	action = '{{"at": {}, "pos": {}}}'.format
+	for i in range(0, len(at), CHUNK):
+		if i > 0:
+			f.write(", ")
+		f.write(", ".join(map(action, at[i:i+CHUNK].tolist(), pos[i:i+CHUNK].tolist())))
+	f.write("], ")
+
+	tail = json.dumps({
+		"inverted": False,
+		"metadata": meta,
+		"range": 100,
+		"version": "1.0",
+	})
+	f.write(tail[1:])
+
+def load_funscript(f):
+	# Actions of a funscript as a structured array, at in seconds
+	from .libfun import ACTION_DTYPE
+
+	actions = json.load(f)["actions"]
+	result = np.empty(len(actions), dtype=ACTION_DTYPE)
+	result["at"] = [a["at"] / 1000 for a in actions]
+	result["pos"] = [a["pos"] for a in actions]
+	return result
@@ -0,0 +1,72 @@
+import zlib
+import struct
+
+import numpy as np
+
+# Same stops as libfun.HEATMAP, without needing matplotlib to sample them
+HEATMAP_COLORS = [
+	(1.0, 1.0, 1.0), # w
+	(0.0, 0.5, 0.0), # g
+	(1.0, 0.6470588235294118, 0.0), # orange
+	(1.0, 0.0, 0.0), # r
+]
+MAX_SPEED = 400.0
+
+def heatmap_lut(n=256):
+	# Equivalent to HEATMAP(np.arange(n), bytes=True)[:, :3]
+	# Interpolated the way matplotlib builds its tables so the bytes match
+	colors = np.array(HEATMAP_COLORS)
+	stops = np.linspace(0, 1, len(colors)) * (n - 1)
+	x = (n - 1) * np.linspace(0, 1, n)
+	ind = np.searchsorted(stops, x)[1:-1]
+	distance = ((x[1:-1] - stops[ind - 1]) / (stops[ind] - stops[ind - 1]))[:, None]
+	lut = np.concatenate((
+		colors[:1],
+		distance * (colors[ind] - colors[ind - 1]) + colors[ind - 1],
+		colors[-1:]
+	))
+	return (np.clip(lut, 0, 1) * 255).astype(np.uint8)
+
+def speed_columns(at, pos, w, duration=None):
+	# Mean speed inside each of w equal time slices. Travelled distance is
+	# piecewise linear in time, so the mean over a slice is just its
+	# difference at the slice edges divided by the slice length.
+	at = np.asarray(at, dtype=np.float64)
+	pos = np.asarray(pos, dtype=np.float64)
+	if (duration is None):
+		duration = at[-1] if len(at) > 0 else 0
+	if (len(at) < 2 or duration <= 0):
+		return np.zeros(w, dtype=np.float64)
+
+	travel = np.concatenate(([0], np.cumsum(np.abs(np.diff(pos)))))
+	edges = np.linspace(0, duration, w + 1)
+	covered = np.interp(edges, at, travel)
+	return np.diff(covered) / np.diff(edges)
+
+def rasterize(speeds, h, lut=None, max_speed=MAX_SPEED):
+	lut = heatmap_lut() if lut is None else lut
+	n = len(lut)
+	idx = np.minimum((np.clip(speeds / max_speed, 0, 1) * n).astype(np.intp), n - 1)
+	return np.broadcast_to(lut[idx], (h, len(speeds), 3))
+
+def _chunk(kind, payload):
+	return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+def write_png(f, img, level=6):
+	# Minimal 8-bit RGB(A) PNG writer, every row uses filter type 0
+	img = np.ascontiguousarray(img, dtype=np.uint8)
+	h, w, channels = img.shape
+	color_type = {3: 2, 4: 6}[channels]
+
+	raw = np.empty((h, 1 + w * channels), dtype=np.uint8)
+	raw[:, 0] = 0
+	raw[:, 1:] = img.reshape(h, -1)
+
+	f.write(b"\x89PNG\r\n\x1a\n")
+	f.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0)))
+	f.write(_chunk(b"IDAT", zlib.compress(raw.tobytes(), level)))
+	f.write(_chunk(b"IEND", b""))
+
+def save_png(path, img, **kwargs):
+	with open(path, "wb") as f:
+		write_png(f, img, **kwargs)
@@ -0,0 +1,95 @@
+import os
+import re
+import sys
+import shutil
+import hashlib
+import warnings
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from .cache import default_cache_dir
+
+def numba_cache_dir(path=None):
+	# Explicit path, else NUMBA_CACHE_DIR, else next to the analysis cache
+	if path:
+		return str(path)
+	if os.environ.get("NUMBA_CACHE_DIR"):
+		return os.environ["NUMBA_CACHE_DIR"]
+	return str(default_cache_dir() / "numba")
+
+def one_file_build():
+	# One-file exes unpack into a new _MEI* directory on every launch, while
+	# one-dir builds run from beside the exe
+	if not hasattr(sys, "_MEIPASS"):
+		return False
+	root = Path(sys._MEIPASS).resolve()
+	return Path(sys.executable).parent.resolve() not in (root, *root.parents)
+
+def prune_numba_cache(path, root):
+	# numba names kernel directories <source dir>_<sha1 of its path>, drop
+	# the ones whose sources are no longer under root (a moved or replaced
+	# build). Returns the number removed.
+	stale = [sub for sub in Path(path).glob("*_*") if sub.is_dir() and re.fullmatch(r".+_[0-9a-f]{40}", sub.name)]
+	if not stale:
+		return 0
+
+	names = {sub.name.rsplit("_", 1)[0] for sub in stale}
+	live = set()
+	for parent, dirs, _ in os.walk(root):
+		for source in [parent] + [os.path.join(parent, name) for name in dirs]:
+			name = os.path.basename(source)
+			if name in names:
+				live.add(f"{name}_{hashlib.sha1(os.path.abspath(source).encode()).hexdigest()}")
+
+	removed = 0
+	for sub in stale:
+		if sub.name not in live:
+			shutil.rmtree(sub, ignore_errors=True)
+			removed += 1
+	return removed
+
+def configure_numba_cache(path=None):
+	# librosa caches its numba kernels beside its sources, which frozen builds
+	# can't write to, so those always get a user directory. Elsewhere numba's
+	# own lookup is kept unless a directory is asked for. Has to run before
+	# librosa is imported, numba picks the location when a kernel is defined.
+	if not path and (not getattr(sys, "frozen", False) or one_file_build()):
+		# A one-file build's sources move every launch, a persistent cache
+		# would only grow. Its unpacked sources are writable and go away
+		# with it.
+		return None
+
+	if not path and not os.environ.get("NUMBA_CACHE_DIR"):
+		# Only in our own directory, a shared one may hold other programs'
+		prune_numba_cache(numba_cache_dir(), sys._MEIPASS)
+	path = numba_cache_dir(path)
+	os.environ["NUMBA_CACHE_DIR"] = path
+	if "numba" in sys.modules:
+		sys.modules["numba"].config.CACHE_DIR = path
+	return path
+
+def cached_kernels(path):
+	# Index files numba wrote, one per cached function
+	return sum(1 for _ in Path(path).rglob("*.nbi"))
+
+def warm_up(seconds=20, sr=22050):
+	# Runs the analysis on a generated clip so that every numba kernel it
+	# uses (onset, PLP, beat tracking, piptrack) is compiled, and written
+	# to the cache. With a warm cache this only loads them. Returns seconds.
+	from .libfun import AnalysisPipeline
+
+	start = perf_counter()
+	rng = np.random.default_rng(0)
+	t = np.arange(seconds * sr) / sr
+	y = 0.2 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+	y[(t % 0.5) < 0.01] += 0.8
+	y = y.astype(np.float32)
+
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore")
+		for pitch_method in ("piptrack", "centroid"):
+			pipeline = AnalysisPipeline(sr, pitch_method=pitch_method)
+			pipeline.run(y)
+	return perf_counter() - start
@@ -0,0 +1,141 @@
+import queue
+import threading
+import traceback
+from collections import deque
+from time import perf_counter
+
+class Cancelled(Exception):
+	pass
+
+class Job:
+	def __init__(self, scheduler, generation, fun, args, done, progressed):
+		self.scheduler = scheduler
+		self.generation = generation
+		self.fun = fun
+		self.args = args
+		self.done = done
+		self.progressed = progressed
+		self.cancelled = False
+		self.submitted = perf_counter()
+		self.started = None
+		self.finished = None
+
+	def cancel(self):
+		self.cancelled = True
+
+	def check(self):
+		# Cooperative cancellation point, called by the job between stages
+		if (self.cancelled):
+			raise Cancelled()
+
+	def progress(self, *value):
+		self.scheduler.results.put(("progress", self, value))
+
+class Scheduler:
+	# A single worker thread running the most recently submitted job.
+	# Submitting replaces whatever is still pending and cancels the job in
+	# flight, results only reach the callbacks through poll() on the Tk thread.
+	def __init__(self, name="worker", history=100):
+		self.generation = 0
+		self.results = queue.Queue()
+		self.latencies = deque(maxlen=history)
+		self.counts = {"submitted": 0, "coalesced": 0, "cancelled": 0, "completed": 0, "failed": 0, "callback_errors": 0}
+
+		self._cond = threading.Condition()
+		self._pending = None
+		self._running = None
+		self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+		self._thread.start()
+
+	def submit(self, fun, *args, done=None, progressed=None):
+		with self._cond:
+			self.generation += 1
+			job = Job(self, self.generation, fun, args, done, progressed)
+			self.counts["submitted"] += 1
+			if (self._pending is not None):
+				self.counts["coalesced"] += 1
+			if (self._running is not None):
+				self._running.cancel()
+			self._pending = job
+			self._cond.notify()
+		return job
+
+	def cancel(self):
+		with self._cond:
+			self.generation += 1
+			if (self._pending is not None):
+				self.counts["coalesced"] += 1
+				self._pending = None
+			if (self._running is not None):
+				self._running.cancel()
+
+	def busy(self):
+		with self._cond:
+			return self._pending is not None or self._running is not None
+
+	def _loop(self):
+		while True:
+			with self._cond:
+				while self._pending is None:
+					self._cond.wait()
+				job, self._pending = self._pending, None
+				self._running = job
+
+			job.started = perf_counter()
+			try:
+				job.check()
+				result = ("done", job, job.fun(job, *job.args))
+			except Cancelled:
+				result = ("cancelled", job, None)
+			except Exception as e:
+				result = ("error", job, e)
+			job.finished = perf_counter()
+
+			with self._cond:
+				self._running = None
+			self.results.put(result)
+
+	def poll(self):
+		# Drain the result queue, must be called from the thread owning the UI
+		while True:
+			try:
+				kind, job, value = self.results.get_nowait()
+			except queue.Empty:
+				return
+
+			stale = job.generation != self.generation
+			if (kind == "progress"):
+				if (not stale and job.progressed):
+					self._call(job.progressed, *value)
+			elif (kind == "cancelled" or (kind == "done" and stale)):
+				self.counts["cancelled"] += 1
+			elif (kind == "error"):
+				self.counts["failed"] += 1
+				traceback.print_exception(type(value), value, value.__traceback__)
+				if (not stale and job.progressed):
+					self._call(job.progressed, -1, f"Failed: {value}")
+			else:
+				self.counts["completed"] += 1
+				self.latencies.append((perf_counter() - job.submitted, job.finished - job.started))
+				if (job.done):
+					self._call(job.done, *value)
+
+	def _call(self, callback, *args):
+		# A failing callback is reported and the remaining results still
+		# get delivered, the poll loop has to outlive it
+		try:
+			callback(*args)
+		except Exception:
+			self.counts["callback_errors"] += 1
+			traceback.print_exc()
+
+	def stats(self):
+		# Latency is submit to delivery on the UI thread, run is time spent in the worker
+		stats = dict(self.counts)
+		if (self.latencies):
+			latency, run = zip(*self.latencies)
+			stats["latency_last"] = latency[-1]
+			stats["latency_mean"] = sum(latency) / len(latency)
+			stats["latency_max"] = max(latency)
+			stats["run_mean"] = sum(run) / len(run)
+		return stats
@@ -1,71 +1,430 @@
-import librosa
+import copy
 import numpy as np
-from json import dump
-from scipy.optimize import minimize
-import matplotlib as mpl
-from matplotlib.colors import LinearSegmentedColormap
-from matplotlib.figure import Figure
-from audioread import audio_open
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import repeat
+from time import perf_counter
+
+from .util import FFMPEG_SR, ffmpeg_read, ffmpeg_stream
+from .heatmap import rasterize, speed_columns
+from .export import dump_csv, dump_funscript
+from .simplify import simplify as simplify_actions
+from .profiling import stage
+
+# librosa, scipy and matplotlib are imported where they are used, a CLI
+# run that hits the cache or only prints help never pays for them
 
 VERSION="?"
-HEATMAP = LinearSegmentedColormap.from_list("intensity",["w", "g", "orange", "r"], N=256)
 
-#TODO: Fix action lag that happens sometimes, maybe change hop?
-def load_audio_data(audio_file, hop_length=1024, frame_length=1024, plp=True):
-	y, sr=None,None
+def __getattr__(name):
+	# HEATMAP is a matplotlib colormap, only build it when the UI asks for it
+	if (name == "HEATMAP"):
+		from matplotlib.colors import LinearSegmentedColormap
+
+		global HEATMAP
+		HEATMAP = LinearSegmentedColormap.from_list("intensity",["w", "g", "orange", "r"], N=256)
+		return HEATMAP
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def decode_audio(audio_file, ffmpeg=False, sr=None):
+	# sr only applies to ffmpeg, which resamples while decoding
+	if (ffmpeg):
+		return ffmpeg_read(audio_file, sr=sr or FFMPEG_SR)
+
+	import librosa
+	from audioread import audio_open
+
 	with audio_open(audio_file) as f:
-		y, sr = librosa.load(f, sr=None, mono=True)
+		return librosa.load(f, sr=None, mono=True)
+
+def _audioread_blocks(f):
+	# Same conversion as librosa.load, one decoder buffer at a time
+	import librosa
+
+	for buf in f:
+		y = librosa.util.buf_to_float(buf, n_bytes=2, dtype=np.float32)
+		if (f.channels > 1):
+			y = y.reshape((-1, f.channels)).T
+			y = librosa.to_mono(y)
+		yield y
+
+N_FFT = 2048
+PITCH_METHODS = ["piptrack", "centroid"]
+
+def _resample_blocks(blocks, orig_sr, target_sr):
+	import soxr
+
+	stream = soxr.ResampleStream(orig_sr, target_sr, 1, dtype="float32")
+	for y in blocks:
+		yield stream.resample_chunk(y)
+	yield stream.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+def _pitch_contour(pitches, magnitudes):
+	# Clamp in place, both matrices are temporaries
+	pitches = np.fmax(0.01, pitches, out=pitches)
+	magnitudes = np.fmax(0.01, magnitudes, out=magnitudes)
+	#TODO: The fuck does this do
+	total = np.sum(magnitudes, axis=0)
+	pitches *= magnitudes
+	return np.sum(pitches, axis=0) / total
+
+# Rough bytes per frame held while a block is analyzed, dominated by the
+# spectrogram and the piptrack matrices (pitches, magnitudes, gradients)
+STREAM_FRAME_BYTES = (N_FFT // 2 + 1) * 4 * 12
+
+def _window(y, offset, a, b):
+	# Samples [a, b) of a signal of which y holds the part from offset on,
+	# anything outside y is zero like the padding of center=True
+	out = np.zeros(b - a, dtype=np.float32)
+	lo, hi = max(a, offset), min(b, offset + len(y))
+	if (hi > lo):
+		out[lo - a:hi - a] = y[lo - offset:hi - offset]
+	return out
+
+def _init_feature_worker():
+	import librosa.feature
+
+def _feature_chunk(name, length, pipeline, k0, k1):
+	# Frames [k0, k1) of the signal in the shared memory block name
+	from multiprocessing import shared_memory
+
+	shm = shared_memory.SharedMemory(name=name)
+	try:
+		y = np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+		result = pipeline.frame_range(y, 0, k0, k1)
+		del y
+	finally:
+		shm.close()
+	return result
+
+def block_frames_for(max_memory, hop_length=1024):
+	# max_memory is in MiB and only bounds the per-block working set,
+	# the per-frame results and log-mel spectrogram still grow with length
+	block_frames = int(max_memory * 1024 * 1024 // (STREAM_FRAME_BYTES + hop_length * 4))
+	return max(16, block_frames)
+
+class AnalysisPipeline:
+	# Computes one magnitude STFT per signal (or block) and feeds it to the
+	# onset envelope, pitch and, for centroid, RMS. PLP and beat tracking
+	# share the resulting onset envelope. Results match calling librosa on y
+	# for every stage, the stages just stop recomputing the spectrogram.
+	def __init__(self, sr, hop_length=1024, frame_length=1024, plp=True, pitch_method="piptrack", profiler=None):
+		if (pitch_method not in PITCH_METHODS):
+			raise ValueError(f"Unknown pitch method: {pitch_method}")
+
+		self.sr = sr
+		self.hop_length = hop_length
+		self.frame_length = frame_length
+		self.n_fft = N_FFT
+		self.plp = plp
+		self.pitch_method = pitch_method
+		self.timings = {}
+		self.profiler = profiler
+		self._frame_params = (hop_length, frame_length, N_FFT)
+
+	def set_rate(self, sr, native_sr=None):
+		# Scale the frame sizes so frames last as long as they would at
+		# native_sr. Timing is exact when the ratio divides the hop evenly.
+		self.sr = sr
+		ratio = sr / native_sr if native_sr else 1.0
+		hop_length, frame_length, n_fft = self._frame_params
+		self.hop_length = max(1, round(hop_length * ratio))
+		# Window sizes follow the rounded hop, the onset envelope's centering
+		# shift depends on n_fft // (2 * hop)
+		self.frame_length = round(frame_length * self.hop_length / hop_length)
+		self.n_fft = round(n_fft * self.hop_length / hop_length)
+
+	@contextmanager
+	def stage(self, name):
+		start = perf_counter()
+		try:
+			with stage(self.profiler, name):
+				yield
+		finally:
+			self.timings[name] = self.timings.get(name, 0.0) + perf_counter() - start
+
+	def decoded(self, blocks):
+		# Streams decode while they are read, so time every read as decode
+		blocks = iter(blocks)
+		while True:
+			with self.stage("decode"):
+				block = next(blocks, None)
+			if block is None:
+				return
+			yield block
+
+	def spectrum(self, y, center=True):
+		import librosa
+		with self.stage("stft"):
+			return np.abs(librosa.stft(y, n_fft=self.n_fft, hop_length=self.hop_length, center=center))
+
+	def log_mel(self, S):
+		# top_db needs the global max, it is applied in beats()
+		import librosa
+		with self.stage("onset"):
+			mel = librosa.feature.melspectrogram(S=S ** 2, sr=self.sr, fmax=0.5 * self.sr)
+			return librosa.power_to_db(mel, top_db=None)
+
+	def frame_features(self, S, y, y_rms, center=True):
+		# S is the spectrum of y, only the centroid backend uses it. piptrack
+		# copies a passed in spectrogram, so it computes its own from y and
+		# the caller drops S first, see features()
+		import librosa
+		with self.stage("rms"):
+			if (self.pitch_method == "centroid"):
+				rms = librosa.feature.rms(S=S, frame_length=self.n_fft)[0]
+			else:
+				rms = librosa.feature.rms(y=y_rms, frame_length=self.frame_length, hop_length=self.hop_length, center=center)[0]
+
+		with self.stage("pitch"):
+			if (self.pitch_method == "centroid"):
+				pitches = librosa.feature.spectral_centroid(S=S, sr=self.sr, n_fft=self.n_fft)[0]
+			else:
+				pitches = _pitch_contour(*librosa.piptrack(y=y, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length, center=center))
+
+		return rms, pitches
+
+	def features(self, y, y_rms, center=True):
+		# Log-mel, RMS and pitch. The spectrum is released before piptrack
+		# allocates its matrices, one extra STFT costs less than keeping it.
+		S = self.spectrum(y, center=center)
+		log_mel = self.log_mel(S)
+		if (self.pitch_method != "centroid"):
+			S = None
+		rms, pitches = self.frame_features(S, y, y_rms, center=center)
+		return log_mel, rms, pitches
+
+	def beats(self, log_mel):
+		import librosa
+		with self.stage("onset"):
+			log_mel = np.maximum(log_mel, log_mel.max() - 80.0, out=log_mel)
+			onset = librosa.onset.onset_strength(S=log_mel, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length, aggregate=np.median)
+
+		# Compute beats
+		if (self.plp):
+			with self.stage("plp"):
+				onset = librosa.beat.plp(onset_envelope=onset, sr=self.sr, hop_length=self.hop_length)
+
+		with self.stage("beat_track"):
+			_, beats = librosa.beat.beat_track(sr=self.sr, onset_envelope=onset, hop_length=self.hop_length, trim=False, units="time")
+		return beats
+
+	def run(self, y):
+		import librosa
+		# Compute onsets, energy (RMS) and pitch
+		log_mel, rms, pitches = self.features(y, y)
+
+		return librosa.get_duration(y=y, sr=self.sr, hop_length=self.hop_length), self.beats(log_mel), rms, pitches
+
+	def frame_range(self, y, offset, k0, k1):
+		# Log-mel, RMS and pitch of frames [k0, k1) as the centered full-file
+		# features would have them, y holds the samples from offset on
+		hop_length, frame_length, n_fft = self.hop_length, self.frame_length, self.n_fft
+		first, last = k0 * hop_length, (k1 - 1) * hop_length
+
+		y_stft = _window(y, offset, first - n_fft // 2, last + n_fft // 2)
+		y_rms = _window(y, offset, first - frame_length // 2, last + frame_length // 2)
+		return self.features(y_stft, y_rms, center=False)
+
+	def run_parallel(self, y, n_jobs, chunks_per_job=4):
+		# The frame-local features of run_stream, with the frame ranges spread
+		# over a process pool. Workers read y from shared memory instead of
+		# getting it pickled, results are stitched in order and beats are
+		# tracked once on the whole onset envelope.
+		from concurrent.futures import ProcessPoolExecutor
+		from multiprocessing import shared_memory
+
+		y = np.ascontiguousarray(y, dtype=np.float32)
+		n_frames = 1 + len(y) // self.hop_length
+		bounds = np.unique(np.linspace(0, n_frames, min(n_frames, n_jobs * chunks_per_job) + 1).astype(int))
+
+		# Workers get a copy without the profiler, its callbacks stay here
+		worker = copy.copy(self)
+		worker.profiler = None
+		worker.timings = {}
+
+		shm = shared_memory.SharedMemory(create=True, size=max(1, y.nbytes))
+		try:
+			np.ndarray(y.shape, dtype=np.float32, buffer=shm.buf)[:] = y
+			with self.stage("features"):
+				with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_feature_worker) as pool:
+					parts = list(pool.map(_feature_chunk, repeat(shm.name), repeat(len(y)), repeat(worker), bounds[:-1].tolist(), bounds[1:].tolist()))
+		finally:
+			shm.close()
+			shm.unlink()
+
+		log_mel = np.concatenate([p[0] for p in parts], axis=-1)
+		rms = np.concatenate([p[1] for p in parts])
+		pitches = np.concatenate([p[2] for p in parts])
+		del parts
+
+		return len(y) / self.sr, self.beats(log_mel), rms, pitches
+
+	def run_stream(self, blocks, block_frames):
+		# Frame k of every centered, zero padded feature covers the samples
+		# [k*hop - W/2, k*hop + W/2), so features can be computed with center=False
+		# on overlapping slices of the stream. RMS and pitch are frame local and
+		# match the full-file path up to float rounding (tested bit-identical,
+		# allow rtol 1e-5 across BLAS builds). The onset
+		# envelope needs the global max for its top_db floor, so its log-mel
+		# spectrogram is kept until the end and beats are tracked once.
+		hop_length = self.hop_length
+		reach = max(self.n_fft, self.frame_length) // 2
+
+		# Decoded blocks wait in pending and are joined to buf once per
+		# analysis block, joining every small decoder block would copy the
+		# whole window each time
+		buf = np.zeros(0, dtype=np.float32)
+		pending = []
+		buf_start = 0
+		total = 0
+		k0 = 0
+		mel, rms, pitches = [], [], []
+
+		def process(k1):
+			nonlocal buf, pending, buf_start, k0
+			if (pending):
+				buf = np.concatenate([buf] + pending)
+				pending = []
+			m, r, p = self.frame_range(buf, buf_start, k0, k1)
+			mel.append(m)
+			rms.append(r)
+			pitches.append(p)
+
+			k0 = k1
+			drop = max(0, k0 * hop_length - reach - buf_start)
+			buf = buf[drop:]
+			buf_start += drop
+
+		for block in self.decoded(blocks):
+			pending.append(block)
+			total += len(block)
+			while (total >= reach and (total - reach) // hop_length + 1 - k0 >= block_frames):
+				process(k0 + block_frames)
+
+		n_frames = 1 + total // hop_length
+		while (k0 < n_frames):
+			process(min(n_frames, k0 + block_frames))
+
+		log_mel = np.concatenate(mel, axis=-1)
+		del mel
+
+		return total / self.sr, self.beats(log_mel), np.concatenate(rms), np.concatenate(pitches)
+
+def beat_segments(frame_times, beats):
+	# Beat i collects the frames after beat i-1 up to and including beat i,
+	# beat 1 also takes everything before the first beat and beat 0 is left
+	# empty. A frame can only close one beat, so beats closer than a hop
+	# are pushed onto later frames. Beats after the last frame run to the end.
+	n = len(frame_times)
+	idx = np.arange(len(beats))
+	ends = np.searchsorted(frame_times, beats, side="right")
+	ends = np.maximum.accumulate(ends - idx) + idx if len(beats) > 0 else ends
+	ends = np.minimum(ends, n)
+
+	starts = np.concatenate(([0, 0], ends[1:-1]))[:len(beats)]
+	if len(beats) > 0:
+		ends[0] = 0
+	return starts, ends
+
+def beat_reduce(values, frame_times, beats, how="sum"):
+	values = np.asarray(values)
+	starts, ends = beat_segments(frame_times, beats)
+	out = np.zeros(len(beats), dtype=np.float64)
+
+	# Non-empty segments tile a prefix of the frames, so one reduceat covers them
+	nonempty = ends > starts
+	if np.any(nonempty):
+		chunk = values[:ends[nonempty][-1]]
+		if how == "max":
+			out[nonempty] = np.maximum.reduceat(chunk, starts[nonempty])
+		else:
+			out[nonempty] = np.add.reduceat(chunk.astype(np.float64), starts[nonempty])
+			if how == "mean":
+				out[nonempty] /= (ends - starts)[nonempty]
+			elif how != "sum":
+				raise ValueError(f"Unknown aggregation: {how}")
+
+	return out.astype(values.dtype, copy=False)
+
+#TODO: Fix action lag that happens sometimes, maybe change hop?
+def load_audio_data(audio_file, hop_length=1024, frame_length=1024, plp=True, cache=None, ffmpeg=False, block_frames=None, pitch_method="piptrack", analysis_sr=None, profiler=None, n_jobs=1):
+	# profiler (see profiling.Profiler) gets one stage per analysis step.
+	# n_jobs > 1 computes the frame features on that many processes, unless
+	# block_frames already streams the analysis.
+	pipeline = AnalysisPipeline(None, hop_length, frame_length, plp, pitch_method, profiler=profiler)
+
+	key = None
+	if (cache is not None):
+		with pipeline.stage("cache"):
+			key = cache.key(audio_file, hop_length=hop_length, frame_length=frame_length, plp=plp, ffmpeg=ffmpeg, stream=block_frames is not None or n_jobs > 1, pitch_method=pitch_method, analysis_sr=analysis_sr)
+			data = cache.load(key)
+		if (data is not None):
+			return data
+
+	with pipeline.stage("import"):
+		import librosa
+		from audioread import audio_open
+
+	if (block_frames is None):
+		with pipeline.stage("decode"):
+			y, sr = decode_audio(audio_file, ffmpeg=ffmpeg, sr=analysis_sr)
+		native_sr = FFMPEG_SR if ffmpeg else sr
+
+		if (analysis_sr and sr != analysis_sr):
+			with pipeline.stage("resample"):
+				y = librosa.resample(y, orig_sr=sr, target_sr=analysis_sr)
+
+		pipeline.set_rate(analysis_sr or sr, native_sr)
+		if (n_jobs > 1):
+			duration, beats, rms, pitches = pipeline.run_parallel(y, n_jobs)
+		else:
+			duration, beats, rms, pitches = pipeline.run(y)
+		del y
+	elif (ffmpeg):
+		pipeline.set_rate(analysis_sr or FFMPEG_SR, FFMPEG_SR)
+		blocks = ffmpeg_stream(audio_file, sr=pipeline.sr, block_size=block_frames * pipeline.hop_length)
+		duration, beats, rms, pitches = pipeline.run_stream(blocks, block_frames)
+	else:
+		with audio_open(audio_file) as f:
+			blocks = _audioread_blocks(f)
+			if (analysis_sr and f.samplerate != analysis_sr):
+				blocks = _resample_blocks(blocks, f.samplerate, analysis_sr)
 
-	# Compute beats
-	onset = None
-	if (plp):
-		pulse = librosa.beat.plp(y=y, sr=sr, hop_length=hop_length)
-		onset = pulse.T
+			pipeline.set_rate(analysis_sr or f.samplerate, f.samplerate)
+			duration, beats, rms, pitches = pipeline.run_stream(blocks, block_frames)
+	sr, hop_length = pipeline.sr, pipeline.hop_length
 
-	_, beats = librosa.beat.beat_track(y=y, sr=sr, onset_envelope=onset, hop_length=hop_length, trim=False, units="time")
+	with pipeline.stage("segment"):
+		frames = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
 
-	# Compute energy (RMS)
-	rms = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
-	frames = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
+		#Funny segment thing
+		frms = beat_reduce(rms, frames, beats)
+		fpitch = beat_reduce(pitches, frames, beats)
 
-	# Compute pitch
-	pitches, magnitudes = librosa.piptrack(y=y, sr=sr, hop_length=hop_length, center=True)
+		#Fix divide by zero
+		fpitch = np.fmax(0.01, fpitch)
+		frms = np.fmax(0.01, frms)
 
-	pitches = np.fmax(0.01, pitches)
-	magnitudes = np.fmax(0.01, magnitudes)
-	#TODO: The fuck does this do
-	pitches = np.sum(pitches * magnitudes, axis=0) / np.sum(magnitudes, axis=0)
-
-	#Funny segment thing
-	last = 0
-	splits = [0]
-	for k,v in enumerate(frames):
-		if last >= len(beats):
-			break
-		if v > beats[last]:
-			if (last > 0):
-				#splits.append(int((k + splits[-1]) / 2))
-				splits.append(k)
-			last += 1
-	splits.append(-1)
-
-	frms = [np.sum(rms[splits[i-1]:splits[i]]) for i in range(len(beats))]
-	fpitch = [np.sum(pitches[splits[i-1]:splits[i]]) for i in range(len(beats))]
-
-	#Fix divide by zero
-	fpitch = np.fmax(0.01, fpitch)
-	frms = np.fmax(0.01, frms)
-
-	return {
-		"at": librosa.get_duration(y=y, sr=sr, hop_length=hop_length),
+	data = {
+		"at": duration,
 		"beats": beats,
 		"pitch": np.log10(fpitch),
-		"energy": frms
+		"energy": frms,
+		"frame_rms": rms,
+		"frame_pitch": pitches
 	}
 
+	if (cache is not None):
+		with pipeline.stage("store"):
+			cache.store(key, data)
+
+	return data
+
 def normalize(data):
+	data = np.asarray(data)
 	fmin, fmax = np.min(data), np.max(data)
-	return np.array([(value-fmin)/(fmax-fmin) for value in data])
+	return (data-fmin)/(fmax-fmin)
 
 def default_peak(pos, at, last_pos, last_at):
 	return [(at, min(max(0,pos),100))]
@@ -124,28 +483,97 @@ def create_peak_fold(pos, at, last_pos, last_at):
 
 peaks = [default_peak, create_peak_bounce, create_peak_fold]
 
-def create_actions_barrier(data, start_time=0, overflow=0):
-	last_at = start_time
-	last_pos = 50
+ACTION_DTYPE = np.dtype([("at", np.float64), ("pos", np.float64)])
+
+def _overflow_points(pos, at, last_pos, last_at, overflow):
+	# Every step emits up to three points: one leaving the previous overflow,
+	# one reaching the current overflow and the final one at "at".
+	n = len(pos)
+	pts_at = np.empty((n, 3), dtype=np.float64)
+	pts_pos = np.empty((n, 3), dtype=np.float64)
+	mask = np.zeros((n, 3), dtype=bool)
+
+	pts_at[:, 2] = at
+	mask[:, 2] = True
+
+	if overflow == 0:
+		pts_pos[:, 2] = pos
+	elif overflow == 1:
+		def int_at_v(idx, limit):
+			before_ratio = np.abs(last_pos[idx] - limit)
+			after_ratio = np.abs(pos[idx] - limit)
+			return (before_ratio * at[idx] + after_ratio * last_at[idx]) / (after_ratio + before_ratio)
+
+		for cond, limit in ((last_pos < 0, 0), (last_pos > 100, 100)):
+			idx = np.flatnonzero(cond)
+			pts_at[idx, 0] = int_at_v(idx, limit)
+			pts_pos[idx, 0] = limit
+			mask[idx, 0] = True
+
+		pts_pos[:, 2] = pos
+		for cond, limit in ((pos > 100, 100), (pos < 0, 0)):
+			idx = np.flatnonzero(cond)
+			pts_at[idx, 1] = int_at_v(idx, limit)
+			pts_pos[idx, 1] = limit
+			pts_pos[idx, 2] = 2 * limit - pos[idx]
+			mask[idx, 1] = True
+	else:
+		int_att = (last_at + at) / 2
+		travel = np.abs(last_pos - pos) / 2
+
+		for cond, sign in ((last_pos < 0, 1), (last_pos > 100, -1)):
+			idx = np.flatnonzero(cond)
+			pts_at[idx, 0] = int_att[idx]
+			pts_pos[idx, 0] = last_pos[idx] + sign * travel[idx]
+			mask[idx, 0] = True
+
+		pts_pos[:, 2] = pos
+		for cond, sign in ((pos < 0, -1), (pos > 100, 1)):
+			idx = np.flatnonzero(cond)
+			pts_at[idx, 1] = int_att[idx]
+			pts_pos[idx, 1] = last_pos[idx] + sign * travel[idx]
+			pts_pos[idx, 2] = last_pos[idx]
+			mask[idx, 1] = True
+
+	actions = np.empty(np.count_nonzero(mask), dtype=ACTION_DTYPE)
+	actions["at"] = pts_at[mask]
+	actions["pos"] = np.clip(pts_pos[mask], 0, 100)
+	return actions
 
-	actions = []
-	for unoffset_pos, at, offset in zip(data["energy_to_pos"], data["beats"], data["offsets"]):
-		# up
-		intermediate_at = (at + last_at) / 2
-		pos = unoffset_pos + offset
-		actions += peaks[int(overflow)](pos, intermediate_at, last_pos, last_at)
-		last_at = intermediate_at
-		last_pos = pos
-
-		# down
-		pos = (unoffset_pos * -1) + offset
-		actions += peaks[int(overflow)](pos, at, last_pos, last_at)
-		last_at = at
-		last_pos = pos
+def create_actions_barrier_array(data, start_time=0, overflow=0):
+	energy_to_pos = np.asarray(data["energy_to_pos"])
+	beats = np.asarray(data["beats"], dtype=np.float64)
+	offsets = np.asarray(data["offsets"])
+	n = min(len(energy_to_pos), len(beats), len(offsets))
+	energy_to_pos, beats, offsets = energy_to_pos[:n], beats[:n], offsets[:n]
+	if n == 0:
+		return np.empty(0, dtype=ACTION_DTYPE)
+
+	# Interleave the up and down strokes of every beat
+	# Positions keep the feature dtype so overflow handling rounds like the scalar path
+	pos_dtype = np.result_type(energy_to_pos, offsets, np.float32)
+	at = np.empty(2 * n, dtype=np.float64)
+	pos = np.empty(2 * n, dtype=pos_dtype)
+	last_at = np.empty(2 * n, dtype=np.float64)
+	last_pos = np.empty(2 * n, dtype=pos_dtype)
+
+	beat_last_at = np.concatenate(([start_time], beats[:-1])).astype(np.float64)
+	at[0::2] = (beats + beat_last_at) / 2
+	at[1::2] = beats
+	pos[0::2] = energy_to_pos + offsets
+	pos[1::2] = (energy_to_pos * -1) + offsets
+
+	last_at[0] = start_time
+	last_at[1:] = at[:-1]
+	last_pos[0] = 50
+	last_pos[1:] = pos[:-1]
+
+	return _overflow_points(pos, at, last_pos, last_at, int(overflow))
 
-	return actions
+def create_actions_barrier(data, start_time=0, overflow=0):
+	return create_actions_barrier_array(data, start_time=start_time, overflow=overflow).tolist()
 
-def create_actions(data, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0):
+def _prepare_actions(data, energy_multiplier=1, pitch_range=100, amplitude_centering=0, center_offset=0):
 	processed_data = data.copy()
 	
 	normalized_pitch = normalize(processed_data["pitch"])
@@ -163,8 +591,24 @@ def create_actions(data, energy_multiplier=1, pitch_range=100, overflow=0, ampli
 	)
 	
 	processed_data["energy_to_pos"] = normalized_energy * energy_multiplier * 50
-	
-	return create_actions_barrier(processed_data, overflow=overflow)
+
+	return processed_data
+
+def create_actions_array(data, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0, profiler=None):
+	with stage(profiler, "prepare"):
+		processed_data = _prepare_actions(data, energy_multiplier, pitch_range, amplitude_centering, center_offset)
+	with stage(profiler, "peaks"):
+		return create_actions_barrier_array(processed_data, overflow=overflow)
+
+def create_actions(data, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0):
+	return create_actions_array(
+		data,
+		energy_multiplier=energy_multiplier,
+		pitch_range=pitch_range,
+		overflow=overflow,
+		amplitude_centering=amplitude_centering,
+		center_offset=center_offset
+	).tolist()
 
 def _speed(A, B, smax=400.0):
 	v = abs(B[1] - A[1]) / (B[0] - A[0])
@@ -172,98 +616,210 @@ def _speed(A, B, smax=400.0):
 def speed(A,B, **kwargs):
 	return max(min(_speed(A,B, **kwargs),1.0),0.0)
 
-def autoval(data, tpi=15, target_speed=300, v2above=0.6, opt=1):
-	def cmean(pitch):
-		result = create_actions(data, energy_multiplier=0, center_offset=pitch)
-		_,Y = map(list, zip(*result))
-		return np.average(Y)
-
-	def pdst(p):
-		a,b = cmean(p), tpi
-		return abs(a - b)
-
-	pres = minimize(pdst, (100,), method="Nelder-Mead", bounds=((-200,200),))
-	pres = pres.x[0]
-
-	def cemean(energy):
-		result = create_actions(data, energy_multiplier=energy, pitch_range=pres)
-		speeds = np.array([_speed(result[i],result[i+1],smax=1.0) for i in range(len(result)-1)], dtype=np.float32)
+class AutomapModel:
+	# Automap only ever renders with crop and without amplitude centering,
+	# so every objective reduces to clipping two strokes per beat
+	def __init__(self, data, cache_size=1024):
+		self.normalized_pitch = normalize(data["pitch"])
+		self.normalized_energy = normalize(data["energy"])
+
+		beats = np.asarray(data["beats"], dtype=np.float64)
+		n = min(len(beats), len(self.normalized_energy))
+		self.normalized_pitch = self.normalized_pitch[:n]
+		self.normalized_energy = self.normalized_energy[:n]
+
+		at = np.empty(2 * n, dtype=np.float64)
+		at[0::2] = (beats[:n] + np.concatenate(([0], beats[:n - 1]))) / 2
+		at[1::2] = beats[:n]
+		self.at = at
+		self.deltas = np.diff(at)
+
+		self.cache_size = cache_size
+		self._cache = OrderedDict()
+
+	def _memo(self, key, fun):
+		if key in self._cache:
+			self._cache.move_to_end(key)
+			return self._cache[key]
+
+		value = fun()
+		self._cache[key] = value
+		if len(self._cache) > self.cache_size:
+			self._cache.popitem(last=False)
+		return value
+
+	def positions(self, energy_multiplier=0, pitch_range=100, center_offset=0):
+		offsets = self.normalized_pitch * pitch_range + (100 - pitch_range) / 2 + center_offset
+		energy_to_pos = self.normalized_energy * energy_multiplier * 50
+
+		pos = np.empty(2 * len(offsets), dtype=np.result_type(offsets, energy_to_pos))
+		pos[0::2] = energy_to_pos + offsets
+		pos[1::2] = (energy_to_pos * -1) + offsets
+		return np.clip(pos, 0, 100)
+
+	def speeds(self, energy_multiplier, pitch_range):
+		def compute():
+			travel = np.abs(np.diff(self.positions(energy_multiplier, pitch_range)))
+			with np.errstate(divide="ignore", invalid="ignore"):
+				speeds = (travel / self.deltas).astype(np.float32)
+			return travel, speeds
+		return self._memo(("speeds", float(energy_multiplier), float(pitch_range)), compute)
+
+	def cmean(self, pitch):
+		return self._memo(
+			("cmean", float(pitch)),
+			lambda: np.average(self.positions(center_offset=pitch))
+		)
+
+	def cemean(self, energy, pitch_range, target_speed, v2above):
+		_, speeds = self.speeds(energy, pitch_range)
 		return abs(np.average(speeds) - target_speed)
 
 	# V2 works abit like lazy clustering
 	# I should do more clustering
-	def cemeanv2(energy):
-		result = create_actions(data, energy_multiplier=energy, pitch_range=pres)
-		speeds = np.array([_speed(result[i], result[i+1], smax=1.0) for i in range(len(result) - 1)], dtype=np.float32)
-		
+	def cemeanv2(self, energy, pitch_range, target_speed, v2above):
+		_, speeds = self.speeds(energy, pitch_range)
+
 		# Counting the number of speeds above the target speed
 		above_target = np.sum(speeds > target_speed)
 		# Calculate the percentage of speeds above the target speed
 		percentage_above_target = above_target / len(speeds)
-		
+
 		# Ensure at least 20% of speeds are above the target speed
 		return abs(percentage_above_target - v2above) # Ensure 20% (0.2) are above the target speed
 
-	def celen(energy):
-		result = create_actions(data, energy_multiplier=energy, pitch_range=pres)
-		actual_percentage = np.mean([abs(result[i][1] - result[i+1][1])/100 for i in range(len(result) - 1)], dtype=np.float64)
+	def celen(self, energy, pitch_range, target_speed, v2above):
+		travel, _ = self.speeds(energy, pitch_range)
+		actual_percentage = np.mean(travel / 100, dtype=np.float64)
 		return abs(actual_percentage - v2above)
 
-	optimizers = [
-		cemean,
-		cemeanv2,
-		celen
-	]
-	eres = minimize(optimizers[opt], (10,), method="Nelder-Mead", bounds=((0,100),), options={'xatol': 1e-10, 'disp': True})
+	optimizers = ["cemean", "cemeanv2", "celen"]
+
+def action_speeds(actions):
+	if isinstance(actions, np.ndarray) and actions.dtype.names:
+		at, pos = actions["at"], actions["pos"]
+	else:
+		at, pos = np.asarray(actions, dtype=np.float64).reshape(-1, 2).T
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		return np.abs(np.diff(pos)) / np.diff(at)
+
+class RenderPipeline:
+	# create_actions split into stages that each remember their last result,
+	# keyed by the parameters they depend on. Dragging one slider only redoes
+	# the stages downstream of it.
+	def __init__(self, data):
+		self.data = data
+		self.hits = {}
+		self._stages = {}
+
+	def _stage(self, name, key, fun):
+		cached = self._stages.get(name)
+		if cached is not None and cached[0] == key:
+			self.hits[name] = self.hits.get(name, 0) + 1
+			return cached[1]
+
+		value = fun()
+		self._stages[name] = (key, value)
+		return value
+
+	def normalized(self):
+		return self._stage("normalized", (), lambda: (
+			normalize(self.data["pitch"]),
+			normalize(self.data["energy"])
+		))
+
+	def offsets(self, pitch_range=100, amplitude_centering=0, center_offset=0):
+		def compute():
+			normalized_pitch, normalized_energy = self.normalized()
+			pitch_bias = (100 - pitch_range) / 2
+			return (
+				normalized_pitch[:len(normalized_energy)] * pitch_range +
+				pitch_bias +
+				amplitude_centering * normalized_energy +
+				center_offset
+			)
+		return self._stage("offsets", (pitch_range, amplitude_centering, center_offset), compute)
+
+	def energy_to_pos(self, energy_multiplier=1):
+		return self._stage("energy_to_pos", (energy_multiplier,), lambda: self.normalized()[1] * energy_multiplier * 50)
+
+	def actions(self, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0):
+		key = (energy_multiplier, pitch_range, overflow, amplitude_centering, center_offset)
+		return self._stage("actions", key, lambda: create_actions_barrier_array({
+			"beats": self.data["beats"],
+			"offsets": self.offsets(pitch_range, amplitude_centering, center_offset),
+			"energy_to_pos": self.energy_to_pos(energy_multiplier),
+		}, overflow=overflow))
+
+	def simplified(self, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0, simplify=None):
+		# simplify holds the keyword arguments of simplify.simplify, or None
+		key = (energy_multiplier, pitch_range, overflow, amplitude_centering, center_offset)
+		if (not simplify):
+			return self.actions(*key)
+		return self._stage("simplified", key + (tuple(sorted(simplify.items())),), lambda: simplify_actions(self.actions(*key), **simplify))
+
+	def speeds(self, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0, simplify=None):
+		key = (energy_multiplier, pitch_range, overflow, amplitude_centering, center_offset)
+		def compute():
+			actions = self.simplified(*key, simplify=simplify)
+			# Zero-length steps get a huge but finite speed instead of inf/nan
+			return np.abs(np.diff(actions["pos"])) / np.maximum(np.diff(actions["at"]), 1e-9)
+		return self._stage("speeds", key + (tuple(sorted((simplify or {}).items())),), compute)
+
+def autoval(data, tpi=15, target_speed=300, v2above=0.6, opt=1, progress=None, profiler=None, verbose=False):
+	# progress(stage, iteration, objective) is called after every Nelder-Mead
+	# iteration, raising from it aborts the optimization. verbose prints
+	# scipy's convergence message for the energy fit.
+	with stage(profiler, "import"):
+		from scipy.optimize import minimize
+
+	with stage(profiler, "model"):
+		model = data if isinstance(data, AutomapModel) else AutomapModel(data)
+
+	def report(stage, fun):
+		if progress is None:
+			return None
+		iteration = 0
+		def callback(xk):
+			nonlocal iteration
+			iteration += 1
+			# Objectives are memoized, so this doesn't cost an extra evaluation
+			progress(stage, iteration, fun(xk))
+		return callback
+
+	def pdst(p):
+		a,b = model.cmean(p[0]), tpi
+		return abs(a - b)
+
+	with stage(profiler, "pitch"):
+		pres = minimize(pdst, (100,), method="Nelder-Mead", bounds=((-200,200),), callback=report("pitch", pdst))
+	pres = pres.x[0]
+
+	objective = getattr(model, AutomapModel.optimizers[opt])
+	def edst(e):
+		return objective(e[0], pres, target_speed, v2above)
+
+	with stage(profiler, "energy"):
+		eres = minimize(edst, (10,), method="Nelder-Mead", bounds=((0,100),), options={'xatol': 1e-10, 'disp': verbose}, callback=report("energy", edst))
 	eres = eres.x[0]
 
 	return pres, eres
 
-#TODO: Do better
-def render_heatmap(data, energy, pitch, oor, amplitude_centering=0, center_offset=0, w=4096, h=128):
-	result = create_actions(
-		data, 
-		energy_multiplier=energy, 
-		pitch_range = pitch,
-		overflow = oor,
-		amplitude_centering=amplitude_centering,
-		center_offset=center_offset
-	)
-	speeds = np.array([speed(result[i],result[i+1]) for i in range(len(result)-1)])
-	gradient = np.vstack([speeds]*h)
-
-	dpi = mpl.rcParams["figure.dpi"]
-	fig = Figure(figsize=(w/dpi, h/dpi), tight_layout=True)
-	plot = fig.add_subplot(111)
-	plot.imshow(gradient, cmap=HEATMAP, interpolation="lanczos")
-	plot.axis("off")
-	return fig
-
-def dump_csv(f, data):
-	for at, pos in data:
-		f.write(f"{at*1000},{round(pos)}\n")
-
-def dump_funscript(f, data):
-	return dump({
-		"actions": [{"at": int(at*1000), "pos": round(pos)} for at,pos in data],
-		"inverted": False,
-		"metadata": {
-			"creator": "PythonDancer",
-			"description": "",
-			"duration": int(data[-1][0]),
-			"license": "None",
-			"notes": "",
-			"performers": [],
-			"script_url": "",
-			"tags": [],
-			"title": "",
-			"type": "basic",
-			"video_url": "",
-		},
-		"range": 100,
-		"version": "1.0",
-	}, f)
-
-if __name__ == "__main__":
-	data = load_audio_data("/mnt/newfiles/Video/MBad2/inter_cgi/SUPERNOVA 2 - HMV⧸PMV [COMBOBEAT] [3373395].mp4")
-	print(data)
\ No newline at end of file
+def render_heatmap(data, energy, pitch, oor, amplitude_centering=0, center_offset=0, w=4096, h=128, profiler=None):
+	# Returns an (h, w, 3) uint8 image with time on the x axis, see heatmap.save_png
+	with stage(profiler, "actions"):
+		result = create_actions_array(
+			data, 
+			energy_multiplier=energy, 
+			pitch_range = pitch,
+			overflow = oor,
+			amplitude_centering=amplitude_centering,
+			center_offset=center_offset,
+			profiler=profiler
+		)
+	duration = max(data.get("at", 0), result["at"][-1] if len(result) > 0 else 0)
+	with stage(profiler, "speeds"):
+		columns = speed_columns(result["at"], result["pos"], w, duration)
+	with stage(profiler, "rasterize"):
+		return rasterize(columns, h)
@@ -0,0 +1,39 @@
+import numpy as np
+
+def minmax_indices(x, y, width, xlim=None):
+	# Indices of the points worth drawing at `width` pixels: the min and max
+	# of every pixel column inside xlim, plus one neighbour on each side so
+	# lines still leave the visible area. x must be sorted.
+	x = np.asarray(x)
+	y = np.asarray(y)
+	n = len(x)
+	if n == 0:
+		return np.zeros(0, dtype=np.intp)
+
+	lo, hi = (x[0], x[-1]) if xlim is None else xlim
+	i0 = max(0, int(np.searchsorted(x, lo, side="left")) - 1)
+	i1 = min(n, int(np.searchsorted(x, hi, side="right")) + 1)
+
+	width = max(1, int(width))
+	if i1 - i0 <= 4 * width:
+		return np.arange(i0, i1)
+
+	xs, ys = x[i0:i1], y[i0:i1]
+	span = (hi - lo) or 1
+	bins = np.clip(((xs - lo) / span * width).astype(np.int64), -1, width)
+
+	# Sort by column, then value: the first and last of each run are min and max
+	order = np.lexsort((ys, bins))
+	runs = bins[order]
+	starts = np.flatnonzero(np.r_[True, runs[1:] != runs[:-1]])
+	ends = np.r_[starts[1:], len(runs)] - 1
+
+	keep = np.unique(np.concatenate((order[starts], order[ends], [0, len(xs) - 1])))
+	return keep + i0
+
+def segment_max(values, idx):
+	# values holds one entry per original segment (i -> i+1), the result one
+	# entry per decimated segment (idx[k] -> idx[k+1])
+	if len(idx) < 2:
+		return np.zeros(0, dtype=np.asarray(values).dtype)
+	return np.maximum.reduceat(np.asarray(values)[:idx[-1]], idx[:-1])
@@ -0,0 +1,91 @@
+import json
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+class Profiler:
+	# Wall time per named stage, and with memory=True the tracemalloc peak
+	# above what was allocated when the stage started. Stages nest, a stage's
+	# row is keyed by its path ("load/decode"), repeated stages accumulate.
+	# on_stage(name) is called whenever a stage starts.
+	def __init__(self, memory=False, on_stage=None):
+		self.memory = memory
+		self.on_stage = on_stage
+		self.rows = {}
+		self._stack = []
+		self._started = None
+
+	@contextmanager
+	def stage(self, name):
+		path = "/".join([s["name"] for s in self._stack] + [name])
+		row = self.rows.setdefault(path, {"name": path, "depth": len(self._stack), "calls": 0, "time": 0.0})
+		frame = {"name": name, "row": row, "base": 0, "peak": 0}
+
+		if self.memory:
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+				self._started = frame
+			current, peak = tracemalloc.get_traced_memory()
+			self._carry(peak)
+			tracemalloc.reset_peak()
+			frame["base"] = frame["peak"] = current
+
+		self._stack.append(frame)
+		if self.on_stage is not None:
+			self.on_stage(name)
+
+		start = perf_counter()
+		try:
+			yield
+		finally:
+			row["time"] += perf_counter() - start
+			row["calls"] += 1
+			self._stack.pop()
+
+			if self.memory:
+				frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+				tracemalloc.reset_peak()
+				self._carry(frame["peak"])
+				row["peak_mb"] = max(row.get("peak_mb", 0.0), (frame["peak"] - frame["base"]) / (1024 * 1024))
+				if self._started is frame:
+					tracemalloc.stop()
+					self._started = None
+
+	def _carry(self, peak):
+		# Peaks are reset per stage, the enclosing stages keep the maximum
+		for s in self._stack:
+			s["peak"] = max(s["peak"], peak)
+
+	def report(self):
+		total = sum(r["time"] for r in self.rows.values() if r["depth"] == 0)
+		return {"total": total, "stages": [dict(r) for r in self.rows.values()]}
+
+def stage(profiler, name):
+	# profiler.stage(name), or nothing without a profiler
+	return profiler.stage(name) if profiler is not None else nullcontext()
+
+def format_table(report):
+	rows = [("Stage", "Calls", "Time", "Share", "Peak")]
+	total = report["total"] or 1.0
+	for r in report["stages"]:
+		rows.append((
+			"  " * r["depth"] + r["name"].rpartition("/")[2],
+			str(r["calls"]),
+			f"{r['time']*1000:.0f} ms",
+			f"{r['time']/total*100:.1f}%",
+			f"{r['peak_mb']:.1f} MiB" if "peak_mb" in r else "-"
+		))
+	rows.append(("total", "", f"{report['total']*1000:.0f} ms", "", ""))
+
+	widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+	lines = []
+	for i, row in enumerate(rows):
+		lines.append("  ".join(c.ljust(w) if j == 0 else c.rjust(w) for j, (c, w) in enumerate(zip(row, widths))).rstrip())
+		if i == 0 or i == len(rows) - 2:
+			lines.append("  ".join("-" * w for w in widths))
+	return "\n".join(lines)
+
+def format_report(report, fmt="table"):
+	if fmt == "json":
+		return json.dumps(report, indent="\t")
+	return format_table(report)
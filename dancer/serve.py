@@ -0,0 +1,540 @@
+import io
+import os
+import sys
+import copy
+import json
+import math
+import queue
+import argparse
+import threading
+import multiprocessing as mp
+from pathlib import Path
+from time import perf_counter
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import numpy as np
+
+from .libfun import autoval, block_frames_for, create_actions_array, load_audio_data
+from .export import dump_csv, dump_funscript
+from .simplify import simplify
+from .cache import cache_from_args
+from .cli import simplify_options
+from .util import cli_args
+from .jit import configure_numba_cache, warm_up as _warm_up
+
+# Request fields, named after the CLI flags. The analysis ones pick the
+# analysis, the rest only change how it is turned into actions.
+ANALYSIS_FIELDS = {
+	"no_plp": bool,
+	"convert": bool,
+	"pitch_method": str,
+	"analysis_sr": int,
+	"max_memory": int,
+}
+RENDER_FIELDS = {
+	"energy": float,
+	"pitch": float,
+	"overflow": int,
+	"amplitude_centering": float,
+	"center_offset": float,
+	"automap": bool,
+	"auto_pitch": int,
+	"auto_speed": int,
+	"auto_per": int,
+	"auto_mod": int,
+	"csv": bool,
+	"csv_precision": int,
+	"drop_collinear": bool,
+	"simplify": float,
+	"min_interval": int,
+	"max_speed": int,
+}
+
+# Lower bounds the CLI leaves unchecked, 0 keeps meaning "off" where it does
+MINIMUM = {
+	"analysis_sr": 1,
+	"max_memory": 1,
+	"auto_speed": 1,
+	"csv_precision": 0,
+	"simplify": 0,
+	"min_interval": 0,
+	"max_speed": 0,
+}
+
+# The CLI's argparse actions, so requests get the same choices and ranges
+CLI_ACTIONS = {action.dest: action for action in cli_args()._actions}
+
+class ServeError(Exception):
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+def parse_request(body, defaults):
+	# JSON object with a path and any of the fields above, missing fields
+	# take the CLI defaults
+	try:
+		request = json.loads(body or b"{}")
+	except ValueError as e:
+		raise ServeError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+	if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+		raise ServeError(HTTPStatus.BAD_REQUEST, "Expected a JSON object with a path")
+
+	args = copy.copy(defaults)
+	fields = dict(ANALYSIS_FIELDS, **RENDER_FIELDS)
+	for name, value in request.items():
+		if name in ("path", "timeout"):
+			continue
+		if name not in fields:
+			raise ServeError(HTTPStatus.BAD_REQUEST, f"Unknown field {name!r}")
+		if (not valid_field(name, fields[name], value)):
+			raise ServeError(HTTPStatus.BAD_REQUEST, f"Invalid {name}: {value!r}")
+		setattr(args, name, None if value is None else fields[name](value))
+
+	timeout = request.get("timeout")
+	if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+		raise ServeError(HTTPStatus.BAD_REQUEST, f"Invalid timeout: {timeout!r}")
+
+	path = Path(request["path"])
+	if not path.is_file():
+		raise ServeError(HTTPStatus.NOT_FOUND, f"No such file: {path}")
+	return path, args, timeout
+
+def valid_field(name, kind, value):
+	# Only the JSON type of the field, no coercion, within the CLI's limits
+	action = CLI_ACTIONS[name]
+	if (value is None):
+		return action.default is None
+	if (kind is bool):
+		return isinstance(value, bool)
+	if (isinstance(value, bool)):
+		return False
+	if (kind is str):
+		ok = isinstance(value, str)
+	elif (kind is int):
+		ok = isinstance(value, int)
+	else:
+		ok = isinstance(value, (int, float)) and math.isfinite(value)
+	if (not ok):
+		return False
+
+	choices = action.choices
+	if (isinstance(choices, range)):
+		# Whole steps on the CLI, floats may lie in between
+		ok = choices.start <= value <= choices[-1]
+	elif (choices is not None):
+		ok = value in choices
+	return ok and value >= MINIMUM.get(name, value)
+
+def analysis_key(path, args):
+	# The file's identity plus the options the analysis depends on, a
+	# rewritten file gets a new key
+	st = path.stat()
+	return (str(path.resolve()), st.st_size, st.st_mtime_ns) + tuple(getattr(args, name) for name in ANALYSIS_FIELDS)
+
+_worker_cache = None
+
+def _init_worker(cache_args, warm_up):
+	# The first real request shouldn't pay for compiling the numba kernels
+	global _worker_cache
+	_worker_cache = cache_from_args(cache_args)
+	if (warm_up):
+		_warm_up()
+
+def _ready():
+	return os.getpid()
+
+def _analyze(path, args):
+	data = load_audio_data(
+		path,
+		plp=not args.no_plp,
+		cache=_worker_cache,
+		ffmpeg=args.convert,
+		pitch_method=args.pitch_method,
+		analysis_sr=args.analysis_sr,
+		block_frames=block_frames_for(args.max_memory) if args.max_memory else None
+	)
+	# Cache hits are mapped from disk, send plain arrays back
+	return {k: np.array(v) if isinstance(v, np.ndarray) else v for k, v in data.items()}
+
+def _actions(data, args):
+	if (args.automap):
+		args.pitch, args.energy = autoval(data, tpi=args.auto_pitch, target_speed=args.auto_speed, v2above=args.auto_per/100.0, opt=(args.auto_mod-1))
+
+	actions = create_actions_array(
+		data,
+		energy_multiplier=args.energy,
+		pitch_range=args.pitch,
+		overflow=args.overflow,
+		amplitude_centering=args.amplitude_centering,
+		center_offset=args.center_offset
+	)
+	if (simplify_options(args)):
+		actions = simplify(actions, **simplify_options(args))
+	return actions
+
+def _worker_main(conn, cache_args, warm_up):
+	# (function, args) in, ("done", result) or ("error", message) out
+	_init_worker(cache_args, warm_up)
+	while True:
+		try:
+			fun, args = conn.recv()
+		except (EOFError, OSError):
+			return
+		try:
+			result = ("done", fun(*args))
+		except Exception as e:
+			result = ("error", str(e) or type(e).__name__)
+		conn.send(result)
+
+# Workers are started from handler threads, forking a threaded process can
+# copy a lock someone else holds
+_mp = mp.get_context("spawn")
+
+class WorkerError(Exception):
+	pass
+
+class Worker:
+	# One process running one job at a time. Unlike a pool worker it can be
+	# killed on its own when its job overruns.
+	def __init__(self, cache_args, warm_up):
+		self.conn, child = _mp.Pipe()
+		self.process = _mp.Process(target=_worker_main, args=(child, cache_args, warm_up), name="dancer-serve", daemon=True)
+		self.process.start()
+		child.close()
+
+	def call(self, fun, args, timeout=None):
+		# Raises TimeoutError past timeout, EOFError or OSError if the
+		# process died and WorkerError if fun raised
+		self.conn.send((fun, args))
+		if not self.conn.poll(timeout):
+			raise TimeoutError()
+		kind, value = self.conn.recv()
+		if (kind == "error"):
+			raise WorkerError(value)
+		return value
+
+	def kill(self):
+		self.process.kill()
+		self.process.join()
+		self.conn.close()
+
+class Analyses:
+	# The last `size` analyses in memory, least recently used first out.
+	# The first request for an analysis computes it on its own thread, the
+	# ones arriving while it runs wait on the same future.
+	def __init__(self, size):
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._done = OrderedDict()
+		self._pending = {}
+
+	def get(self, key, compute, timeout=None):
+		with self._lock:
+			if key in self._done:
+				self._done.move_to_end(key)
+				self.hits += 1
+				return self._done[key]
+			future = self._pending.get(key)
+			if future is None:
+				self.misses += 1
+				future = self._pending[key] = Future()
+				owner = True
+			else:
+				self.hits += 1
+				owner = False
+
+		if (not owner):
+			return future.result(timeout=timeout)
+
+		try:
+			data = compute()
+		except BaseException as e:
+			with self._lock:
+				self._pending.pop(key, None)
+			future.set_exception(e)
+			raise
+
+		with self._lock:
+			self._pending.pop(key, None)
+			self._done[key] = data
+			while len(self._done) > self.size:
+				self._done.popitem(last=False)
+		future.set_result(data)
+		return data
+
+	def stats(self):
+		with self._lock:
+			return {"cached": len(self._done), "pending": len(self._pending), "hits": self.hits, "misses": self.misses}
+
+class Service:
+	# Admits at most jobs + queue_size requests and runs analyses and action
+	# rendering on jobs worker processes. Every step of a request runs on a
+	# worker under the request's deadline, a worker still busy at the
+	# deadline is killed and replaced, as is one that died.
+	def __init__(self, jobs=2, queue_size=16, timeout=300.0, analyses=32, cache_args=None, warm_up=True):
+		self.jobs = jobs
+		self.queue_size = queue_size
+		self.timeout = timeout
+		self.defaults = cli_args().parse_args([])
+		self.analyses = Analyses(analyses)
+		self.counts = {"requests": 0, "completed": 0, "rejected": 0, "timeouts": 0, "failed": 0, "restarts": 0}
+		self.active = 0
+		self.running = 0
+
+		self._lock = threading.Lock()
+		self._admitted = threading.BoundedSemaphore(jobs + queue_size)
+		self._worker_args = (cache_args or self.defaults, warm_up)
+		self._workers = set()
+		self._idle = queue.Queue()
+		for _ in range(jobs):
+			self._idle.put(self._spawn())
+
+	def _spawn(self):
+		worker = Worker(*self._worker_args)
+		with self._lock:
+			self._workers.add(worker)
+		return worker
+
+	def _replace(self, worker):
+		worker.kill()
+		with self._lock:
+			self._workers.discard(worker)
+			self.counts["restarts"] += 1
+		return self._spawn()
+
+	def start(self):
+		# Wait until every worker is up and warm before the first request
+		workers = [self._idle.get() for _ in range(self.jobs)]
+		try:
+			return sorted(w.call(_ready, ()) for w in workers)
+		finally:
+			for w in workers:
+				self._idle.put(w)
+
+	def close(self):
+		with self._lock:
+			workers, self._workers = list(self._workers), set()
+		for w in workers:
+			w.kill()
+
+	def count(self, name, active=0, running=0):
+		with self._lock:
+			if name:
+				self.counts[name] += 1
+			self.active += active
+			self.running += running
+
+	def render(self, body):
+		# Returns (content type, write(f)), raises ServeError
+		path, args, timeout = parse_request(body, self.defaults)
+		timeout = min(timeout, self.timeout) if timeout else self.timeout
+		deadline = perf_counter() + timeout
+
+		self.count("requests")
+		if not self._admitted.acquire(blocking=False):
+			self.count("rejected")
+			raise ServeError(HTTPStatus.SERVICE_UNAVAILABLE, "Job queue is full")
+
+		self.count(None, active=1)
+		try:
+			result = self._render(path, args, deadline)
+		finally:
+			self.count(None, active=-1)
+			self._admitted.release()
+
+		self.count("completed")
+		return result
+
+	def _call(self, deadline, what, fun, *args):
+		# fun(*args) on the next idle worker, within the deadline
+		try:
+			worker = self._idle.get(timeout=max(0.0, deadline - perf_counter()))
+		except queue.Empty:
+			self.count("timeouts")
+			raise ServeError(HTTPStatus.GATEWAY_TIMEOUT, "Timed out waiting for a worker")
+
+		self.count(None, running=1)
+		try:
+			# Idle workers never write, a readable pipe is an exited process
+			if (not worker.process.is_alive() or worker.conn.poll()):
+				worker = self._replace(worker)
+			return worker.call(fun, args, timeout=max(0.0, deadline - perf_counter()))
+		except TimeoutError:
+			# Hung jobs (a stuck decoder) would hold the worker for good
+			worker = self._replace(worker)
+			self.count("timeouts")
+			raise ServeError(HTTPStatus.GATEWAY_TIMEOUT, f"Timed out {what}")
+		except (EOFError, OSError):
+			worker = self._replace(worker)
+			self.count("failed")
+			raise ServeError(HTTPStatus.INTERNAL_SERVER_ERROR, f"Worker died {what}")
+		except WorkerError as e:
+			self.count("failed")
+			raise ServeError(HTTPStatus.UNPROCESSABLE_ENTITY, f"Failed {what}: {e}")
+		finally:
+			self.count(None, running=-1)
+			self._idle.put(worker)
+
+	def _render(self, path, args, deadline):
+		try:
+			data = self.analyses.get(analysis_key(path, args), lambda: self._call(deadline, "analyzing audio", _analyze, path, args), timeout=max(0.0, deadline - perf_counter()))
+		except TimeoutError:
+			# Waited on another request's analysis
+			self.count("timeouts")
+			raise ServeError(HTTPStatus.GATEWAY_TIMEOUT, "Timed out analyzing audio")
+
+		actions = self._call(deadline, "rendering actions", _actions, data, args)
+		if (args.csv):
+			return "text/csv", lambda f: dump_csv(f, actions, precision=args.csv_precision, drop_collinear=args.drop_collinear)
+		return "application/json", lambda f: dump_funscript(f, actions, drop_collinear=args.drop_collinear)
+
+	def status(self):
+		with self._lock:
+			status = {"jobs": self.jobs, "queue_size": self.queue_size, "active": self.active, "running": self.running}
+			status.update(self.counts)
+		status["analyses"] = self.analyses.stats()
+		return status
+
+class Handler(BaseHTTPRequestHandler):
+	# POST /funscript with a JSON request streams the script back, GET /status
+	# reports the queue and counters
+	server_version = "PythonDancer"
+
+	def address_string(self):
+		# Unix sockets have no peer address
+		return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+	def log_message(self, format, *args):
+		if not self.server.quiet:
+			super().log_message(format, *args)
+
+	def send_json(self, status, obj):
+		body = json.dumps(obj).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		if (status == HTTPStatus.SERVICE_UNAVAILABLE):
+			self.send_header("Retry-After", "1")
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path == "/status":
+			self.send_json(HTTPStatus.OK, self.server.service.status())
+		else:
+			self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+	def do_POST(self):
+		if self.path != "/funscript":
+			self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+			return
+
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		try:
+			content_type, write = self.server.service.render(body)
+		except ServeError as e:
+			self.send_json(e.status, {"error": str(e)})
+			return
+		except Exception as e:
+			self.server.service.count("failed")
+			self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e) or type(e).__name__})
+			return
+
+		# No length up front, the script is written as it is generated and
+		# the connection closes after it
+		self.send_response(HTTPStatus.OK)
+		self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+		self.send_header("Connection", "close")
+		self.end_headers()
+		f = io.TextIOWrapper(self.wfile, encoding="utf8")
+		try:
+			write(f)
+			f.flush()
+		finally:
+			f.detach()
+
+class HTTPServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+	daemon_threads = True
+
+	def server_bind(self):
+		# A socket file left over from an earlier run would fail the bind
+		if os.path.exists(self.server_address) and not os.path.isfile(self.server_address):
+			os.unlink(self.server_address)
+		super().server_bind()
+
+def make_server(service, host="127.0.0.1", port=8765, socket_path=None, quiet=False):
+	if (socket_path):
+		server = UnixHTTPServer(socket_path, Handler)
+	else:
+		server = HTTPServer((host, port), Handler)
+	server.service = service
+	server.quiet = quiet
+	return server
+
+def serve_args():
+	parser = argparse.ArgumentParser(
+		prog="dancer serve",
+		description="Keep analysis workers warm and serve funscripts over local HTTP",
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter
+	)
+	parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+	parser.add_argument("--port", type=int, default=8765, help="Port to listen on, 0 picks a free one")
+	parser.add_argument("--socket", default=None, metavar="PATH", help="Listen on a Unix socket instead of TCP")
+	parser.add_argument("-j", "--jobs", type=int, default=2, help="Worker processes, also the number of jobs running at once")
+	parser.add_argument("--queue_size", type=int, default=16, help="Jobs waiting for a worker before requests are turned away with 503")
+	parser.add_argument("--timeout", type=float, default=300, metavar="SECONDS", help="Longest a job may take, requests may ask for less")
+	parser.add_argument("--analyses", type=int, default=32, help="Analyses kept in memory for repeated requests")
+	parser.add_argument("--no_warm_up", dest="warm_up", help="Skip compiling the analysis kernels at startup", action="store_false")
+	parser.add_argument("--numba_cache_dir", default=None, metavar="DIR", help="Where numba keeps compiled analysis kernels")
+	parser.add_argument("--no_cache", help="Bypass the analysis cache", action="store_true")
+	parser.add_argument("--clear_cache", help="Empty the analysis cache", action="store_true")
+	parser.add_argument("--cache_dir", default=None, help="Analysis cache directory (default: user cache dir)")
+	parser.add_argument("--cache_size", type=int, default=1024, metavar="MB", help="Analysis cache size limit")
+	parser.add_argument("-q", "--quiet", help="Don't log requests", action="store_true")
+	return parser
+
+def main(argv=None):
+	args = serve_args().parse_args(argv)
+	configure_numba_cache(args.numba_cache_dir)
+
+	# The parent clears the cache once, workers only open it
+	cache_from_args(args)
+	args.clear_cache = False
+
+	service = Service(args.jobs, args.queue_size, args.timeout, args.analyses, cache_args=args, warm_up=args.warm_up)
+	try:
+		server = make_server(service, args.host, args.port, args.socket, args.quiet)
+	except OSError as e:
+		service.close()
+		print(f"Can't listen: {e}")
+		return 1
+
+	print(f"Starting {args.jobs} workers...", flush=True)
+	service.start()
+	if (args.socket):
+		print(f"Serving on {args.socket}", flush=True)
+	else:
+		print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]}", flush=True)
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.close()
+		if (args.socket and os.path.exists(args.socket)):
+			os.unlink(args.socket)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,115 @@
+import numpy as np
+
+def turning_points(pos, tolerance):
+	# Peaks and troughs with a stroke longer than tolerance on both sides
+	rise = np.diff(pos)
+	turn = (rise[:-1] * rise[1:] < 0) & (np.minimum(np.abs(rise[:-1]), np.abs(rise[1:])) > tolerance)
+	return np.flatnonzero(turn) + 1
+
+def rdp_mask(at, pos, tolerance):
+	# Ramer-Douglas-Peucker on the position track. Distances are vertical, in
+	# position units, since that is the error a player shows. All segments of
+	# one recursion level are split together.
+	#
+	# Clear strokes are pinned before recursing. Plain RDP keeps them anyway in
+	# all but contrived cases, but on a dense zigzag it peels them off one per
+	# level, which is quadratic.
+	n = len(at)
+	keep = np.zeros(n, dtype=bool)
+	if n <= 2:
+		keep[:] = True
+		return keep
+
+	pinned = np.concatenate(([0], turning_points(pos, tolerance), [n - 1]))
+	keep[pinned] = True
+	starts, ends = pinned[:-1], pinned[1:]
+	while len(starts) > 0:
+		lengths = ends - starts - 1
+		active = lengths > 0
+		starts, ends, lengths = starts[active], ends[active], lengths[active]
+		if len(starts) == 0:
+			break
+
+		# Interior points of every segment, laid out segment after segment
+		first = np.cumsum(lengths) - lengths
+		seg = np.repeat(np.arange(len(starts)), lengths)
+		idx = np.arange(lengths.sum()) - first[seg] + starts[seg] + 1
+
+		t0, t1 = at[starts][seg], at[ends][seg]
+		p0, p1 = pos[starts][seg], pos[ends][seg]
+		dt = t1 - t0
+		with np.errstate(divide="ignore", invalid="ignore"):
+			frac = np.where(dt > 0, (at[idx] - t0) / dt, 0)
+		dist = np.abs(pos[idx] - (p0 + frac * (p1 - p0)))
+
+		# Split each segment at its farthest point, if that is out of tolerance
+		farthest = np.maximum.reduceat(dist, first)
+		candidates = np.flatnonzero((dist == farthest[seg]) & (farthest[seg] > tolerance))
+		split_seg, pick = np.unique(seg[candidates], return_index=True)
+		split = idx[candidates[pick]]
+
+		keep[split] = True
+		starts = np.concatenate((starts[split_seg], split))
+		ends = np.concatenate((split, ends[split_seg]))
+	return keep
+
+def interval_mask(at, min_interval):
+	# Greedily keep points at least min_interval after the last kept one, the
+	# last point always stays. Jumps are found with one searchsorted, only the
+	# walk over kept points is sequential.
+	n = len(at)
+	keep = np.zeros(n, dtype=bool)
+	if n == 0:
+		return keep
+
+	following = np.searchsorted(at, at + min_interval, side="left").tolist()
+	i = 0
+	while i < n:
+		keep[i] = True
+		i = max(following[i], i + 1)
+
+	# Replace the last kept point by the final one if they are too close
+	last = np.flatnonzero(keep)[-1]
+	if last != n - 1:
+		if at[n - 1] - at[last] < min_interval and last > 0:
+			keep[last] = False
+		keep[n - 1] = True
+	return keep
+
+def clamp_speed(at, pos, max_speed):
+	# Limit every step to max_speed by pulling the later point towards the
+	# earlier one. That is a recurrence, but it only carries on while points
+	# get clamped, so the loop runs over the clamped points alone.
+	pos = np.array(pos, dtype=np.float64)
+	reach = np.diff(at) * max_speed
+
+	# A run of clamped points ends at a point that is back in reach, from
+	# there on nothing changed, so the violations found up front stay valid
+	i = 0
+	for j in (np.flatnonzero(np.abs(np.diff(pos)) > reach) + 1).tolist():
+		if j < i:
+			continue
+		i = j
+		while i < len(pos):
+			lo, hi = pos[i - 1] - reach[i - 1], pos[i - 1] + reach[i - 1]
+			if lo <= pos[i] <= hi:
+				break
+			pos[i] = min(max(pos[i], lo), hi)
+			i += 1
+	return pos
+
+def simplify(actions, tolerance=0, min_interval=0, max_speed=None):
+	# actions is a structured array (see libfun.ACTION_DTYPE), min_interval is
+	# in seconds and max_speed in units per second like action_speeds
+	actions = np.asarray(actions)
+	if len(actions) == 0:
+		return actions
+
+	if (tolerance > 0):
+		actions = actions[rdp_mask(actions["at"], actions["pos"], tolerance)]
+	if (min_interval > 0):
+		actions = actions[interval_mask(actions["at"], min_interval)]
+	if (max_speed):
+		actions = actions.copy()
+		actions["pos"] = clamp_speed(actions["at"], actions["pos"], max_speed)
+	return actions
@@ -0,0 +1,148 @@
+import json
+import itertools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .libfun import RenderPipeline, action_speeds
+from .export import dump_csv, dump_funscript, open_output
+
+# Sweepable parameters, named after their CLI flags
+SWEEP_PARAMS = {
+	"energy": float,
+	"pitch": float,
+	"overflow": int,
+	"amplitude_centering": float,
+	"center_offset": float,
+}
+
+class SweepError(Exception):
+	pass
+
+def _check(params):
+	for name in params:
+		if name not in SWEEP_PARAMS:
+			raise SweepError(f"Can't sweep {name!r}, choose from {', '.join(SWEEP_PARAMS)}")
+	return {k: SWEEP_PARAMS[k](v) for k, v in params.items()}
+
+def expand_grid(grid):
+	names = list(grid)
+	return [_check(dict(zip(names, values))) for values in itertools.product(*grid.values())]
+
+def parse_sweep(specs):
+	# Each spec is either name=v1,v2,... (the grid is their cartesian product)
+	# or a JSON file holding such a grid as an object, or a list of parameter sets
+	variants, grid = [], {}
+	for spec in specs:
+		if spec.endswith(".json"):
+			with open(spec, encoding="utf8") as f:
+				loaded = json.load(f)
+			if isinstance(loaded, dict):
+				variants += expand_grid({k: v if isinstance(v, list) else [v] for k, v in loaded.items()})
+			else:
+				variants += [_check(v) for v in loaded]
+			continue
+
+		name, sep, values = spec.partition("=")
+		if not sep or not values:
+			raise SweepError(f"Expected name=value[,value...] or a .json file, got {spec!r}")
+		grid[name.strip()] = [v for v in values.split(",") if v.strip()]
+
+	if grid:
+		variants += expand_grid(grid)
+	return variants
+
+def variant_label(params):
+	return "_".join(f"{k}{v:g}" for k, v in params.items()) or "base"
+
+def variant_path(out_file, params):
+	# x.funscript -> x.energy10_pitch80.funscript, keeping a trailing .gz
+	out_file = Path(out_file)
+	gz = out_file.suffix == ".gz"
+	base = out_file.with_suffix("") if gz else out_file
+	return base.with_name(f"{base.stem}.{variant_label(params)}{base.suffix}{'.gz' if gz else ''}")
+
+def summary_path(out_file):
+	out_file = Path(out_file)
+	base = out_file.with_suffix("") if out_file.suffix == ".gz" else out_file
+	return base.with_name(f"{base.stem}.sweep.json")
+
+def speed_stats(actions):
+	speeds = action_speeds(actions)
+	speeds = speeds[np.isfinite(speeds)]
+	if len(speeds) == 0:
+		return {"mean": 0.0, "median": 0.0, "p90": 0.0, "max": 0.0}
+	p50, p90 = np.percentile(speeds, (50, 90))
+	return {
+		"mean": float(speeds.mean()),
+		"median": float(p50),
+		"p90": float(p90),
+		"max": float(speeds.max()),
+	}
+
+def _pipeline_key(params):
+	# Neighbours sharing the pitch-side parameters reuse the offsets stage
+	return (params["pitch"], params["amplitude_centering"], params["center_offset"], params["energy"], params["overflow"])
+
+def evaluate(pipeline, variants, out_file, options):
+	# variants are (params, overrides) pairs, files are named after the overrides
+	rows = []
+	for params, overrides in variants:
+		actions = pipeline.simplified(
+			params["energy"],
+			params["pitch"],
+			params["overflow"],
+			params["amplitude_centering"],
+			params["center_offset"],
+			simplify=options.get("simplify")
+		)
+
+		path = variant_path(out_file, overrides)
+		with open_output(path, compress=options.get("gzip") or None) as f:
+			if (options.get("csv")):
+				dump_csv(f, actions, precision=options.get("csv_precision"), drop_collinear=options.get("drop_collinear"))
+			else:
+				dump_funscript(f, actions, drop_collinear=options.get("drop_collinear"))
+
+		rows.append({
+			"params": params,
+			"out": str(path),
+			"actions": len(actions),
+			"speed": speed_stats(actions),
+		})
+	return rows
+
+_worker_pipeline = None
+
+def _init_worker(data):
+	global _worker_pipeline
+	_worker_pipeline = RenderPipeline(data)
+
+def _evaluate_chunk(variants, out_file, options):
+	return evaluate(_worker_pipeline, variants, out_file, options)
+
+def run_sweep(data, variants, base, out_file, options, jobs=1):
+	# variants override base, which holds every SWEEP_PARAMS entry. Returns
+	# the summary that is also written next to the outputs.
+	order = sorted(range(len(variants)), key=lambda i: _pipeline_key(dict(base, **variants[i])))
+	ordered = [(dict(base, **variants[i]), variants[i]) for i in order]
+
+	if jobs > 1 and len(ordered) > 1:
+		# Contiguous chunks so every worker still gets neighbouring variants
+		chunks = [c.tolist() for c in np.array_split(np.arange(len(ordered)), min(jobs, len(ordered)))]
+		with ProcessPoolExecutor(max_workers=len(chunks), initializer=_init_worker, initargs=(data,)) as pool:
+			futures = [pool.submit(_evaluate_chunk, [ordered[i] for i in c], out_file, options) for c in chunks]
+			rows = [row for future in futures for row in future.result()]
+	else:
+		rows = evaluate(RenderPipeline(data), ordered, out_file, options)
+
+	# Back to the order the variants were given in
+	results = [None] * len(rows)
+	for i, row in zip(order, rows):
+		results[i] = row
+
+	summary = {"beats": len(data["beats"]), "variants": results}
+	with open(summary_path(out_file), "w", encoding="utf8") as f:
+		json.dump(summary, f, indent="\t")
+	return summary
@@ -5,17 +5,20 @@ import sys, os, json
 from pathlib import Path
 
 from threading import Thread
+from time import perf_counter
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as FigureCanvas
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as FigureCanvas, NavigationToolbar2Tk
 
-from .cli import cmd
-
-from .libfun import load_audio_data, create_actions, dump_funscript, speed, autoval, render_heatmap, VERSION, HEATMAP
-from .util import cli_args, ffmpeg_check, ffmpeg_conv
+from .libfun import dump_funscript, speed, autoval, render_heatmap, AutomapModel, VERSION, HEATMAP
+from .util import cli_args, ffmpeg_check
+from .cache import cache_from_args
+from .jobs import Cancelled, Scheduler
+from .lod import minmax_indices, segment_max
+from .worker import Engine, Stale
 
 plt.style.use(["ggplot", "dark_background", "fast"])
 
@@ -56,6 +59,46 @@ def enableChildren(parent):
 		else:
 			enableChildren(child)
 
+class DecimatedPlot:
+	# Keeps the full data of its artists and only hands matplotlib the
+	# min/max points of each pixel column, redone whenever the x range changes
+	def __init__(self, ax, on_refresh=None):
+		self.ax = ax
+		self.on_refresh = on_refresh
+		self.artists = []
+		ax.callbacks.connect("xlim_changed", lambda ax: self.refresh())
+
+	def line(self, x, y, **kwargs):
+		artist, = self.ax.plot(x[:0], y[:0], **kwargs)
+		self.artists.append((artist, x, y, None))
+		return artist
+
+	def heat(self, x, y, speeds, **kwargs):
+		artist = LineCollection([], **kwargs)
+		self.ax.add_collection(artist)
+		self.artists.append((artist, x, y, speeds))
+		return artist
+
+	def refresh(self):
+		start = perf_counter()
+		width = max(1, int(self.ax.bbox.width))
+		xlim = tuple(sorted(self.ax.get_xlim()))
+
+		shown, total = 0, 0
+		for artist, x, y, speeds in self.artists:
+			idx = minmax_indices(x, y, width, xlim)
+			if speeds is None:
+				artist.set_data(x[idx], y[idx])
+			else:
+				points = np.stack((x[idx], y[idx]), axis=-1)
+				artist.set_segments(np.stack((points[:-1], points[1:]), axis=1))
+				artist.set_color(HEATMAP(np.clip(segment_max(speeds, idx) / 400.0, 0.0, 1.0)))
+			shown += len(idx)
+			total += len(x)
+
+		if self.on_refresh:
+			self.on_refresh(shown, total, perf_counter() - start)
+
 class ImageWorker:
 	progressed = None
 	finished = None
@@ -86,24 +129,56 @@ class ImageWorker:
 
 		self.progressed(100, "Done!")
 
+# Analysis stages in the order load_audio_data runs them, with their labels
+LOAD_STAGES = {
+	"cache": "Checking cache...",
+	"import": "Loading librosa...",
+	"decode": "Decoding audio...",
+	"resample": "Resampling...",
+	"features": "Extracting features...",
+	"stft": "Computing spectrogram...",
+	"onset": "Detecting onsets...",
+	"rms": "Measuring energy...",
+	"pitch": "Tracking pitch...",
+	"plp": "Estimating pulse...",
+	"beat_track": "Tracking beats...",
+	"segment": "Segmenting beats...",
+	"store": "Caching analysis...",
+}
+
 class LoadWorker(ImageWorker):
 	done = None
 
-	def __init__(self, size, fileName, data, plp):
+	def __init__(self, size, engine, fileName, data, plp, cache=None, ffmpeg=False, analysis_sr=None):
 		super().__init__()
 		self.w, self.h = size
+		self.engine = engine
 		self.fileName = fileName
 		self.data = data
 		self.plp = plp
+		self.cache = cache
+		self.ffmpeg = ffmpeg
+		self.analysis_sr = analysis_sr
+
+	def stage(self, name):
+		# Streamed stages repeat, the bar only moves forward
+		index = list(LOAD_STAGES).index(name) if name in LOAD_STAGES else 0
+		self.reached = max(self.reached, index)
+		label = LOAD_STAGES.get(name, name)
+		if (label != self.label):
+			self.label = label
+			self.progressed(5 + 45 * self.reached // len(LOAD_STAGES), label)
 
 	def run(self):
-		self.progressed(5, "Converting to wav...")
+		self.reached, self.label = 0, None
+		self.progressed(5, "Decoding audio...")
 
 		self.pre()
 
 		if (isinstance(self.fileName, Path)):
 			try:
-				self.data = load_audio_data(self.fileName, plp=self.plp)
+				# Analysis runs in the engine's process, the arrays come back mapped
+				self.data = self.engine.load(self.fileName, progress=self.stage, plp=self.plp, cache=self.cache, ffmpeg=self.ffmpeg, analysis_sr=self.analysis_sr)
 			except Exception as e:
 				self.progressed(-1, "Failed to transform audio data!")
 				self.finished()
@@ -113,9 +188,16 @@ class LoadWorker(ImageWorker):
 
 		if len(self.data) > 0:
 			# plotting the graph
-			self.plot.plot(self.data["pitch"], label="pitch", linewidth=.5)
-			self.plot.plot(self.data["energy"], label="energy", linewidth=.5)
+			lod = DecimatedPlot(self.plot)
+			for name in ("pitch", "energy"):
+				y = np.asarray(self.data[name])
+				lod.line(np.arange(len(y)), y, label=name, linewidth=.5)
 			self.plot.legend()
+			self.plot.set_xlim(0, max(1, len(self.data["energy"]) - 1))
+			self.plot.set_ylim(
+				min(np.min(self.data["pitch"]), np.min(self.data["energy"])),
+				max(np.max(self.data["pitch"]), np.max(self.data["energy"]))
+			)
 
 		self.post()
 
@@ -126,9 +208,10 @@ class LoadWorker(ImageWorker):
 class RenderWorker(ImageWorker):
 	done = None
 
-	def __init__(self, size, data, energy_mult, pitch_offset, overflow, heatmap, automode, amplitude_centering, center_offset):
+	def __init__(self, size, engine, data, energy_mult, pitch_offset, overflow, heatmap, automode, amplitude_centering, center_offset, simplify=None):
 		super().__init__()
 		self.w, self.h = size
+		self.engine = engine
 		self.data = data
 		self.energy_mult = energy_mult
 		self.pitch_offset = pitch_offset
@@ -137,70 +220,61 @@ class RenderWorker(ImageWorker):
 		self.automode = automode
 		self.amplitude_centering = amplitude_centering
 		self.center_offset = center_offset
+		self.simplify = simplify
 
-	def run(self):
+	def run(self, job):
 		# Calculate data in thread, do not touch GUI or Figures
+		self.progressed = job.progress
 		result = []
 
 		if len(self.data) > 0:
 			self.progressed(50, "Creating actions...")
 
-			# plotting the graph
+			# The engine's render pipeline recomputes only the stages whose
+			# parameters changed
+			params = (self.energy_mult, self.pitch_offset, self.overflow, self.amplitude_centering, self.center_offset)
 			try:
-				result = create_actions(
-					self.data, 
-					energy_multiplier=self.energy_mult,
-					pitch_range=self.pitch_offset,
-					overflow=self.overflow,
-					amplitude_centering=self.amplitude_centering,
-					center_offset=self.center_offset
-				)
-			except Exception as e:
-				print(e)
-				self.progressed(-1, "Failed to create actions!")
-				self.finished()
-				return
+				result, v, removed, avg_speed = self.engine.render(self.data, params, self.simplify)
+			except Stale:
+				raise Cancelled()
+			job.check()
 
 			# Prepare plotting data
-			X,Y = map(np.array, map(list, zip(*result)))
+			X, Y = result["at"], result["pos"]
 			
 			plot_data = {
 				"X": X,
 				"Y": Y,
-				"segments": None,
-				"colors": None,
-				"avg_speed": 0
+				"speeds": None,
+				"avg_speed": 0,
+				"removed": removed
 			}
 
-			# Vectorized speed calculation (needed for speed display even if heatmap is off)
-			dX = X[1:] - X[:-1]
-			dY = np.abs(Y[1:] - Y[:-1])
-			
-			# Avoid divide by zero
-			dX = np.maximum(dX, 1e-9) 
-			
-			v = dY / dX
-			avg_speed = np.mean(v)
+			# Needed for speed display even if heatmap is off
 			plot_data["avg_speed"] = avg_speed
 
+			# Colors are picked per drawn segment, after decimation
 			if (self.heatmap):
-				points = np.array([X, Y]).T.reshape(-1, 1, 2)
-				segments = np.concatenate([points[:-1], points[1:]], axis=1)
-
-				normalized_v = np.clip(v / 400.0, 0.0, 1.0)
-				
-				colors = HEATMAP(normalized_v)
-				
-				plot_data["segments"] = segments
-				plot_data["colors"] = colors
+				plot_data["speeds"] = v
 
 		else:
 			plot_data = None
 
 
 		self.progressed(100, "Done!")
-		self.done(result, plot_data, self.data.get("at", 0))
-		self.finished()
+		return result, plot_data, self.data.get("at", 0)
+
+def automap_job(job, model, data, tpi, target_speed, v2above, opt):
+	# The model is built here on the first run, so data it can't map (a file
+	# without beats) fails the job and is reported like any other error
+	if (model is None):
+		model = AutomapModel(data)
+
+	def progress(stage, iteration, value):
+		job.check()
+		job.progress(stage, iteration, value)
+
+	return autoval(model, tpi=tpi, target_speed=target_speed, v2above=v2above, opt=opt, progress=progress), model
 
 class MainWindow(tk.Tk):
 	def __init__(self, args):
@@ -272,6 +346,9 @@ class MainWindow(tk.Tk):
 		self.audioi_canvas.draw()
 		self.audioi_canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
 
+		self.audioi_toolbar = NavigationToolbar2Tk(self.audioi_canvas, self.audio_input, pack_toolbar=False)
+		self.audioi_toolbar.grid(row=1, column=0, sticky="ew", padx=5)
+
 		self.audio_output = tk.Canvas(audio_group, bg="white")
 		self.audio_output.grid(row=2, column=0, sticky="nsew", padx=5, pady=5)
 		self.audio_output.columnconfigure(0, weight=1)
@@ -281,6 +358,9 @@ class MainWindow(tk.Tk):
 		self.audioo_canvas.draw()
 		self.audioo_canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
 
+		self.audioo_toolbar = NavigationToolbar2Tk(self.audioo_canvas, self.audio_output, pack_toolbar=False)
+		self.audioo_toolbar.grid(row=1, column=0, sticky="ew", padx=5)
+
 		# Settings GroupBox
 		self.settings_group = ttk.LabelFrame(central_frame, text="Settings")
 		self.settings_group.grid(row=2, column=0, sticky="ew", padx=5, pady=5)
@@ -349,6 +429,10 @@ class MainWindow(tk.Tk):
 		self.map_check = ttk.Checkbutton(misc_group, text="Automap", variable=self.map_var)
 		self.map_check.grid(row=2, column=0, sticky="w")
 
+		self.simplify_var = tk.BooleanVar(value=False)
+		self.simplify_check = ttk.Checkbutton(misc_group, text="Simplify", variable=self.simplify_var)
+		self.simplify_check.grid(row=3, column=0, sticky="w")
+
 		self.automap_group = ttk.LabelFrame(options_group, text="Automap settings")
 		self.automap_group.grid(row=0, column=2, sticky="ew", padx=5, pady=5)
 		self.automap_group.columnconfigure(0, weight=1)
@@ -417,10 +501,22 @@ class MainWindow(tk.Tk):
 		self.fileName = None
 		self.data = {}
 		self.result = None
+		self.__lod_shown, self.__lod_total = 0, 0
+		self.cache = cache_from_args(args)
+		self.analysis_sr = args.analysis_sr
+		self.convert = args.convert
 
 		self.__loadworker = Thread()
-		self.__renderworker = Thread()
-		self.__waitloader = None
+		self.renderer = Scheduler("render")
+		self.automapper = Scheduler("automap")
+		self.automap_model = None
+		self.automap_results = {}
+		self.__poll_jobs()
+
+		# Analysis and rendering run in their own process, which compiles
+		# (or loads) the numba kernels while the user picks a file
+		self.engine = Engine()
+		self.engine.start()
 
 		self.about_button.bind("<Button-1>", lambda event: messagebox.showinfo("About", """Thanks to ncdxncdx for the original application!
 Thanks to Nodude for the Python port!
@@ -432,7 +528,7 @@ Thanks to you for using this software!""") )
 			self.disableUX()
 			self.progress_label["text"] = "FFMpeg is missing, please download it!"
 		elif (args.audio_path):
-			self.loadfile(args.audio_path)
+			self.loadfile(args.audio_path[0])
 		else:
 			self.LoadWorker()
 
@@ -476,15 +572,18 @@ Thanks to you for using this software!""") )
 		self.heatmap_var.set(cfg.get("heatmap", self.heatmap_var.get()))
 		self.plp_var.set(cfg.get("plp", self.plp_var.get()))
 		self.map_var.set(cfg.get("automap", self.map_var.get()))
+		self.simplify_var.set(cfg.get("simplify", self.simplify_var.get()))
 		# Save
 		self.heatmap_var.trace("w", lambda *args: cfg.save("heatmap", self.heatmap_var.get()))
 		self.plp_var.trace("w", lambda *args: cfg.save("plp", self.plp_var.get()))
 		self.map_var.trace("w", lambda *args: cfg.save("automap", self.map_var.get()))
+		self.simplify_var.trace("w", lambda *args: cfg.save("simplify", self.simplify_var.get()))
 
 		# Triggers
 		self.var_oor.trace("w", lambda *args: self.RenderWorker())
 
 		self.heatmap_var.trace("w", lambda *args: self.RenderWorker())
+		self.simplify_var.trace("w", lambda *args: self.RenderWorker())
 		self.plp_var.trace("w", lambda *args: self.LoadWorker(self.fileName))
 		self.map_var.trace("w", lambda *args: self.cmapPressed())
 
@@ -525,6 +624,10 @@ Thanks to you for using this software!""") )
 		self.LoadWorker(self.fileName)
 
 	def __load_done(self, data, img, init):
+		if (data is not self.data):
+			self.automapper.cancel()
+			self.automap_model = None
+			self.automap_results = {}
 		self.data = data
 		if (init):
 			self.automap()
@@ -556,9 +659,13 @@ Thanks to you for using this software!""") )
 				self.audio_input.winfo_width(),
 				self.audio_input.winfo_height()
 			),
+			self.engine,
 			fileName,
 			self.data,
-			self.plp_var.get()
+			self.plp_var.get(),
+			self.cache,
+			ffmpeg=self.convert,
+			analysis_sr=self.analysis_sr
 		)
 		thread = Thread(target=worker.run)
 
@@ -582,50 +689,52 @@ Thanks to you for using this software!""") )
 			# Should rely on canvas having a figure
 			return
 			
+		start = perf_counter()
 		ax = fig.gca()
 		ax.clear()
 		
 		if plot_data:
 			X, Y = plot_data["X"], plot_data["Y"]
-			if self.heatmap_var.get() and plot_data["segments"] is not None:
-				lc = LineCollection(plot_data["segments"], colors=plot_data["colors"], linewidths=.5)
-				ax.add_collection(lc)
-				ax.autoscale()
+			lod = DecimatedPlot(ax, self.__lod_refreshed)
+			if self.heatmap_var.get() and plot_data["speeds"] is not None:
+				lod.heat(X, Y, plot_data["speeds"], linewidths=.5)
 			else:
-				ax.plot(X, Y, linewidth=.5)
+				lod.line(X, Y, linewidth=.5)
 			
 			ax.set_ylim(0, 100)
-			if duration > 0:
-				ax.set_xlim(0, duration)
+			ax.set_xlim(0, duration if duration > 0 else max(X[-1] if len(X) > 0 else 0, 1))
 			
 			if "avg_speed" in plot_data:
 				self.meta_speed["text"] = f"Speed: {int(plot_data['avg_speed'])}"
 			
-			self.meta_actions["text"] = f"Actions: {len(X)}"
+			if plot_data["removed"] > 0:
+				self.meta_actions["text"] = f"Actions: {len(X)} ({plot_data['removed']} removed)"
+			else:
+				self.meta_actions["text"] = f"Actions: {len(X)}"
 		
 		self.audioo_canvas.draw()
+		latency = self.renderer.stats().get("latency_last", 0)
+		self.progress_label["text"] = f"Drawn {self.__lod_shown} of {self.__lod_total} points in {(perf_counter() - start) * 1000:.0f} ms, rendered in {latency * 1000:.0f} ms"
 
-	def __render_repeat_aux(self):
-		#TODO: While loop it without UI freeze
-		if (self.__renderworker.is_alive()):
-			self.after(10, self.__render_repeat_aux)
-			return
-
-		if (self.__waitloader != None):
-			self.__renderworker = self.__render_thread()
-			self.__waitloader = None
-
-			self.__renderworker.start()
+	def __lod_refreshed(self, shown, total, elapsed):
+		self.__lod_shown, self.__lod_total = shown, total
+		self.progress_label["text"] = f"Drawn {shown} of {total} points, decimated in {elapsed * 1000:.0f} ms"
 
-	def __render_repeat(self):
-		self.after(10, self.__render_repeat_aux)
+	def __poll_jobs(self):
+		try:
+			self.automapper.poll()
+			self.renderer.poll()
+		finally:
+			self.after(15, self.__poll_jobs)
 
-	def __render_thread(self) -> Thread:
+	def RenderWorker(self):
+		# Only the latest settings matter, older renders are dropped or cancelled
 		worker = RenderWorker(
 			(
 				self.audio_output.winfo_width(),
 				self.audio_output.winfo_height()
 			),
+			self.engine,
 			self.data,
 			self.energy_slider.get() / 10.0,
 			self.pitch_slider.get(),
@@ -634,21 +743,9 @@ Thanks to you for using this software!""") )
 			self.Automode(),
 			self.amplitude_centering_slider.get(),
 			self.center_offset_slider.get(),
+			self.simplify_options() if self.simplify_var.get() else None,
 		)
-		thread = Thread(target=worker.run)
-
-		worker.done = self.__render_done
-		worker.progressed = self.__load_prog
-		worker.finished = self.__render_repeat
-
-		return thread
-
-	def RenderWorker(self):
-		if not self.__renderworker.is_alive():
-			self.__renderworker = self.__render_thread()
-			self.__renderworker.start()
-		else:
-			self.__waitloader = True
+		self.renderer.submit(worker.run, done=self.__render_done, progressed=self.__load_prog)
 
 	def enableUX(self):
 		self.load_button["state"] = "normal"
@@ -658,10 +755,53 @@ Thanks to you for using this software!""") )
 		disableChildren(self.settings_group)
 		
 	def automap(self):
-		if (self.map_var.get() and len(self.data) > 0):
-			pitch, energy = autoval(self.data, tpi=self.center_offset_slider.get(), target_speed=self.speed_spinbox_var.get(), v2above=self.per_spinbox_var.get()/100.0, opt=self.Automode())
-			self.pitch_slider["value"] = int(pitch)
-			self.energy_slider["value"] = int(energy * 10.0)
+		# Returns True when the sliders will be set (and rendered) once the job finishes
+		if (not self.map_var.get() or len(self.data) == 0):
+			self.automapper.cancel()
+			return False
+
+		key = (
+			self.center_offset_slider.get(),
+			self.speed_spinbox_var.get(),
+			self.per_spinbox_var.get()/100.0,
+			self.Automode()
+		)
+		if (key in self.automap_results):
+			self.automapper.cancel()
+			self.__automap_done(key, self.automap_results[key])
+			return True
+
+		# Restarts the optimization if one is still running for older targets
+		self.automapper.submit(
+			automap_job, self.automap_model, self.data, *key,
+			done=lambda result, model: self.__automap_done(key, result, model),
+			progressed=self.__automap_prog
+		)
+		return True
+
+	def __automap_prog(self, stage, iteration=None, value=None):
+		# The scheduler reports a failed job as (-1, message)
+		if (stage == -1):
+			self.progress_label["text"] = f"Automapping {iteration}"
+			return
+		self.progress_label["text"] = f"Automapping {stage}: iteration {iteration}, error {value:.4f}"
+
+	def __automap_done(self, key, result, model=None):
+		if (model is not None):
+			self.automap_model = model
+		self.automap_results[key] = result
+		pitch, energy = result
+		self.pitch_slider["value"] = int(pitch)
+		self.energy_slider["value"] = int(energy * 10.0)
+		self.RenderWorker()
+
+	def simplify_options(self):
+		# No controls for these yet, they can be tuned in config.json
+		return {
+			"tolerance": cfg.get("simplify_tolerance", 2.0),
+			"min_interval": cfg.get("simplify_interval", 50) / 1000.0,
+			"max_speed": cfg.get("simplify_speed", 0),
+		}
 
 	def OOR(self):
 		if self.var_oor.get() == "crop":
@@ -685,11 +825,11 @@ Thanks to you for using this software!""") )
 			disableChildren(self.automap_group)
 	def cmapPressed(self):
 		self._cmapPressed()
-		self.automap()
-		self.RenderWorker()
+		if (not self.automap()):
+			self.RenderWorker()
 		
 	def bfunscriptPressed(self):
-		if (not self.result):
+		if (self.result is None or len(self.result) == 0):
 			return
 
 		initial_file = str(self.fileName.with_suffix(".funscript").name)
@@ -735,7 +875,10 @@ Thanks to you for using this software!""") )
 
 def ux(args):
 	app = MainWindow(args)
-	app.mainloop()
+	try:
+		app.mainloop()
+	finally:
+		app.engine.close()
 
 if __name__ == "__main__":
 	ux(cli_args().parse_args())
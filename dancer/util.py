@@ -1,6 +1,10 @@
+import os
 import argparse
+import tempfile
 import subprocess
 
+import numpy as np
+
 def ffmpeg_check():
 	try:
 		subprocess.check_call([
@@ -19,15 +23,55 @@ def ffmpeg_check():
 
 	return False
 
-def ffmpeg_conv(in_file, out_file):
-	subprocess.check_call([
+FFMPEG_SR = 48000
+
+def _ffmpeg_pcm_cmd(in_file, sr):
+	return [
 		"ffmpeg",
-		"-y",
-		"-i", in_file,
-		"-map", "0:a",
-		"-ar", "48000",
-		out_file
-	])
+		"-nostdin",
+		"-v", "error",
+		"-i", str(in_file),
+		"-map", "0:a:0",
+		"-ac", "1",
+		"-ar", str(sr),
+		"-f", "f32le",
+		"-"
+	]
+
+def ffmpeg_read(in_file, sr=FFMPEG_SR):
+	# Decode straight to mono float32 PCM over stdout, no intermediate file
+	proc = subprocess.run(_ffmpeg_pcm_cmd(in_file, sr), stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+
+	if (proc.returncode != 0):
+		raise RuntimeError(proc.stderr.decode(errors="replace").strip() or "ffmpeg failed")
+
+	return np.frombuffer(proc.stdout, dtype=np.float32), sr
+
+def ffmpeg_stream(in_file, sr=FFMPEG_SR, block_size=1 << 20):
+	# Like ffmpeg_read, but yields blocks of at most block_size samples.
+	# stderr goes to a file, a full stderr pipe nobody reads would block
+	# ffmpeg while we wait on stdout.
+	with tempfile.TemporaryFile() as err:
+		proc = subprocess.Popen(_ffmpeg_pcm_cmd(in_file, sr), stdout=subprocess.PIPE, stderr=err)
+		try:
+			while True:
+				raw = proc.stdout.read(block_size * 4)
+				if not raw:
+					break
+				# A short read may split a sample
+				if (len(raw) % 4):
+					raw += proc.stdout.read(4 - len(raw) % 4)
+				yield np.frombuffer(raw, dtype=np.float32)
+		except GeneratorExit:
+			proc.kill()
+			raise
+		finally:
+			proc.stdout.close()
+			code = proc.wait()
+
+		if (code != 0):
+			err.seek(0)
+			raise RuntimeError(err.read().decode(errors="replace").strip() or "ffmpeg failed")
 
 def cli_args():
 	parser = argparse.ArgumentParser(
@@ -38,15 +82,36 @@ def cli_args():
 
 	def irange(min,max):
 		return range(min, max+1)
-	parser.add_argument("audio_path", nargs='?', default=None, help="Path to input media")
+	parser.add_argument("audio_path", nargs='*', default=None, help="Path to input media, directories or globs")
 	parser.add_argument("--out_path", help="Path to export funscript")
 	parser.add_argument("--csv", help="Export as CSV instead of funscript", action="store_true")
 	parser.add_argument("-m", "--heatmap", help="Export heatmap", action="store_true")
-	parser.add_argument("-c", "--convert", help="Automatically use ffmpeg to convert input media", action="store_true")
+	parser.add_argument("--gzip", help="Gzip the exported funscript/CSV (also implied by an --out_path ending in .gz)", action="store_true")
+	parser.add_argument("--drop_collinear", help="Leave out points lying exactly on the line between their neighbours", action="store_true")
+	parser.add_argument("--sweep", action="append", default=[], metavar="SPEC", help="Write one script per variant from a single analysis: name=v1,v2,... (repeatable, the grid is their product) or a .json grid/list. Sweepable: energy, pitch, overflow, amplitude_centering, center_offset")
+	parser.add_argument("--sweep_jobs", type=int, default=1, help="Worker processes for evaluating sweep variants")
+	parser.add_argument("--simplify", type=float, default=0, metavar="TOLERANCE", help="Drop points that stay within this many position units of the simplified line (Ramer-Douglas-Peucker)")
+	parser.add_argument("--min_interval", type=int, default=0, metavar="MS", help="Minimum time between actions")
+	parser.add_argument("--max_speed", type=int, default=0, metavar="UNITS/S", help="Clamp the speed of every stroke")
+	parser.add_argument("--csv_precision", type=int, default=None, metavar="DIGITS", help="Decimals of the CSV timestamps (default: full precision)")
+	parser.add_argument("-c", "--convert", help="Decode input media through ffmpeg", action="store_true")
 	parser.add_argument("-a", "--automap", help="Automatically find suitable pitch and energy values", action="store_true")
 	parser.add_argument("-y", "--yes", help="Overwrite funscript", action="store_true")
 	parser.add_argument("--no_plp", help="Disable PLP", action="store_true")
 	parser.add_argument("--cli", help="Use commandline", action="store_true")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Number of worker processes when processing several files")
+	parser.add_argument("--pitch_method", default="piptrack", choices=["piptrack", "centroid"], help="Pitch feature, centroid is cheaper and shares one STFT with RMS")
+	parser.add_argument("--analysis_sr", type=int, default=None, metavar="HZ", help="Resample to this rate before analysis, frame timing is kept. Rates dividing the source rate (22050 for 44.1 kHz, 24000 for ffmpeg) keep it exact")
+	parser.add_argument("--n_jobs", type=int, default=1, help="Processes computing the frame features (RMS, pitch, onsets) of one file, beats are still tracked once")
+	parser.add_argument("--max_memory", type=int, default=None, metavar="MB", help="Stream the analysis in blocks sized for this working-set budget")
+	parser.add_argument("--profile", nargs="?", const="table", default=None, choices=["table", "json"], help="Print the time spent in every stage, as a table or as JSON")
+	parser.add_argument("--profile_memory", help="Also record the tracemalloc peak of every stage (slows Python-heavy stages)", action="store_true")
+	parser.add_argument("--numba_cache_dir", default=None, metavar="DIR", help="Where numba keeps compiled analysis kernels (default: NUMBA_CACHE_DIR, or the cache dir for the exe)")
+	parser.add_argument("--warm_up", help="Compile the analysis kernels into the numba cache and exit", action="store_true")
+	parser.add_argument("--no_cache", help="Bypass the analysis cache", action="store_true")
+	parser.add_argument("--clear_cache", help="Empty the analysis cache", action="store_true")
+	parser.add_argument("--cache_dir", default=None, help="Analysis cache directory (default: user cache dir)")
+	parser.add_argument("--cache_size", type=int, default=1024, metavar="MB", help="Analysis cache size limit")
 	parser.add_argument("--auto_pitch", type=int, default=20, metavar="[0-100]", choices=irange(0,100), help="Where you want the actions to generally lie in percent")
 	parser.add_argument("--auto_speed", type=int, default=250, metavar="[0-400]", choices=irange(0,400), help="The target action speed in units/s")
 	parser.add_argument("--auto_per", type=int, default=65, metavar="[0-100]", choices=irange(0,100), help="The target percent of actions that should have a speed above the specified speed")
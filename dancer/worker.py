@@ -0,0 +1,203 @@
+import os
+import mmap
+import uuid
+import shutil
+import tempfile
+import threading
+import multiprocessing as mp
+from pathlib import Path
+
+import numpy as np
+
+class Stale(Exception):
+	# A render for data that has been replaced by a newer load
+	pass
+
+def export_arrays(data, directory):
+	# Arrays travel as files the other process maps instead of as pickled
+	# copies. Arrays already mapped from a file (analysis cache hits) are
+	# passed by location, the rest are written once to directory.
+	out = {}
+	for k, v in data.items():
+		if not isinstance(v, np.ndarray) or v.size == 0:
+			out[k] = ("value", v)
+		elif isinstance(v, np.memmap) and isinstance(v.base, mmap.mmap) and (v.flags.c_contiguous or v.flags.f_contiguous):
+			out[k] = ("map", v.filename, v.offset, v.dtype, v.shape, "C" if v.flags.c_contiguous else "F")
+		else:
+			path = Path(directory, f"{uuid.uuid4().hex}.npy")
+			np.save(path, v)
+			out[k] = ("npy", str(path))
+	return out
+
+def import_arrays(desc):
+	# Read-only maps of what export_arrays sent, and the files that were
+	# written for the hand-off (those can go once they are mapped)
+	data, written = {}, []
+	for k, (kind, *args) in desc.items():
+		if kind == "value":
+			data[k] = args[0]
+		elif kind == "map":
+			filename, offset, dtype, shape, order = args
+			data[k] = np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+		else:
+			data[k] = np.load(args[0], mmap_mode="r")
+			written.append(args[0])
+	return data, written
+
+def _serve(conn, directory, warm):
+	# The worker process: one request at a time, ("progress", ...) messages
+	# while it runs and then ("done", result) or ("error", message)
+	from .libfun import RenderPipeline, load_audio_data
+	from .profiling import Profiler
+
+	if (warm):
+		from .jit import warm_up
+		warm_up()
+
+	pipeline = None
+	while True:
+		try:
+			kind, args = conn.recv()
+		except (EOFError, OSError):
+			return
+		if (kind == "quit"):
+			return
+
+		try:
+			if (kind == "load"):
+				profiler = Profiler(on_stage=lambda name: conn.send(("progress", name)))
+				data = load_audio_data(**args, profiler=profiler)
+				pipeline = RenderPipeline(data)
+				conn.send(("done", export_arrays(data, directory)))
+			elif (kind == "render"):
+				params, simplify = args
+				result = pipeline.simplified(*params, simplify=simplify)
+				removed = len(pipeline.actions(*params)) - len(result)
+				speeds = pipeline.speeds(*params, simplify=simplify)
+				arrays = export_arrays({"result": result, "speeds": speeds}, directory)
+				conn.send(("done", (arrays, removed, float(np.mean(speeds)) if len(speeds) > 0 else 0.0)))
+			else:
+				raise ValueError(f"Unknown request {kind!r}")
+		except Exception as e:
+			conn.send(("error", f"{type(e).__name__}: {e}"))
+
+class Engine:
+	# Runs analysis and rendering in a child process so that numpy and
+	# librosa never hold the GIL of the Tk process. Requests are serialized,
+	# callers block on the pipe (which releases the GIL) and get progress
+	# callbacks on their own thread. The child holds the render pipeline of
+	# the last load, so renders only send parameters. A child that died is
+	# replaced by the next request and given the last load again.
+	def __init__(self, warm_up=True):
+		self.warm_up = warm_up
+		self.directory = tempfile.mkdtemp(prefix="pythondancer-")
+		self.loaded = None
+		self._load_args = None
+		self._lock = threading.Lock()
+		self._process = None
+		self._conn = None
+		self._written = []
+
+	def start(self):
+		with self._lock:
+			self._ensure()
+
+	def _ensure(self, restore=True):
+		if (self._process is not None and self._process.is_alive()):
+			return
+		self._conn, child = mp.Pipe()
+		self._process = mp.Process(target=_serve, args=(child, self.directory, self.warm_up), name="dancer-engine", daemon=True)
+		self._process.start()
+		child.close()
+
+		if (not restore or self._load_args is None):
+			self.loaded = None
+			self._load_args = None
+			return
+
+		# A new process holds no analysis, rebuild the render pipeline of the
+		# data callers still hold. Its arrays are already mapped here.
+		try:
+			desc = self._exchange("load", self._load_args)
+		except RuntimeError as e:
+			self.loaded = None
+			self._load_args = None
+			raise RuntimeError(f"Analysis process restarted, reload the file ({e})")
+		self._cleanup([args[0] for kind, *args in desc.values() if kind == "npy"])
+
+	def _request(self, kind, args, progress=None, restore=True):
+		self._ensure(restore)
+		return self._exchange(kind, args, progress)
+
+	def _exchange(self, kind, args, progress=None):
+		try:
+			self._conn.send((kind, args))
+		except OSError:
+			self._process = None
+			raise RuntimeError("Analysis process died")
+		while True:
+			try:
+				message = self._conn.recv()
+			except (EOFError, OSError):
+				self._process = None
+				raise RuntimeError("Analysis process died")
+
+			if (message[0] == "progress"):
+				if (progress):
+					progress(*message[1:])
+			elif (message[0] == "error"):
+				raise RuntimeError(message[1])
+			else:
+				return message[1]
+
+	def _cleanup(self, written):
+		# Mapped files can be unlinked right away on POSIX, Windows keeps
+		# them until every map is gone, so failures are retried later
+		pending = []
+		for path in self._written + written:
+			try:
+				os.unlink(path)
+			except FileNotFoundError:
+				pass
+			except OSError:
+				pending.append(path)
+		self._written = pending
+
+	def load(self, audio_file, progress=None, **options):
+		# Returns the analysis as read-only maps, progress(stage) per stage
+		with self._lock:
+			args = dict(options, audio_file=audio_file)
+			# A restarted process would only reload what this replaces
+			desc = self._request("load", args, progress, restore=False)
+			data, written = import_arrays(desc)
+			self._cleanup(written)
+			self.loaded = data
+			self._load_args = args
+			return data
+
+	def render(self, data, params, simplify=None):
+		# (actions, speeds, removed, mean speed) for data, which has to be
+		# the dict the last load returned
+		with self._lock:
+			if (data is not self.loaded):
+				raise Stale()
+			arrays, removed, avg_speed = self._request("render", (params, simplify))
+			arrays, written = import_arrays(arrays)
+			self._cleanup(written)
+			return arrays["result"], arrays["speeds"], removed, avg_speed
+
+	def close(self):
+		with self._lock:
+			if (self._process is not None and self._process.is_alive()):
+				try:
+					self._conn.send(("quit", None))
+				except OSError:
+					pass
+				self._process.join(timeout=2)
+				if (self._process.is_alive()):
+					self._process.terminate()
+			self._process = None
+			self.loaded = None
+			self._load_args = None
+			self._cleanup([])
+			shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,2 +1,6 @@
 from PyInstaller.utils.hooks import collect_data_files
-datas = collect_data_files("librosa")
\ No newline at end of file
+datas = collect_data_files("librosa")
+
+# numba only caches kernels whose source file exists, keep librosa's .py
+# files next to the bytecode so the cache in NUMBA_CACHE_DIR can be used
+module_collection_mode = "pyz+py"
@@ -29,20 +29,18 @@ a = Analysis(
 )
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
+# One-dir, a one-file exe unpacks to a new directory every launch and
+# numba can't reuse kernels cached for the previous one
 exe = EXE(
 	pyz,
 	a.scripts,
-	a.binaries,
-	a.zipfiles,
-	a.datas,
 	[],
+	exclude_binaries=True,
 	name='PythonDancer.exe',
 	debug=False,
 	bootloader_ignore_signals=False,
 	strip=False,
 	upx=True,
-	upx_exclude=[],
-	runtime_tmpdir=None,
 	console=True,
 	disable_windowed_traceback=False,
 	argv_emulation=False,
@@ -50,3 +48,14 @@ exe = EXE(
 	codesign_identity=None,
 	entitlements_file=None,
 )
+
+coll = COLLECT(
+	exe,
+	a.binaries,
+	a.zipfiles,
+	a.datas,
+	strip=False,
+	upx=True,
+	upx_exclude=[],
+	name='PythonDancer',
+)
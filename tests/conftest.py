@@ -0,0 +1,19 @@
+import wave
+
+import numpy as np
+import pytest
+
+def write_clicks(path, seconds=10, sr=22050, bpm=120):
+	# A tone with a click on every beat, mono 16 bit
+	y = 0.1 * np.sin(2 * np.pi * 220 * np.arange(int(seconds * sr)) / sr)
+	y[::int(sr * 60 / bpm)] = 0.9
+	with wave.open(str(path), "wb") as w:
+		w.setnchannels(1)
+		w.setsampwidth(2)
+		w.setframerate(sr)
+		w.writeframes((y * 32767).astype("<i2").tobytes())
+	return path
+
+@pytest.fixture
+def click_track(tmp_path):
+	return write_clicks(tmp_path / "clicks.wav")
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from dancer.libfun import create_actions, create_actions_array, peaks, _prepare_actions
+
+def create_actions_loop(data, energy_multiplier=1, pitch_range=100, overflow=0, amplitude_centering=0, center_offset=0):
+	# The original per-beat implementation, kept as the parity reference
+	data = _prepare_actions(data, energy_multiplier, pitch_range, amplitude_centering, center_offset)
+	last_at = 0
+	last_pos = 50
+
+	actions = []
+	for unoffset_pos, at, offset in zip(data["energy_to_pos"], data["beats"], data["offsets"]):
+		intermediate_at = (at + last_at) / 2
+		pos = unoffset_pos + offset
+		actions += peaks[int(overflow)](pos, intermediate_at, last_pos, last_at)
+		last_at = intermediate_at
+		last_pos = pos
+
+		pos = (unoffset_pos * -1) + offset
+		actions += peaks[int(overflow)](pos, at, last_pos, last_at)
+		last_at = at
+		last_pos = pos
+
+	return actions
+
+PARAMS = [
+	dict(energy_multiplier=1, pitch_range=100),
+	dict(energy_multiplier=4, pitch_range=150, amplitude_centering=30, center_offset=-20),
+	dict(energy_multiplier=10, pitch_range=-200, amplitude_centering=-100, center_offset=100),
+	dict(energy_multiplier=0, pitch_range=50),
+]
+
+def beat_data(n=500, bpm=128, seed=0):
+	rng = np.random.default_rng(seed)
+	beats = np.cumsum(rng.uniform(0.7, 1.3, n) * 60.0 / bpm)
+	return {
+		"at": float(beats[-1]),
+		"beats": beats,
+		"pitch": np.log10(rng.uniform(1, 1000, n)).astype(np.float32),
+		"energy": rng.uniform(0.01, 10, n).astype(np.float32),
+	}
+
+@pytest.mark.parametrize("overflow", [0, 1, 2])
+@pytest.mark.parametrize("params", PARAMS)
+def test_vectorized_actions_match_loop(overflow, params):
+	data = beat_data()
+	expected = np.array(create_actions_loop(data, overflow=overflow, **params))
+	actual = create_actions_array(data, overflow=overflow, **params)
+	np.testing.assert_array_equal(actual["at"], expected[:, 0])
+	np.testing.assert_array_equal(actual["pos"], expected[:, 1])
+	assert create_actions(data, overflow=overflow, **params) == create_actions_loop(data, overflow=overflow, **params)
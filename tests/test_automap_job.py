@@ -0,0 +1,48 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from dancer.jobs import Scheduler
+from dancer.ui import MainWindow, automap_job
+
+def poll_until(scheduler, cond, timeout=10):
+	end = time.monotonic() + timeout
+	while not cond():
+		if time.monotonic() > end:
+			raise AssertionError(f"Timed out, stats {scheduler.stats()}")
+		scheduler.poll()
+		time.sleep(0.01)
+
+def test_failing_automap_reports_through_progress():
+	# A file without beats has no per-beat features, building the model fails
+	data = {"beats": np.zeros(0), "pitch": np.zeros(0), "energy": np.zeros(0), "at": 0.0}
+	window = SimpleNamespace(progress_label={})
+	done = []
+
+	scheduler = Scheduler("automap")
+	scheduler.submit(
+		automap_job, None, data, 20, 250, 0.65, 2,
+		done=lambda *result: done.append(result),
+		progressed=lambda *args: MainWindow._MainWindow__automap_prog(window, *args)
+	)
+	poll_until(scheduler, lambda: scheduler.counts["failed"] > 0)
+
+	assert done == []
+	assert scheduler.counts["callback_errors"] == 0
+	assert window.progress_label["text"].startswith("Automapping Failed: ")
+
+def test_automap_returns_model_for_reuse():
+	rng = np.random.default_rng(0)
+	data = {"beats": np.arange(1, 65) * 0.5, "pitch": rng.random(64), "energy": rng.random(64), "at": 33.0}
+	done = []
+
+	scheduler = Scheduler("automap")
+	scheduler.submit(automap_job, None, data, 20, 250, 0.65, 2, done=lambda *result: done.append(result))
+	poll_until(scheduler, lambda: done)
+
+	(pitch, energy), model = done[0]
+	scheduler.submit(automap_job, model, data, 20, 250, 0.65, 2, done=lambda *result: done.append(result))
+	poll_until(scheduler, lambda: len(done) > 1)
+	assert done[1][0] == (pitch, energy)
+	assert done[1][1] is model
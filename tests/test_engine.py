@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from dancer.worker import Engine, Stale
+
+PARAMS = (2.5, 80, 1, 0, 0)
+
+@pytest.fixture
+def engine():
+	engine = Engine(warm_up=False)
+	engine.start()
+	yield engine
+	engine.close()
+
+def kill(engine):
+	engine._process.kill()
+	engine._process.join()
+
+def test_render_after_child_killed(engine, click_track):
+	data = engine.load(click_track)
+	actions, speeds, removed, _ = engine.render(data, PARAMS)
+	first = engine._process.pid
+
+	kill(engine)
+	again, again_speeds, again_removed, _ = engine.render(data, PARAMS)
+	assert engine._process.pid != first
+	assert engine.loaded is data
+	assert np.array_equal(again, actions) and np.array_equal(again_speeds, speeds) and again_removed == removed
+
+	# Later renders keep going to the new process
+	assert len(engine.render(data, (5.0, 100, 0, 0, 0))[0]) > 0
+
+def test_restart_without_the_file_asks_for_a_reload(engine, click_track):
+	data = engine.load(click_track)
+	click_track.unlink()
+
+	kill(engine)
+	with pytest.raises(RuntimeError, match="reload"):
+		engine.render(data, PARAMS)
+	with pytest.raises(Stale):
+		engine.render(data, PARAMS)
@@ -0,0 +1,138 @@
+import gzip
+import io
+import json
+
+import numpy as np
+import pytest
+
+from dancer.libfun import create_actions, create_actions_array
+from dancer.export import collinear_mask, dump_csv, dump_funscript, load_funscript, open_output, quantize
+
+def dump_csv_loop(f, data):
+	# The original writers, kept for parity
+	for at, pos in data:
+		f.write(f"{at*1000},{round(pos)}\n")
+
+def dump_funscript_loop(f, data):
+	return json.dump({
+		"actions": [{"at": int(at*1000), "pos": round(pos)} for at,pos in data],
+		"inverted": False,
+		"metadata": {
+			"creator": "PythonDancer",
+			"description": "",
+			"duration": int(data[-1][0]),
+			"license": "None",
+			"notes": "",
+			"performers": [],
+			"script_url": "",
+			"tags": [],
+			"title": "",
+			"type": "basic",
+			"video_url": "",
+		},
+		"range": 100,
+		"version": "1.0",
+	}, f)
+
+def written(fun, *args, **kwargs):
+	f = io.StringIO()
+	fun(f, *args, **kwargs)
+	return f.getvalue()
+
+def beat_data(n=400, seed=0):
+	rng = np.random.default_rng(seed)
+	beats = np.cumsum(rng.uniform(0.3, 0.6, n))
+	return {
+		"at": float(beats[-1]),
+		"beats": beats,
+		"pitch": np.log10(rng.uniform(1, 1000, n)).astype(np.float32),
+		"energy": rng.uniform(0.01, 10, n).astype(np.float32),
+	}
+
+@pytest.fixture(params=[0, 1, 2], ids=["crop", "bounce", "fold"])
+def actions(request):
+	data = beat_data()
+	params = dict(energy_multiplier=2.5, pitch_range=80, overflow=request.param)
+	return create_actions(data, **params), create_actions_array(data, **params)
+
+def test_funscript_matches_baseline_writer(actions):
+	listed, array = actions
+	old = json.loads(written(dump_funscript_loop, listed))
+	for new in (written(dump_funscript, listed), written(dump_funscript, iter(listed)), written(dump_funscript, array)):
+		new = json.loads(new)
+		# The duration is now in ms like at, the rest is unchanged
+		assert new["metadata"]["duration"] == new["actions"][-1]["at"]
+		new["metadata"]["duration"] = old["metadata"]["duration"]
+		assert new == old
+
+	expected = written(dump_funscript_loop, listed)
+	text = written(dump_funscript, array).replace(f'"duration": {old["actions"][-1]["at"]}', f'"duration": {old["metadata"]["duration"]}')
+	assert text == expected
+
+@pytest.mark.parametrize("suffix", [".funscript", ".funscript.gz"])
+def test_funscript_round_trip(actions, tmp_path, suffix):
+	_, array = actions
+	path = tmp_path / f"out{suffix}"
+	with open_output(path) as f:
+		dump_funscript(f, array)
+
+	opener = gzip.open if suffix.endswith(".gz") else open
+	with opener(path, "rt", encoding="utf8") as f:
+		assert f.read() == written(dump_funscript, array)
+	with opener(path, "rt", encoding="utf8") as f:
+		loaded = load_funscript(f)
+
+	at, pos = quantize(array["at"], array["pos"])
+	np.testing.assert_array_equal(np.rint(loaded["at"] * 1000), at)
+	np.testing.assert_array_equal(loaded["pos"], pos)
+
+def test_collinear_mask():
+	at = np.array([0, 100, 200, 300, 300, 400, 500])
+	pos = np.array([0, 10, 20, 50, 60, 60, 60])
+	np.testing.assert_array_equal(collinear_mask(at, pos), [True, False, True, True, True, False, True])
+	np.testing.assert_array_equal(collinear_mask(at[:2], pos[:2]), [True, True])
+
+def zigzag():
+	# Strokes sampled every 100 ms, most points lie on a straight line
+	from dancer.libfun import ACTION_DTYPE
+	array = np.empty(200, dtype=ACTION_DTYPE)
+	array["at"] = np.arange(200) * 0.1
+	array["pos"] = 100 - np.abs(np.arange(200) % 20 * 10 - 100)
+	return array
+
+def test_dropping_collinear_points_keeps_the_motion(actions):
+	# A player interpolating the kept points lands on every dropped one
+	for array in (actions[1], zigzag()):
+		check_dropped(array)
+
+def check_dropped(array):
+	at, pos = quantize(array["at"], array["pos"])
+	kept = json.loads(written(dump_funscript, array, drop_collinear=True))["actions"]
+	k_at = np.array([a["at"] for a in kept])
+	k_pos = np.array([a["pos"] for a in kept])
+
+	dropped = ~collinear_mask(at, pos)
+	assert len(kept) == len(at) - dropped.sum()
+	np.testing.assert_array_equal(np.interp(at[dropped], k_at, k_pos), pos[dropped])
+
+def test_csv_matches_baseline_writer(actions):
+	listed, array = actions
+	expected = written(dump_csv_loop, listed)
+	assert written(dump_csv, listed) == expected
+	assert written(dump_csv, array) == expected
+
+@pytest.mark.parametrize("precision", [0, 1, 3])
+def test_csv_precision(actions, precision):
+	listed, array = actions
+	baseline = [line.split(",") for line in written(dump_csv_loop, listed).splitlines()]
+	lines = [line.split(",") for line in written(dump_csv, array, precision=precision).splitlines()]
+	assert [p for _, p in lines] == [p for _, p in baseline]
+	for (at, _), (expected, _) in zip(lines, baseline):
+		assert ("." in at) == (precision > 0)
+		if precision > 0:
+			assert len(at.split(".")[1]) == precision
+		assert float(at) == pytest.approx(float(expected), abs=0.5 * 10 ** -precision)
+
+def test_empty_funscript():
+	empty = json.loads(written(dump_funscript, []))
+	assert empty["actions"] == [] and empty["metadata"]["duration"] == 0
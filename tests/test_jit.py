@@ -0,0 +1,39 @@
+import hashlib
+import os
+import sys
+
+from dancer.jit import one_file_build, prune_numba_cache
+
+def kernel_dir(cache, source):
+	# Named the way numba names a cache subdirectory
+	source = os.path.abspath(source)
+	path = cache / f"{os.path.basename(source)}_{hashlib.sha1(source.encode()).hexdigest()}"
+	path.mkdir(parents=True)
+	(path / "kernel.nbi").touch()
+	return path
+
+def test_prune_keeps_kernels_of_the_current_build(tmp_path):
+	root = tmp_path / "app"
+	(root / "librosa" / "core").mkdir(parents=True)
+	cache = tmp_path / "cache"
+	live = [kernel_dir(cache, root / "librosa"), kernel_dir(cache, root / "librosa" / "core")]
+	stale = [kernel_dir(cache, tmp_path / "_MEI1234" / "librosa" / "core"), kernel_dir(cache, tmp_path / "old" / "librosa")]
+	(cache / "notes_1").mkdir()
+
+	assert prune_numba_cache(cache, root) == len(stale)
+	assert all(path.exists() for path in live)
+	assert not any(path.exists() for path in stale)
+	assert (cache / "notes_1").exists()
+
+def test_prune_without_cache(tmp_path):
+	assert prune_numba_cache(tmp_path / "missing", tmp_path) == 0
+
+def test_one_file_build(tmp_path, monkeypatch):
+	monkeypatch.delattr(sys, "_MEIPASS", raising=False)
+	assert not one_file_build()
+
+	app = tmp_path / "PythonDancer"
+	monkeypatch.setattr(sys, "executable", str(app / "PythonDancer.exe"))
+	for root, one_file in ((app, False), (app / "_internal", False), (tmp_path / "_MEI1234", True)):
+		monkeypatch.setattr(sys, "_MEIPASS", str(root), raising=False)
+		assert one_file_build() == one_file
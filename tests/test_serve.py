@@ -0,0 +1,55 @@
+import json
+from http import HTTPStatus
+
+import pytest
+
+from dancer.serve import ServeError, parse_request
+from dancer.util import cli_args
+
+def parse(path, **fields):
+	return parse_request(json.dumps(dict(path=str(path), **fields)).encode(), cli_args().parse_args([]))
+
+def test_valid_fields_are_applied(tmp_path):
+	path = tmp_path / "a.wav"
+	path.touch()
+	_, args, timeout = parse(path, energy=12.5, overflow=2, automap=True, csv_precision=0, min_interval=0, analysis_sr=None, pitch_method="centroid", timeout=5)
+	assert (args.energy, args.overflow, args.automap, args.csv_precision, args.pitch_method) == (12.5, 2, True, 0, "centroid")
+	assert args.analysis_sr is None and timeout == 5
+
+@pytest.mark.parametrize("name, value", [
+	("automap", "false"),
+	("automap", 0),
+	("csv", 1),
+	("overflow", 3),
+	("overflow", -1),
+	("overflow", 1.5),
+	("overflow", True),
+	("energy", 101),
+	("energy", "10"),
+	("pitch", -201),
+	("energy", None),
+	("auto_mod", 0),
+	("auto_speed", 0),
+	("auto_speed", -5),
+	("min_interval", -1),
+	("max_speed", -1),
+	("csv_precision", -1),
+	("simplify", -0.5),
+	("analysis_sr", 0),
+	("max_memory", -1),
+	("pitch_method", "yin"),
+	("no_plp", "yes"),
+])
+def test_invalid_fields_are_rejected(tmp_path, name, value):
+	path = tmp_path / "a.wav"
+	path.touch()
+	with pytest.raises(ServeError) as e:
+		parse(path, **{name: value})
+	assert e.value.status == HTTPStatus.BAD_REQUEST
+
+def test_non_finite_numbers_are_rejected(tmp_path):
+	path = tmp_path / "a.wav"
+	path.touch()
+	with pytest.raises(ServeError) as e:
+		parse_request(f'{{"path": "{path}", "energy": NaN}}'.encode(), cli_args().parse_args([]))
+	assert e.value.status == HTTPStatus.BAD_REQUEST
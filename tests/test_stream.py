@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from dancer.libfun import AnalysisPipeline, decode_audio, load_audio_data
+
+# Streamed frame features match the full-file ones up to float rounding
+RTOL, ATOL = 1e-5, 1e-7
+
+def assert_close(actual, expected):
+	np.testing.assert_allclose(actual, expected, rtol=RTOL, atol=ATOL)
+
+@pytest.mark.parametrize("block_frames", [16, 100, 314])
+@pytest.mark.parametrize("analysis_sr", [None, 11025])
+def test_streamed_analysis_matches_full(click_track, block_frames, analysis_sr):
+	full = load_audio_data(click_track, analysis_sr=analysis_sr)
+	streamed = load_audio_data(click_track, block_frames=block_frames, analysis_sr=analysis_sr)
+
+	np.testing.assert_array_equal(streamed["beats"], full["beats"])
+	assert streamed["at"] == pytest.approx(full["at"])
+	for k in ("frame_rms", "frame_pitch", "energy", "pitch"):
+		assert_close(streamed[k], full[k])
+
+@pytest.mark.parametrize("block_frames", [16, 100, 314])
+def test_streamed_onset_matches_full(click_track, block_frames):
+	# run_stream keeps the log-mel spectrogram of every block for the onset
+	# envelope, it has to line up with the full-file one
+	y, sr = decode_audio(click_track)
+	pipeline = AnalysisPipeline(sr)
+	expected = pipeline.log_mel(pipeline.spectrum(y))
+
+	n_frames = 1 + len(y) // pipeline.hop_length
+	bounds = list(range(0, n_frames, block_frames)) + [n_frames]
+	actual = np.concatenate([pipeline.frame_range(y, 0, k0, k1)[0] for k0, k1 in zip(bounds[:-1], bounds[1:])], axis=-1)
+	assert_close(actual, expected)
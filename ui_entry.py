@@ -1,4 +1,8 @@
+from multiprocessing import freeze_support
+
 from dancer import main
 
 if __name__ == "__main__":
+    # The frozen exe starts the analysis process (and batch workers) from itself
+    freeze_support()
     main()